@@ -0,0 +1,179 @@
+import os
+import sys
+import time
+import threading
+
+# Rough memory footprint of one render worker: interpreter plus pyrender/OSMesa
+BASE_WORKER_MB = 400
+# Peak worker memory per MB of model file (float64 mesh, caches, unmerged GPU copy)
+MODEL_MEMORY_FACTOR = 15
+# Fraction of available memory the pool may plan to use
+MEMORY_BUDGET = 0.8
+# Throughput gain (fraction) below which adding workers is considered flat
+MIN_GAIN = 0.05
+# Worker count value that enables autotuning
+AUTO = "auto"
+
+def memory_info_mb():
+    """Return (available MB, total MB); either may be None when unknown"""
+    if sys.platform.startswith("linux"):
+        try:
+            fields = {}
+            with open("/proc/meminfo") as f:
+                for line in f:
+                    name, value = line.split(":", 1)
+                    fields[name] = int(value.split()[0]) / 1024
+            return fields.get("MemAvailable"), fields.get("MemTotal")
+        except (OSError, ValueError):
+            pass
+    if sys.platform == "win32":
+        import ctypes
+
+        class MEMORYSTATUSEX(ctypes.Structure):
+            _fields_ = [("dwLength", ctypes.c_ulong), ("dwMemoryLoad", ctypes.c_ulong),
+                        ("ullTotalPhys", ctypes.c_ulonglong), ("ullAvailPhys", ctypes.c_ulonglong),
+                        ("ullTotalPageFile", ctypes.c_ulonglong), ("ullAvailPageFile", ctypes.c_ulonglong),
+                        ("ullTotalVirtual", ctypes.c_ulonglong), ("ullAvailVirtual", ctypes.c_ulonglong),
+                        ("ullAvailExtendedVirtual", ctypes.c_ulonglong)]
+
+        status = MEMORYSTATUSEX()
+        status.dwLength = ctypes.sizeof(MEMORYSTATUSEX)
+        if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+            return status.ullAvailPhys / (1024 * 1024), status.ullTotalPhys / (1024 * 1024)
+        return None, None
+    try:
+        page = os.sysconf("SC_PAGE_SIZE")
+        available = os.sysconf("SC_AVPHYS_PAGES") * page / (1024 * 1024)
+        total = os.sysconf("SC_PHYS_PAGES") * page / (1024 * 1024)
+        return available, total
+    except (ValueError, OSError, AttributeError):
+        return None, None
+
+def estimate_worker_mb(file_sizes=None):
+    """Estimate peak memory of one worker from the largest model to render"""
+    largest_mb = max(file_sizes) / (1024 * 1024) if file_sizes else 0
+    return BASE_WORKER_MB + MODEL_MEMORY_FACTOR * largest_mb
+
+def initial_worker_count(file_sizes=None):
+    """Start from the CPU count, capped by how many workers fit in available memory"""
+    cpus = os.cpu_count() or 1
+    available, _ = memory_info_mb()
+    if available is None:
+        return cpus
+    fit = int(available * MEMORY_BUDGET / estimate_worker_mb(file_sizes))
+    return max(1, min(cpus, fit))
+
+def parse_worker_count(value, default=4):
+    """Return AUTO or a positive worker count from a command line or GUI value"""
+    if str(value).strip().lower() == AUTO:
+        return AUTO
+    try:
+        return max(1, int(value))
+    except (TypeError, ValueError):
+        return default
+
+class AutoTuner:
+    """
+    Adjusts a RenderPool's size while it runs
+
+    Every busy interval the tuner measures finished models per second (a
+    batch task counts all its models). It adds workers while each step raises
+    throughput by at least MIN_GAIN, settles on the best size once throughput
+    flattens, and removes workers whenever available memory falls below the
+    reserve. Once memory recovers by a worker's worth it starts climbing again.
+    """
+
+    def __init__(self, pool, min_workers=1, max_workers=None, interval=15.0, reserve_mb=None):
+        self.pool = pool
+        self.min_workers = min_workers
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.interval = interval
+        _, total = memory_info_mb()
+        self.reserve_mb = reserve_mb if reserve_mb is not None else max(1024, (total or 0) * 0.1)
+        self.best = (pool.max_workers, 0.0)
+        self.previous_rate = None
+        self.climbing = True
+        # Set while the pool is held back by low memory rather than by throughput
+        self.memory_limited = False
+        self.history = []
+        self.started = time.time()
+        self.started_done = pool.stats["items_done"]
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def _run(self):
+        last_done = self.pool.stats["items_done"]
+        last_time = time.time()
+        while not self._stop.wait(self.interval):
+            now = time.time()
+            done = self.pool.stats["items_done"]
+            idle = done == last_done and self.pool.outstanding() == 0
+            rate = (done - last_done) / (now - last_time)
+            last_done, last_time = done, now
+            if not idle:
+                # An idle pool says nothing about the best worker count
+                self.step(rate)
+
+    def step(self, rate):
+        """Record one throughput sample and resize the pool"""
+        workers = self.pool.max_workers
+        available, _ = memory_info_mb()
+        self.history.append((workers, rate, available))
+        if rate > self.best[1]:
+            self.best = (workers, rate)
+
+        rss = list(self.pool.worker_rss.values())
+        worker_mb = max(rss) if rss else BASE_WORKER_MB
+        if available is not None and available < self.reserve_mb and workers > self.min_workers:
+            print(f"Autotune: {available:.0f} MB free, reducing to {workers - 1} workers")
+            self.pool.set_max_workers(workers - 1)
+            self.climbing = False
+            self.memory_limited = True
+            return
+
+        if self.memory_limited and available is not None and available - worker_mb > self.reserve_mb:
+            # The memory spike is over: measure again from this size
+            print(f"Autotune: {available:.0f} MB free again, resuming with {workers} workers")
+            self.memory_limited = False
+            self.climbing = True
+            self.previous_rate = None
+        if not self.climbing:
+            return
+        if self.previous_rate is not None and rate < self.previous_rate * (1 + MIN_GAIN):
+            # Throughput flattened: settle on the best size seen
+            self.climbing = False
+            if self.best[0] != workers:
+                print(f"Autotune: throughput flat at {rate:.2f} models/s, "
+                      f"settling on {self.best[0]} workers")
+                self.pool.set_max_workers(self.best[0])
+            return
+        self.previous_rate = rate
+
+        fits = available is None or available - worker_mb > self.reserve_mb
+        if workers < self.max_workers and fits:
+            print(f"Autotune: {rate:.2f} models/s with {workers} workers, trying {workers + 1}")
+            self.pool.set_max_workers(workers + 1)
+        else:
+            self.climbing = False
+
+    def report(self):
+        """Describe the chosen settings so they can be pinned"""
+        workers, rate = self.best
+        if not self.history:
+            # The run ended before the first sample; use its overall rate
+            elapsed = max(time.time() - self.started, 1e-6)
+            rate = (self.pool.stats["items_done"] - self.started_done) / elapsed
+        available, _ = memory_info_mb()
+        memory = f", {available:.0f} MB free" if available is not None else ""
+        return (f"Autotune: best throughput {rate:.2f} models/s with {workers} workers "
+                f"(now {self.pool.max_workers}{memory}). "
+                f"Pin it with max workers = {workers}.")
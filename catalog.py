@@ -0,0 +1,379 @@
+import os
+import sys
+import json
+import html
+import hashlib
+import urllib.parse
+import progress
+from treesnapshot import TreeSnapshot, pop_snapshot_option, open_snapshot
+
+# Catalog output folder, created inside the cataloged folder by default
+CATALOG_DIR = "_catalog"
+MANIFEST_FILE = "manifest.json"
+# A script rather than JSON: browsers block fetch() on pages opened from file://
+SEARCH_INDEX_FILE = "search-index.js"
+OLD_SEARCH_INDEX_FILE = "search-index.json"
+MODELS_PER_PAGE = 200
+MODEL_EXTENSIONS = ('.stl', '.obj')
+# Preview suffixes tried for a model's grid thumbnail and its full-size image, best first
+THUMBNAIL_SUFFIXES = [f"_top_view_200{ext}" for ext in (".webp", ".jpg", ".png")] + \
+                     [f"_top_view{ext}" for ext in (".webp", ".jpg", ".png")]
+FULL_SUFFIXES = [f"_top_view{ext}" for ext in (".webp", ".jpg", ".png")]
+FRONT_SUFFIXES = [f"_front_view{ext}" for ext in (".webp", ".jpg", ".png")]
+
+STYLE = """body{font-family:sans-serif;margin:0;background:#202020;color:#ddd}
+header{padding:10px 16px;background:#2b2b2b;position:sticky;top:0}
+a{color:#9cf}nav.crumbs a{margin-right:4px}
+#search{width:320px;padding:4px;margin-top:6px}
+ul.folders{columns:3;list-style:none;padding:0 16px}
+.grid{display:grid;grid-template-columns:repeat(auto-fill,minmax(210px,1fr));gap:12px;padding:16px}
+.card{background:#2b2b2b;padding:6px;border-radius:4px;overflow:hidden}
+.card img{width:200px;height:200px;object-fit:contain;background:#282828;display:block}
+.card .name{font-size:13px;word-break:break-all}.card .meta{font-size:11px;color:#999}
+.pages{padding:0 16px 16px}.pages a,.pages b{margin-right:6px}
+"""
+
+SCRIPT = """(function(){
+var box=document.getElementById('search'),results=document.getElementById('results'),
+    content=document.getElementById('content'),index=null,loading=false;
+function load(){if(index||loading)return;loading=true;
+  var s=document.createElement('script');s.src='search-index.js';
+  s.onload=function(){index=window.EZSTL_INDEX;run();};
+  s.onerror=function(){loading=false;};document.head.appendChild(s);}
+function esc(s){return s.replace(/[&<>"]/g,function(c){return{'&':'&amp;','<':'&lt;','>':'&gt;','"':'&quot;'}[c];});}
+function run(){var q=box.value.toLowerCase().split(/\\s+/).filter(Boolean);
+  if(!q.length){results.innerHTML='';content.style.display='';return;}
+  if(!index){load();return;}
+  var out=[],m=index.models;
+  for(var i=0;i<m.length&&out.length<200;i++){var n=m[i][0].toLowerCase(),ok=true;
+    for(var j=0;j<q.length;j++){if(n.indexOf(q[j])<0){ok=false;break;}}
+    if(ok)out.push(m[i]);}
+  content.style.display='none';
+  results.innerHTML='<div class="grid">'+out.map(function(e){
+    return '<div class="card"><a href="'+esc(index.pages[e[1]])+'">'+
+      (e[2]?'<img loading="lazy" src="'+esc(e[2])+'" width="200" height="200" alt="">':'')+
+      '</a><div class="name">'+esc(e[0])+'</div><div class="meta">'+esc(index.folders[e[1]])+'</div></div>';
+  }).join('')+'</div>';}
+box.addEventListener('focus',load);box.addEventListener('input',run);
+})();
+"""
+
+def page_name(folder_key, page=1):
+    """File name of one page of a folder; the catalog root is index.html"""
+    if folder_key == "":
+        stem = "index"
+    else:
+        stem = "f-" + hashlib.sha1(folder_key.encode("utf-8")).hexdigest()[:16]
+    return f"{stem}.html" if page == 1 else f"{stem}-{page}.html"
+
+def url_for(path, catalog_dir):
+    """Relative URL from a catalog page to a file"""
+    relative = os.path.relpath(path, catalog_dir).replace(os.sep, "/")
+    return urllib.parse.quote(relative)
+
+def find_preview(base_name, files, suffixes):
+    for suffix in suffixes:
+        if base_name + suffix in files:
+            return base_name + suffix
+    return None
+
+def format_size(size):
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+def scan_folders(root, snapshot, skip_dirs, stored=None):
+    """
+    Return {folder key: folder record} for every folder holding models, children first
+
+    Each record lists the folder's models with their previews and the model
+    count of every subfolder; its signature changes whenever anything shown on
+    the folder's pages changes. stored maps model paths to their views in the
+    preview store, for models previewed only there.
+    """
+    order = []
+    stack = [root]
+    while stack:
+        folder = stack.pop()
+        order.append(folder)
+        dirnames, _ = snapshot.listdir(folder)
+        for name in dirnames:
+            path = os.path.join(folder, name)
+            if path not in skip_dirs:
+                stack.append(path)
+
+    folders = {}
+    totals = {}
+    for folder in reversed(order):
+        dirnames, files = snapshot.listdir(folder)
+        key = os.path.relpath(folder, root).replace(os.sep, "/")
+        key = "" if key == "." else key
+        models = []
+        for name in sorted(files, key=str.lower):
+            if not name.lower().endswith(MODEL_EXTENSIONS):
+                continue
+            base_name = os.path.splitext(name)[0]
+            stored_views = sorted((stored or {}).get(os.path.join(folder, name), ()))
+            models.append({
+                "name": name,
+                "size": files[name].size,
+                "thumb": find_preview(base_name, files, THUMBNAIL_SUFFIXES),
+                "full": find_preview(base_name, files, FULL_SUFFIXES),
+                "front": find_preview(base_name, files, FRONT_SUFFIXES),
+                "stored": stored_views,
+            })
+        children = []
+        for name in dirnames:
+            child = os.path.join(folder, name)
+            if totals.get(child):
+                children.append((name, totals[child]))
+        totals[folder] = len(models) + sum(count for _, count in children)
+        if not totals[folder] and key != "":
+            continue
+
+        signature_data = [[(m["name"], m["size"], m["thumb"], m["full"], m["front"],
+                            m["stored"], files[m["name"]].mtime_ns) for m in models], children]
+        folders[key] = {
+            "path": folder,
+            "models": models,
+            "children": children,
+            "total": totals[folder],
+            "signature": hashlib.sha1(json.dumps(signature_data).encode("utf-8")).hexdigest(),
+        }
+    return folders
+
+def export_store_thumbnails(store, folder_record, catalog_dir):
+    """
+    Write store-backed thumbnails of one folder into the catalog
+
+    Only used for models without loose previews; the files go under
+    <catalog>/previews/ mirroring the folder layout.
+    """
+    folder = folder_record["path"]
+    relative = os.path.relpath(folder, store.root)
+    for model in folder_record["models"]:
+        if model["thumb"] is not None or not model["stored"]:
+            continue
+        model_path = os.path.join(folder, model["name"])
+        for key in ("top_200", "top"):
+            data = store.get(model_path, key)
+            if data is None:
+                continue
+            suffix = next(suffix for path, view, suffix, _ in store.entries(model_path) if view == key)
+            out_path = os.path.normpath(os.path.join(
+                catalog_dir, "previews", relative, os.path.splitext(model["name"])[0] + suffix))
+            os.makedirs(os.path.dirname(out_path), exist_ok=True)
+            with open(out_path, "wb") as f:
+                f.write(data)
+            model["thumb_path"] = out_path
+            break
+
+def render_folder_pages(key, record, catalog_dir, page_size):
+    """Return [(file name, HTML)] for every page of one folder"""
+    folder = record["path"]
+    title = key or os.path.basename(os.path.dirname(catalog_dir)) or "Catalog"
+    crumbs = ['<a href="index.html">Catalog</a>']
+    if key:
+        parts = key.split("/")
+        for i, part in enumerate(parts):
+            crumbs.append(f'/ <a href="{page_name("/".join(parts[:i + 1]))}">{html.escape(part)}</a>')
+
+    folder_list = ""
+    if record["children"]:
+        items = []
+        for name, count in record["children"]:
+            child_key = f"{key}/{name}" if key else name
+            items.append(f'<li><a href="{page_name(child_key)}">{html.escape(name)}</a> ({count})</li>')
+        folder_list = '<ul class="folders">' + "".join(items) + "</ul>"
+
+    models = record["models"]
+    page_count = max(1, (len(models) + page_size - 1) // page_size)
+    pages = []
+    for page in range(1, page_count + 1):
+        cards = []
+        for model in models[(page - 1) * page_size:page * page_size]:
+            thumb_path = model.get("thumb_path") or (
+                os.path.join(folder, model["thumb"]) if model["thumb"] else None)
+            image = (f'<img loading="lazy" decoding="async" src="{url_for(thumb_path, catalog_dir)}" '
+                     f'width="200" height="200" alt="">' if thumb_path else "<div>No preview</div>")
+            full = os.path.join(folder, model["full"]) if model["full"] else thumb_path
+            links = [f'<a href="{url_for(os.path.join(folder, model["name"]), catalog_dir)}">model</a>']
+            if model["front"]:
+                links.append(f'<a href="{url_for(os.path.join(folder, model["front"]), catalog_dir)}">front</a>')
+            cards.append(
+                '<div class="card">'
+                + (f'<a href="{url_for(full, catalog_dir)}">{image}</a>' if full else image)
+                + f'<div class="name">{html.escape(model["name"])}</div>'
+                + f'<div class="meta">{format_size(model["size"])} · {" · ".join(links)}</div></div>')
+
+        pager = ""
+        if page_count > 1:
+            pager = '<div class="pages">' + "".join(
+                f"<b>{n}</b>" if n == page else f'<a href="{page_name(key, n)}">{n}</a>'
+                for n in range(1, page_count + 1)) + "</div>"
+        body = (f'<header><nav class="crumbs">{"".join(crumbs)}</nav>'
+                f'<input id="search" type="search" placeholder="Search all models"></header>'
+                f'<div id="results"></div><div id="content"><h2 style="padding:0 16px">'
+                f'{html.escape(title)} ({record["total"]} models)</h2>{folder_list}'
+                f'{pager}<div class="grid">{"".join(cards)}</div>{pager}</div>')
+        pages.append((page_name(key, page),
+                      '<!DOCTYPE html><html><head><meta charset="utf-8">'
+                      f'<title>{html.escape(title)}</title><link rel="stylesheet" href="catalog.css">'
+                      f'</head><body>{body}<script src="catalog.js"></script></body></html>'))
+    return pages
+
+def write_if_changed(path, text):
+    """Write a text file unless it already holds exactly this text; returns True if written"""
+    try:
+        with open(path, encoding="utf-8") as f:
+            if f.read() == text:
+                return False
+    except OSError:
+        pass
+    temp_path = path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(temp_path, path)
+    return True
+
+def build_catalog(root, catalog_dir=None, page_size=MODELS_PER_PAGE, snapshot=None):
+    """
+    Build or update the static HTML catalog of root
+
+    Only pages of folders whose signature differs from the manifest are
+    rewritten; pages of folders that disappeared are removed. Returns the
+    number of folders whose pages were written.
+    """
+    root = os.path.abspath(root)
+    catalog_dir = os.path.abspath(catalog_dir or os.path.join(root, CATALOG_DIR))
+    os.makedirs(catalog_dir, exist_ok=True)
+    if snapshot is None or not snapshot.contains(root):
+        snapshot = TreeSnapshot.build(root)
+
+    manifest_path = os.path.join(catalog_dir, MANIFEST_FILE)
+    try:
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+    old_folders = manifest.get("folders", {})
+    if manifest.get("page_size") != page_size:
+        # Every page changes; keep only the page counts so stale pages are removed
+        old_folders = {key: {"pages": entry.get("pages", 0)} for key, entry in old_folders.items()}
+
+    from previewstore import STORE_DIR, PreviewStore
+    skip_dirs = {catalog_dir, os.path.join(root, STORE_DIR)}
+    store = PreviewStore(root) if snapshot.isdir(os.path.join(root, STORE_DIR)) else None
+    folders = scan_folders(root, snapshot, skip_dirs, store.stored_views() if store is not None else None)
+
+    write_if_changed(os.path.join(catalog_dir, "catalog.css"), STYLE)
+    write_if_changed(os.path.join(catalog_dir, "catalog.js"), SCRIPT)
+
+    changed = {key for key, record in folders.items()
+               if old_folders.get(key, {}).get("signature") != record["signature"]
+               or not os.path.exists(os.path.join(catalog_dir, page_name(key)))
+               or missing_thumbnails(old_folders[key])}
+    progress.stage_start("catalog", len(changed))
+    new_folders = {}
+    try:
+        for key, record in folders.items():
+            if key not in changed:
+                new_folders[key] = old_folders[key]
+                continue
+            if store is not None:
+                export_store_thumbnails(store, record, catalog_dir)
+            pages = render_folder_pages(key, record, catalog_dir, page_size)
+            for name, text in pages:
+                write_if_changed(os.path.join(catalog_dir, name), text)
+            # Remove pages left over from a folder that used to be longer
+            for page in range(len(pages) + 1, old_folders.get(key, {}).get("pages", 0) + 1):
+                remove_file(os.path.join(catalog_dir, page_name(key, page)))
+            new_folders[key] = {"signature": record["signature"], "pages": len(pages),
+                                "thumbs": [m.get("thumb_path") for m in record["models"]]}
+            progress.item_done("catalog", key or "/")
+    finally:
+        if store is not None:
+            store.close()
+
+    for key, entry in old_folders.items():
+        if key not in folders:
+            for page in range(1, entry.get("pages", 1) + 1):
+                remove_file(os.path.join(catalog_dir, page_name(key, page)))
+
+    # The search index is rebuilt from the scan but only written when it changed
+    pages, folder_names, models = [], [], []
+    for key, record in sorted(folders.items()):
+        thumbs = new_folders[key].get("thumbs") or [None] * len(record["models"])
+        for page_index, model in enumerate(record["models"]):
+            thumb_path = thumbs[page_index] if page_index < len(thumbs) else None
+            if thumb_path is None and model["thumb"]:
+                thumb_path = os.path.join(record["path"], model["thumb"])
+            page = page_name(key, page_index // page_size + 1)
+            if not pages or pages[-1] != page:
+                pages.append(page)
+                folder_names.append(key or "/")
+            models.append([model["name"], len(pages) - 1,
+                           url_for(thumb_path, catalog_dir) if thumb_path else None])
+    index = json.dumps({"pages": pages, "folders": folder_names, "models": models}, separators=(",", ":"))
+    write_if_changed(os.path.join(catalog_dir, SEARCH_INDEX_FILE), f"window.EZSTL_INDEX={index};\n")
+    remove_file(os.path.join(catalog_dir, OLD_SEARCH_INDEX_FILE))
+
+    manifest = {"page_size": page_size, "folders": new_folders}
+    write_if_changed(manifest_path, json.dumps(manifest))
+    progress.stage_end("catalog")
+    print(f"Catalog: {len(folders)} folders, {len(changed)} rewritten, "
+          f"{folders['']['total']} models. "
+          f"Open {os.path.join(catalog_dir, 'index.html')}")
+    return len(changed)
+
+def missing_thumbnails(entry):
+    """True if a thumbnail exported from the store was removed, e.g. by the cleanup stage"""
+    return any(path and not os.path.exists(path) for path in entry.get("thumbs") or ())
+
+def remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def main():
+    args = sys.argv[1:]
+    try:
+        snapshot_path = pop_snapshot_option(args)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return 1
+    catalog_dir = None
+    page_size = MODELS_PER_PAGE
+    for name in ("--out", "--page-size"):
+        if name in args:
+            index = args.index(name)
+            if index + 1 >= len(args):
+                print(f"Error: {name} needs a value")
+                return 1
+            if name == "--out":
+                catalog_dir = args[index + 1]
+            else:
+                try:
+                    page_size = max(1, int(args[index + 1]))
+                except ValueError:
+                    print("Error: --page-size must be a number")
+                    return 1
+            del args[index:index + 2]
+    if len(args) != 1:
+        print("Usage: python catalog.py /path/to/folder [--out DIR] [--page-size N] [--snapshot FILE]")
+        return 1
+
+    folder_path = args[0]
+    if not os.path.isdir(folder_path):
+        print(f"Error: {folder_path} is not a valid directory")
+        return 1
+    snapshot = open_snapshot(snapshot_path, folder_path) if snapshot_path else None
+    build_catalog(folder_path, catalog_dir, page_size, snapshot)
+    if snapshot is not None:
+        snapshot.save(snapshot_path)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -7,6 +7,100 @@ import threading
 import queue
 import signal
 import time
+import json
+import tempfile
+import logging
+import logging.handlers
+from treesnapshot import TreeSnapshot
+from pipeline import Pipeline
+from autotune import parse_worker_count
+import progress
+
+# Lines kept in the log widget; the complete log goes to LOG_FILE
+MAX_LOG_LINES = 5000
+LOG_FILE = os.path.join(os.path.expanduser("~"), ".ezstl", "cataloger.log")
+# Seconds check_queue may spend draining messages per tick
+QUEUE_TICK_BUDGET = 0.05
+# Triangle limit for batched rendering of small models (stlphoto18.DEFAULT_BATCH_TRIANGLES)
+SMALL_MODEL_TRIANGLES = 20000
+
+def create_file_logger():
+    """Logger writing the full GUI log to LOG_FILE, rotated at 5 MB with 5 backups"""
+    logger = logging.getLogger("ezstl.gui")
+    if logger.handlers:
+        return logger
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    try:
+        os.makedirs(os.path.dirname(LOG_FILE), exist_ok=True)
+        handler = logging.handlers.RotatingFileHandler(
+            LOG_FILE, maxBytes=5 * 1024 * 1024, backupCount=5, encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(message)s"))
+    except OSError as e:
+        print(f"Could not open log file {LOG_FILE}: {e}")
+        handler = logging.NullHandler()
+    logger.addHandler(handler)
+    return logger
+
+class QueueWriter:
+    """File-like object that forwards complete lines to the GUI queue as log messages"""
+
+    def __init__(self, target_queue):
+        self.queue = target_queue
+        self.buffer = ""
+
+    def write(self, text):
+        self.buffer += text
+        while "\n" in self.buffer:
+            line, self.buffer = self.buffer.split("\n", 1)
+            self.queue.put(("log", line))
+        return len(text)
+
+    def flush(self):
+        if self.buffer:
+            self.queue.put(("log", self.buffer))
+            self.buffer = ""
+
+class RunOutput:
+    """
+    Stands in for sys.stdout during an in-process run and sends the run's output to the GUI log
+
+    sys.stdout is shared by every thread, so writes are routed by thread: the
+    thread that created this object and threads started afterwards (the stages'
+    helper threads) go to the log, each through its own QueueWriter so lines
+    never interleave. Threads that were already running, such as the Tk thread,
+    keep writing to the original stream.
+    """
+
+    def __init__(self, target_queue, original):
+        self.queue = target_queue
+        self.original = original
+        current = threading.current_thread()
+        self.other_threads = {thread for thread in threading.enumerate() if thread is not current}
+        self.writers = {}
+        self.lock = threading.Lock()
+
+    def _target(self):
+        thread = threading.current_thread()
+        if thread in self.other_threads:
+            return self.original
+        with self.lock:
+            writer = self.writers.get(thread)
+            if writer is None:
+                writer = self.writers[thread] = QueueWriter(self.queue)
+        return writer
+
+    def write(self, text):
+        return self._target().write(text)
+
+    def flush(self):
+        self._target().flush()
+
+    def flush_all(self):
+        with self.lock:
+            writers = list(self.writers.values())
+        for writer in writers:
+            writer.flush()
 
 class ScriptGUI:
     def __init__(self, root):
@@ -19,17 +113,29 @@ class ScriptGUI:
         
         # Variables
         self.input_folder_path = tk.StringVar()
-        self.stlphoto_max_workers = tk.StringVar(value="4")
+        self.stlphoto_max_workers = tk.StringVar(value="auto")
         self.delete_empty_enabled = tk.BooleanVar(value=False)
         self.combine_enabled = tk.BooleanVar(value=True)
         self.delete_mode = tk.StringVar(value="all")
         self.min_images = tk.StringVar(value="3")
+        self.in_process_enabled = tk.BooleanVar(value=False)
+        self.store_previews_enabled = tk.BooleanVar(value=False)
+        self.image_format = tk.StringVar(value="png")
+        self.thumbnails_enabled = tk.BooleanVar(value=False)
+        self.batch_small_enabled = tk.BooleanVar(value=False)
+        self.catalog_enabled = tk.BooleanVar(value=False)
+        self.contact_sheets_enabled = tk.BooleanVar(value=False)
+        self.binary_stl_enabled = tk.BooleanVar(value=False)
         
         # Queue for thread communication
         self.queue = queue.Queue()
         self.running = False
         self.current_process = None
         self.stop_requested = False
+        self.snapshot_path = None
+        self.pipeline = None
+        self.tracker = progress.ProgressTracker()
+        self.file_log = create_file_logger()
         
         self.create_widgets()
 
@@ -46,8 +152,27 @@ class ScriptGUI:
         config_frame.pack(fill="x", padx=10, pady=5)
 
         # STL Photo options
-        ttk.Label(config_frame, text="STL Photo Max Workers:").pack(anchor="w")
+        ttk.Label(config_frame, text="STL Photo Max Workers (number or auto):").pack(anchor="w")
         ttk.Entry(config_frame, textvariable=self.stlphoto_max_workers, width=10).pack(fill="x", pady=2)
+        ttk.Checkbutton(config_frame, text="Run stages in-process (keeps render workers warm between runs)",
+                        variable=self.in_process_enabled).pack(anchor="w", pady=2)
+        ttk.Checkbutton(config_frame, text="Store previews in catalog shard files instead of loose PNGs",
+                        variable=self.store_previews_enabled).pack(anchor="w", pady=2)
+        format_frame = ttk.Frame(config_frame)
+        format_frame.pack(fill="x", pady=2)
+        ttk.Label(format_frame, text="Image format:").pack(side="left", padx=5)
+        ttk.Combobox(format_frame, textvariable=self.image_format, values=("png", "webp", "jpeg"),
+                     state="readonly", width=6).pack(side="left")
+        ttk.Checkbutton(format_frame, text="Also write 200 px grid thumbnails",
+                        variable=self.thumbnails_enabled).pack(side="left", padx=10)
+        ttk.Checkbutton(config_frame, text="Render small models in batches (faster for packs of small parts)",
+                        variable=self.batch_small_enabled).pack(anchor="w", pady=2)
+        ttk.Checkbutton(config_frame, text="Convert ASCII STL files to binary before rendering",
+                        variable=self.binary_stl_enabled).pack(anchor="w", pady=2)
+        ttk.Checkbutton(config_frame, text="Write a contact sheet of the previews into every model folder",
+                        variable=self.contact_sheets_enabled).pack(anchor="w", pady=2)
+        ttk.Checkbutton(config_frame, text="Build HTML catalog (_catalog/index.html) after the other stages",
+                        variable=self.catalog_enabled).pack(anchor="w", pady=2)
 
         # Add script toggles with descriptions
         combine_frame = ttk.Frame(config_frame)
@@ -170,6 +295,11 @@ class ScriptGUI:
                                               state="disabled")
         self.emergency_stop_button.pack(side="left", padx=5)
 
+        # Renders a folder's models next, ahead of the rest of a running render
+        self.prioritize_button = ttk.Button(buttons_frame, text="Prioritize Folder",
+                                            command=self.prioritize_folder, state="disabled")
+        self.prioritize_button.pack(side="left", padx=5)
+
         # Create emergency button style
         style = ttk.Style()
         style.configure("Emergency.TButton", foreground="red")
@@ -189,32 +319,56 @@ class ScriptGUI:
         self.check_queue()
 
     def check_queue(self):
+        # Log lines are collected and inserted once per tick; a stage printing thousands
+        # of lines per second would otherwise freeze the UI with one insert per line
+        lines = []
+        stage = None
+        deadline = time.time() + QUEUE_TICK_BUDGET
         try:
-            while True:
+            while time.time() < deadline:
                 message = self.queue.get_nowait()
                 if isinstance(message, tuple):
                     if message[0] == "log":
-                        self.log_message(message[1])
-                    elif message[0] == "progress":
+                        lines.append(message[1])
+                        continue
+                    if message[0] in ("done", "confirm", "error"):
+                        # Show everything logged so far before a dialog blocks the tick
+                        self.log_lines(lines)
+                        lines = []
+                    if message[0] == "progress":
                         current, total = message[1], message[2]
                         percentage = (current / total) * 100
                         self.progress_var.set(f"Processing: {current}/{total} ({percentage:.1f}%)")
                         self.progress_bar['value'] = percentage
+                    elif message[0] == "event":
+                        stage = self.tracker.update(message[1])
+                    elif message[0] == "progress_msg":
+                        self.progress_var.set(message[1])
                     elif message[0] == "done":
                         self.running = False
                         self.run_button.config(state="normal")
                         self.stop_button.config(state="disabled")
                         self.emergency_stop_button.config(state="disabled")
+                        self.prioritize_button.config(state="disabled")
                         messagebox.showinfo("Success", "All scripts completed successfully!")
+                    elif message[0] == "confirm":
+                        _, text, reply = message
+                        reply["answer"] = messagebox.askyesno("Confirm", text)
+                        reply["event"].set()
                     elif message[0] == "error":
                         self.running = False
                         self.run_button.config(state="normal")
                         self.stop_button.config(state="disabled")
                         self.emergency_stop_button.config(state="disabled")
+                        self.prioritize_button.config(state="disabled")
                         messagebox.showerror("Error", message[1])
         except queue.Empty:
             pass
         finally:
+            self.log_lines(lines)
+            if stage is not None:
+                self.progress_var.set(self.tracker.summary(stage))
+                self.progress_bar['value'] = stage.fraction() * 100
             self.root.after(100, self.check_queue)
 
     def browse_input_folder(self):
@@ -223,50 +377,102 @@ class ScriptGUI:
             self.input_folder_path.set(folder)
 
     def log_message(self, message):
-        self.log_text.insert("end", message + "\n")
+        self.log_lines([message])
+
+    def log_lines(self, lines):
+        """Append lines to the log file and the widget, keeping the widget to MAX_LOG_LINES"""
+        if not lines:
+            return
+        text = "\n".join(lines)
+        self.file_log.info(text)
+        self.log_text.insert("end", "\n".join(lines[-MAX_LOG_LINES:]) + "\n")
+        line_count = int(self.log_text.index("end-1c").split(".")[0])
+        if line_count > MAX_LOG_LINES:
+            self.log_text.delete("1.0", f"{line_count - MAX_LOG_LINES}.0")
         self.log_text.see("end")
 
-    def run_script(self, script_name, input_path):
+    def ask_confirmation(self, text):
+        """Ask a yes/no question on the Tk thread and wait for the answer"""
+        reply = {"answer": False, "event": threading.Event()}
+        self.queue.put(("confirm", text, reply))
+        while not reply["event"].wait(0.1):
+            if self.stop_requested:
+                return False
+        return reply["answer"]
+
+    def run_script(self, script_name, input_path, extra_args=None):
         if self.stop_requested:
             return False
 
         self.queue.put(("log", f"\n=== Running {script_name} ==="))
+        channel = None
+        readers = []
         try:
             cmd = [sys.executable, script_name, input_path]
-            
+            if extra_args:
+                cmd.extend(extra_args)
+            if self.snapshot_path:
+                cmd.extend(["--snapshot", self.snapshot_path])
+
+            # Progress events arrive on their own channel; stdout and stderr carry the log text
+            channel = progress.EventChannel()
             if sys.platform == "win32":
-                self.current_process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, 
-                                                      text=True, bufsize=1, universal_newlines=True)
+                self.current_process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                                      text=True, bufsize=1, universal_newlines=True,
+                                                      env=channel.child_env())
             else:
-                self.current_process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, 
-                                                      text=True, bufsize=1, universal_newlines=True, 
-                                                      preexec_fn=os.setsid)
-
-            while True:
+                self.current_process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                                      text=True, bufsize=1, universal_newlines=True,
+                                                      preexec_fn=os.setsid, env=channel.child_env(),
+                                                      pass_fds=channel.pass_fds)
+            channel.child_started()
+            process = self.current_process
+            # Both pipes are drained at once so a chatty child never blocks on a full pipe
+            readers = [threading.Thread(target=self.forward_output, args=(stream,), daemon=True)
+                       for stream in (process.stdout, process.stderr)]
+            readers.append(threading.Thread(target=self.forward_events,
+                                            args=(channel, process), daemon=True))
+            for reader in readers:
+                reader.start()
+
+            while process.poll() is None:
                 if self.stop_requested:
-                    self.current_process.terminate()
+                    process.terminate()
                     self.queue.put(("log", f"Stopped {script_name}"))
                     return False
+                time.sleep(0.1)
 
-                output = self.current_process.stdout.readline()
-                if output == '' and self.current_process.poll() is not None:
-                    break
-                if output:
-                    self.queue.put(("log", output.strip()))
-
-            return_code = self.current_process.wait()
+            return_code = process.wait()
             if return_code != 0:
                 raise subprocess.CalledProcessError(return_code, cmd)
 
-            if script_name == "scriptdeletempty.py":
-                cmd.extend([self.min_images.get(), self.delete_mode.get()])
-
             return True
 
         except Exception as e:
             self.queue.put(("log", f"Error running {script_name}:"))
             self.queue.put(("log", str(e)))
             raise
+        finally:
+            for reader in readers:
+                reader.join(timeout=5)
+            if channel is not None:
+                channel.close()
+
+    def forward_output(self, stream):
+        """Pass a child's output lines to the GUI queue until the pipe closes"""
+        try:
+            for line in stream:
+                self.queue.put(("log", line.rstrip()))
+        except (OSError, ValueError):
+            pass
+
+    def forward_events(self, channel, process):
+        """Pass a child's progress events to the GUI queue until it exits"""
+        try:
+            for event in channel.events(lambda: process.poll() is None):
+                self.queue.put(("event", event))
+        except (OSError, ValueError) as e:
+            self.queue.put(("log", f"Progress channel closed: {e}"))
 
     def run_scripts(self):
         input_path = self.input_folder_path.get()
@@ -278,7 +484,20 @@ class ScriptGUI:
             self.queue.put(("error", f"Invalid input directory: {input_path}"))
             return
 
+        # Priority requests made from here on are served once the render stage runs
+        run_started = time.time()
         try:
+            if self.in_process_enabled.get():
+                if self.run_in_process(input_path) and not self.stop_requested:
+                    self.queue.put(("done", None))
+                return
+
+            # Scan the input folder once; every stage loads and updates this snapshot
+            self.queue.put(("log", "Building folder snapshot..."))
+            fd, self.snapshot_path = tempfile.mkstemp(prefix="ezstl_snapshot_", suffix=".json")
+            os.close(fd)
+            TreeSnapshot.build(input_path).save(self.snapshot_path)
+
             # Run preprocessing scripts
             for script in ["scriptunzipmultirar.py", "script7zextract.py"]:
                 if not self.run_script(script, input_path):
@@ -289,23 +508,33 @@ class ScriptGUI:
                 if not self.run_script("scriptcombine.py", input_path):
                     return
 
-            # Launch stlphoto18.py in new terminal
-            folder_path = self.input_folder_path.get()
-            max_workers = self.stlphoto_max_workers.get()
-            script_path = os.path.join(os.path.dirname(__file__), "stlphoto18.py")
-            
-            if sys.platform == "win32":
-                # Wrap the path in quotes to handle spaces
-                cmd = f'start cmd /k "python "{script_path}" "{folder_path}" {max_workers}"'
-                subprocess.Popen(cmd, shell=True)
-            else:
-                terminal_cmd = 'gnome-terminal' if os.system('which gnome-terminal') == 0 else 'xterm'
-                cmd = [terminal_cmd, '--', 'python3', script_path, folder_path, str(max_workers)]
-                subprocess.Popen(cmd)
+            if self.binary_stl_enabled.get():
+                if not self.run_script("scriptstlbinary.py", input_path):
+                    return
+
+            # Render previews; progress and ETA are shown from its event stream
+            output_backend = "store" if self.store_previews_enabled.get() else "files"
+            render_args = [self.stlphoto_max_workers.get().strip() or "4",
+                           "--output-backend", output_backend, "--format", self.image_format.get(),
+                           "--requests-since", f"{run_started:.3f}"]
+            if self.thumbnails_enabled.get():
+                render_args.extend(["--sizes", "800,200"])
+            if self.batch_small_enabled.get():
+                render_args.extend(["--batch-small", str(SMALL_MODEL_TRIANGLES)])
+            if not self.run_script("stlphoto18.py", input_path, render_args):
+                return
 
             # Run post-processing script only if enabled
             if self.delete_empty_enabled.get():
-                if not self.run_script("scriptdeletempty.py", input_path):
+                if not self.run_delete_empty(input_path):
+                    return
+
+            if self.contact_sheets_enabled.get():
+                if not self.run_script("scriptcontactsheet.py", input_path):
+                    return
+
+            if self.catalog_enabled.get():
+                if not self.run_script("catalog.py", input_path):
                     return
 
             if not self.stop_requested:
@@ -314,29 +543,112 @@ class ScriptGUI:
         except Exception as e:
             self.queue.put(("error", f"An error occurred: {str(e)}"))
         finally:
+            if self.snapshot_path and os.path.exists(self.snapshot_path):
+                os.remove(self.snapshot_path)
+            self.snapshot_path = None
             self.running = False
             self.stop_requested = False
             self.current_process = None
             self.run_button.config(state="normal")
             self.stop_button.config(state="disabled")
             self.emergency_stop_button.config(state="disabled")
+            self.prioritize_button.config(state="disabled")
+
+    def run_in_process(self, input_path):
+        """Run all stages through the long-lived pipeline and its warm render pool"""
+        max_workers = parse_worker_count(self.stlphoto_max_workers.get())
+        if self.pipeline is not None and self.pipeline.max_workers != max_workers:
+            self.pipeline.close()
+            self.pipeline = None
+        if self.pipeline is None:
+            self.pipeline = Pipeline(max_workers)
+        self.pipeline.output_backend = "store" if self.store_previews_enabled.get() else "files"
+        import stlphoto18
+        self.pipeline.encoder = stlphoto18.parse_encoder_options(
+            self.image_format.get(), sizes=(800, 200) if self.thumbnails_enabled.get() else None)
+        self.pipeline.batch_triangles = SMALL_MODEL_TRIANGLES if self.batch_small_enabled.get() else 0
+
+        original_stdout = sys.stdout
+        output = RunOutput(self.queue, original_stdout)
+        sink = lambda event: self.queue.put(("event", event))
+        progress.add_sink(sink)
+        sys.stdout = output
+        try:
+            success = self.pipeline.run(
+                input_path,
+                combine=self.combine_enabled.get(),
+                cleanup=self.delete_empty_enabled.get(),
+                min_images=int(self.min_images.get()),
+                delete_mode=self.delete_mode.get(),
+                confirm=self.ask_confirmation,
+                build_catalog=self.catalog_enabled.get(),
+                binary_stl=self.binary_stl_enabled.get(),
+                contact_sheets=self.contact_sheets_enabled.get())
+        finally:
+            sys.stdout = original_stdout
+            output.flush_all()
+            progress.remove_sink(sink)
+        if not success and not self.stop_requested:
+            raise RuntimeError("A pipeline stage completed with errors")
+        return success
+
+    def run_delete_empty(self, input_path):
+        """Write the deletion plan, confirm it once, then apply it in one pass"""
+        fd, plan_path = tempfile.mkstemp(prefix="deletion_plan_", suffix=".json")
+        os.close(fd)
+        try:
+            if not self.run_script("scriptdeletempty.py", input_path,
+                                   [self.min_images.get(), self.delete_mode.get(),
+                                    "--batch", "--dry-run", "--plan", plan_path]):
+                return False
+
+            with open(plan_path, encoding="utf-8") as f:
+                plan = json.load(f)
+            if not plan["folders"]:
+                self.queue.put(("log", "No folders match the delete criteria."))
+                return True
+
+            total_mb = plan["total_size"] / (1024 * 1024)
+            images = sum(folder["images"] for folder in plan["folders"])
+            text = (f"Delete {len(plan['folders'])} folders "
+                    f"({images} images, {total_mb:.1f} MB)?\n\n"
+                    f"The full list is in {plan_path}")
+            if not self.ask_confirmation(text):
+                self.queue.put(("log", "Deletion plan not applied."))
+                return not self.stop_requested
+
+            return self.run_script("scriptdeletempty.py", input_path,
+                                   ["--apply", plan_path, "--yes"])
+        finally:
+            if os.path.exists(plan_path):
+                os.remove(plan_path)
 
     def start_scripts(self):
         if not self.running:
             self.running = True
             self.stop_requested = False
+            self.tracker = progress.ProgressTracker()
+            self.progress_var.set("")
+            self.progress_bar['value'] = 0
             self.run_button.config(state="disabled")
             self.stop_button.config(state="normal")
             self.emergency_stop_button.config(state="normal")
+            self.prioritize_button.config(state="normal")
             threading.Thread(target=self.run_scripts, daemon=True).start()
 
     def stop_scripts(self):
         if self.running:
             self.stop_requested = True
+            if self.pipeline is not None:
+                self.pipeline.stop()
             self.queue.put(("log", "\nStop requested. Waiting for current operation to complete..."))
             self.stop_button.config(state="disabled")
 
     def emergency_stop(self):
+        if self.pipeline is not None and self.in_process_enabled.get() and self.running:
+            self.queue.put(("log", "\nEmergency stop triggered! Killing render workers..."))
+            self.pipeline.stop()
+            self.pipeline.terminate()
         if self.current_process:
             self.queue.put(("log", "\nEmergency stop triggered! Terminating process..."))
             try:
@@ -353,16 +665,43 @@ class ScriptGUI:
             self.run_button.config(state="normal")
             self.stop_button.config(state="disabled")
             self.emergency_stop_button.config(state="disabled")
+            self.prioritize_button.config(state="disabled")
             self.queue.put(("progress_msg", "Process terminated"))
             self.progress_bar['value'] = 0
 
+    def prioritize_folder(self):
+        """Queue a folder inside the input folder to be rendered before the remaining backlog"""
+        input_path = self.input_folder_path.get()
+        folder = filedialog.askdirectory(title="Select Folder to Render First", initialdir=input_path)
+        if not folder:
+            return
+        root_path = os.path.abspath(input_path)
+        folder = os.path.abspath(folder)
+        try:
+            inside = os.path.commonpath([root_path, folder]) == root_path
+        except ValueError:
+            # Different drives on Windows
+            inside = False
+        if not inside:
+            messagebox.showerror("Error", "The folder to prioritize must be inside the input folder.")
+            return
+        import stlphoto18
+        try:
+            stlphoto18.request_priority(root_path, folder)
+        except OSError as e:
+            messagebox.showerror("Error", f"Could not queue {folder}: {e}")
+            return
+        self.queue.put(("log", f"Prioritized {folder}; it is rendered next once the render stage runs"))
+
     def on_closing(self):
         if self.running:
             if messagebox.askokcancel("Quit", "A process is still running. Do you want to terminate it and quit?"):
-                if self.current_process:
+                if self.current_process or self.pipeline is not None:
                     self.emergency_stop()
                 self.root.destroy()
         else:
+            if self.pipeline is not None:
+                self.pipeline.close()
             self.root.destroy()
 
 def main():
@@ -0,0 +1,184 @@
+import os
+import re
+import sys
+import time
+import warnings
+import numpy as np
+
+# OBJ files are parsed this many bytes at a time
+READ_CHUNK = 16 * 1024 * 1024
+
+VERTEX_LINE = re.compile(rb"^v[ \t]+([^\r\n]*)", re.MULTILINE)
+FACE_LINE = re.compile(rb"^f[ \t]+([^\r\n]*)", re.MULTILINE)
+# Texture and normal references of a face corner ("7/3/5", "7//5")
+CORNER_EXTRAS = re.compile(rb"/[^ \t\n]*")
+# Bytes that separate the corners of a face record
+BLANKS = np.zeros(256, dtype=bool)
+BLANKS[list(b" \t\r\n")] = True
+
+def parse_numbers(text, dtype):
+    """Parse whitespace-separated numbers in C; raises ValueError on anything else"""
+    with warnings.catch_warnings():
+        # numpy only warns and stops at the first unparsable token; make that an error
+        warnings.simplefilter("error", DeprecationWarning)
+        try:
+            return np.fromstring(text, dtype=dtype, sep=" ")
+        except DeprecationWarning as e:
+            raise ValueError(str(e))
+
+def parse_vertices(lines):
+    """Return the xyz coordinates of a list of 'v' record bodies as an (n, 3) array"""
+    if not lines:
+        return np.zeros((0, 3))
+    width = len(lines[0].split())
+    values = parse_numbers(b" ".join(lines), np.float64)
+    if width >= 3 and len(values) == width * len(lines):
+        # Every record has the same layout (xyz, xyzw or xyz + rgb)
+        return values.reshape(-1, width)[:, :3]
+    return np.array([line.split()[:3] for line in lines], dtype=np.float64)
+
+def corners_per_line(joined, line_count):
+    """Count the whitespace-separated tokens on each line of joined, without splitting it in Python"""
+    data = np.frombuffer(joined, dtype=np.uint8)
+    blank = BLANKS[data]
+    # A token starts at a non-blank byte that is first in the text or follows a blank
+    starts = np.flatnonzero(~blank & np.concatenate(([True], blank[:-1])))
+    line_ends = np.flatnonzero(data == ord("\n"))
+    return np.bincount(np.searchsorted(line_ends, starts), minlength=line_count)
+
+def triangulate(corners, counts):
+    """
+    Fan-triangulate polygons given as a flat corner array and corners per polygon
+
+    Returns an (n, 3) array of corner values.
+    """
+    if len(counts) and (counts == 3).all():
+        return corners.reshape(-1, 3)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    # Records with fewer than three corners (points, lines) are not polygons: skip them
+    keep = counts >= 3
+    starts, counts = starts[keep], counts[keep]
+    triangles = counts - 2
+    first = np.repeat(starts, triangles)
+    # Index of each triangle within its polygon: 0, 1, ... triangles - 1
+    within = np.arange(triangles.sum()) - np.repeat(np.cumsum(triangles) - triangles, triangles)
+    return np.column_stack((corners[first], corners[first + within + 1], corners[first + within + 2]))
+
+def parse_faces(data, lines, vertex_base, vertex_offsets=None):
+    """
+    Return the 0-based triangle indices of a list of 'f' record bodies
+
+    vertex_base is the number of vertices defined before this chunk. Negative
+    (relative) indices need the vertex count at each face, which
+    vertex_offsets(data) supplies on demand.
+    """
+    if not lines:
+        return np.zeros((0, 3), dtype=np.int64)
+    joined = CORNER_EXTRAS.sub(b"", b"\n".join(lines))
+    corners = parse_numbers(joined, np.int64)
+    # The total alone cannot tell triangles apart from a mix of short and large polygons
+    counts = corners_per_line(joined, len(lines))
+    if counts.sum() != len(corners):
+        raise ValueError("malformed face record")
+    if (corners < 0).any():
+        vertices_before = np.repeat(vertex_base + vertex_offsets(data), counts)
+        corners = np.where(corners < 0, vertices_before + corners, corners - 1)
+    else:
+        corners -= 1
+    return triangulate(corners, counts)
+
+def vertex_counts_before_faces(data):
+    """For every face record in data, the number of vertex records before it"""
+    vertex_starts = [match.start() for match in VERTEX_LINE.finditer(data)]
+    face_starts = [match.start() for match in FACE_LINE.finditer(data)]
+    return np.searchsorted(vertex_starts, face_starts)
+
+def read_obj_geometry(file_path, chunk_bytes=READ_CHUNK):
+    """
+    Read only the vertex positions and faces of an OBJ file
+
+    Materials, texture coordinates, normals, groups and objects are ignored, so
+    the whole file becomes one mesh. Polygons are fan-triangulated. Returns
+    (vertices (n, 3) float64, faces (m, 3) int64); raises ValueError if a face
+    refers to a vertex that does not exist.
+    """
+    vertex_parts = []
+    face_parts = []
+    vertex_count = 0
+    with open(file_path, "rb") as f:
+        carry = b""
+        while True:
+            chunk = f.read(chunk_bytes)
+            data = carry + chunk
+            if chunk:
+                # Only parse whole lines; the rest waits for the next chunk
+                end = data.rfind(b"\n") + 1
+                data, carry = data[:end], data[end:]
+            vertices = parse_vertices(VERTEX_LINE.findall(data))
+            faces = parse_faces(data, FACE_LINE.findall(data), vertex_count, vertex_counts_before_faces)
+            vertex_count += len(vertices)
+            vertex_parts.append(vertices)
+            face_parts.append(faces)
+            if not chunk:
+                break
+
+    vertices = np.concatenate(vertex_parts)
+    faces = np.concatenate(face_parts)
+    if len(faces) and (faces.min() < 0 or faces.max() >= len(vertices)):
+        raise ValueError(f"face index out of range in {file_path}")
+    return vertices, faces
+
+def load_obj_mesh(file_path):
+    """Load an OBJ as a single untextured trimesh, processed like trimesh.load would"""
+    import trimesh
+    vertices, faces = read_obj_geometry(file_path)
+    return trimesh.Trimesh(vertices=vertices, faces=faces, process=True)
+
+def collect_obj_files(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, names in os.walk(path):
+                files.extend(os.path.join(root, name) for name in names if name.lower().endswith(".obj"))
+        elif path.lower().endswith(".obj"):
+            files.append(path)
+    return sorted(files)
+
+def bench(paths, repeat=3):
+    """Compare load times of trimesh.load and load_obj_mesh on the given OBJ files or folders"""
+    import trimesh
+    files = collect_obj_files(paths)
+    if not files:
+        print("No OBJ files found")
+        return 1
+    total_trimesh = total_fast = 0.0
+    for file_path in files:
+        timings = {}
+        meshes = {}
+        for name, load in (("trimesh", lambda: trimesh.load(file_path, force='mesh')),
+                           ("objreader", lambda: load_obj_mesh(file_path))):
+            best = None
+            for _ in range(repeat):
+                started = time.perf_counter()
+                meshes[name] = load()
+                elapsed = time.perf_counter() - started
+                best = elapsed if best is None else min(best, elapsed)
+            timings[name] = best
+        total_trimesh += timings["trimesh"]
+        total_fast += timings["objreader"]
+        print(f"{os.path.basename(file_path)}: trimesh {timings['trimesh'] * 1000:.1f} ms "
+              f"({len(meshes['trimesh'].faces)} faces), objreader {timings['objreader'] * 1000:.1f} ms "
+              f"({len(meshes['objreader'].faces)} faces), {timings['trimesh'] / timings['objreader']:.1f}x")
+    print(f"Total: trimesh {total_trimesh:.2f}s, objreader {total_fast:.2f}s "
+          f"({total_trimesh / total_fast:.1f}x faster)")
+    return 0
+
+def main():
+    args = sys.argv[1:]
+    if len(args) < 2 or args[0] != "bench":
+        print("Usage: python objreader.py bench <file.obj or folder> [...]")
+        return 1
+    return bench(args[1:])
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,268 @@
+import os
+import sys
+import time
+import importlib
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
+import script7zextract
+import scriptunzipmultirar
+import scriptcombine
+import scriptdeletempty
+import scriptstlbinary
+import scriptcontactsheet
+import catalog
+import progress
+from treesnapshot import TreeSnapshot
+from autotune import AUTO, AutoTuner, initial_worker_count, parse_worker_count
+
+# Imported once in the fork server so every render worker starts with them loaded
+HEAVY_MODULES = ["numpy", "scipy", "PIL.Image", "trimesh", "pyrender", "stlphoto18"]
+
+def preload_heavy_modules():
+    """Import the render dependencies; used as the worker initializer"""
+    for name in HEAVY_MODULES:
+        try:
+            importlib.import_module(name)
+        except Exception as e:
+            print(f"Could not preload {name}: {e}")
+
+def noop():
+    return os.getpid()
+
+def create_warm_pool(max_workers, **pool_options):
+    """
+    Create a render pool whose workers already have the heavy modules imported
+
+    With forkserver the modules are imported once in the server and every worker
+    (including recycled replacements) is forked from it; other platforms fall
+    back to spawn plus an initializer.
+    """
+    import stlphoto18
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        ctx = multiprocessing.get_context("forkserver")
+        ctx.set_forkserver_preload(HEAVY_MODULES)
+    else:
+        ctx = multiprocessing.get_context("spawn")
+    executor = stlphoto18.create_render_pool(
+        max_workers, mp_context=ctx, initializer=preload_heavy_modules, **pool_options)
+    # Start every worker now instead of on the first render job
+    for future in [executor.submit(noop) for _ in range(max_workers)]:
+        future.result()
+    return executor
+
+class Pipeline:
+    """
+    Runs extraction, combine, STL conversion, render, cleanup, contact sheets and the catalog in one long-lived process
+
+    The render pool is created once and reused by every run, so repeated runs
+    pay neither interpreter startup nor the trimesh/pyrender import cost.
+    With max_workers="auto" the pool is resized by an AutoTuner during renders.
+    """
+
+    def __init__(self, max_workers=4, pool_options=None, output_backend="files", encoder=None,
+                 batch_triangles=0):
+        self.max_workers = max_workers
+        self.pool_options = pool_options or {}
+        self.output_backend = output_backend
+        self.encoder = encoder
+        self.batch_triangles = batch_triangles
+        self.executor = None
+        self.stop_requested = False
+
+    def start(self):
+        if self.executor is None:
+            started = time.time()
+            workers = initial_worker_count() if self.max_workers == AUTO else self.max_workers
+            print(f"Starting {workers} render workers...")
+            self.executor = create_warm_pool(workers, **self.pool_options)
+            print(f"Render workers ready in {time.time() - started:.1f}s")
+        return self
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.executor = None
+
+    def terminate(self):
+        """Kill the render workers immediately; the pool is recreated on the next run"""
+        if self.executor is None:
+            return
+        self.executor.kill()
+        self.executor = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def stop(self):
+        self.stop_requested = True
+
+    def should_stop(self):
+        return self.stop_requested
+
+    def run_extract(self, folder_path, snapshot):
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            scriptunzipmultirar.process_folder(folder_path, executor, snapshot)
+        return script7zextract.process_7z_folder(folder_path, snapshot)
+
+    def run_combine(self, folder_path, snapshot, dedup_hardlinks=False):
+        return scriptcombine.combine_folder(folder_path, snapshot=snapshot, hardlinks=dedup_hardlinks)
+
+    def run_binary_stl(self, folder_path, snapshot):
+        return scriptstlbinary.normalize_folder(folder_path, os.cpu_count() or 4, snapshot=snapshot)
+
+    def run_render(self, folder_path, snapshot, requests_since=None):
+        import stlphoto18
+        self.start()
+        tuner = AutoTuner(self.executor).start() if self.max_workers == AUTO else None
+        try:
+            stlphoto18.process_all_meshes_in_folder(
+                folder_path, self.executor.max_workers, snapshot,
+                executor=self.executor, should_stop=self.should_stop,
+                output_backend=self.output_backend, encoder=self.encoder,
+                batch_triangles=self.batch_triangles, requests_since=requests_since)
+        finally:
+            if tuner is not None:
+                tuner.stop()
+                print(tuner.report())
+        return True
+
+    def run_cleanup(self, folder_path, snapshot, min_images, delete_mode, confirm):
+        plan = scriptdeletempty.build_deletion_plan(folder_path, min_images, delete_mode, snapshot)
+        data = scriptdeletempty.make_plan_data(plan, folder_path, min_images, delete_mode)
+        print(f"Deletion plan: {scriptdeletempty.describe_plan(data)}")
+        if not plan:
+            return True
+        if confirm is not None and not confirm(f"Delete {scriptdeletempty.describe_plan(data)}?"):
+            print("Deletion plan not applied.")
+            return True
+        scriptdeletempty.apply_deletion_plan(data, snapshot=snapshot)
+        return True
+
+    def run_contact_sheets(self, folder_path, snapshot):
+        scriptcontactsheet.build_contact_sheets(folder_path, snapshot)
+        return True
+
+    def run_catalog(self, folder_path, snapshot):
+        catalog.build_catalog(folder_path, snapshot=snapshot)
+        return True
+
+    def run(self, folder_path, combine=True, render=True, cleanup=False,
+            min_images=3, delete_mode="all", confirm=None, build_catalog=False, binary_stl=False,
+            contact_sheets=False, dedup_hardlinks=False):
+        """
+        Run the enabled stages on folder_path; returns False if a stage failed or was stopped
+
+        confirm(text) is asked once before the cleanup plan is applied; None applies it.
+        Duplicates found by combine are only hardlinked with dedup_hardlinks.
+        """
+        self.stop_requested = False
+        # Priority requests made from here on are served once the render stage runs
+        run_started = time.time()
+        folder_path = os.path.abspath(folder_path)
+        snapshot = TreeSnapshot.build(folder_path)
+
+        stages = [("extract", lambda: self.run_extract(folder_path, snapshot))]
+        if combine:
+            stages.append(("combine", lambda: self.run_combine(folder_path, snapshot, dedup_hardlinks)))
+        if binary_stl:
+            stages.append(("binarystl", lambda: self.run_binary_stl(folder_path, snapshot)))
+        if render:
+            stages.append(("render", lambda: self.run_render(folder_path, snapshot, run_started)))
+        if cleanup:
+            stages.append(("cleanup", lambda: self.run_cleanup(
+                folder_path, snapshot, min_images, delete_mode, confirm)))
+        if contact_sheets:
+            stages.append(("contactsheet", lambda: self.run_contact_sheets(folder_path, snapshot)))
+        if build_catalog:
+            stages.append(("catalog", lambda: self.run_catalog(folder_path, snapshot)))
+
+        for name, stage in stages:
+            if self.stop_requested:
+                print(f"Stopped before {name}")
+                return False
+            started = time.time()
+            print(f"\n=== Running {name} ===")
+            if not stage():
+                print(f"Stage {name} completed with errors")
+                return False
+            print(f"Stage {name} finished in {time.time() - started:.1f}s")
+        return not self.stop_requested
+
+def confirm_on_console(text):
+    if sys.stdin is None or not sys.stdin.isatty():
+        print("No interactive input available; run with --yes to apply the deletion plan.")
+        return False
+    return input(f"{text} (y/n): ").lower().strip() == "y"
+
+def main():
+    args = sys.argv[1:]
+    combine = "--no-combine" not in args
+    output_backend = "store" if "--store" in args else "files"
+    encoder_args = {"--format": "png", "--sizes": None, "--batch-small": None}
+    for arg in args:
+        name, _, value = arg.partition("=")
+        if name in encoder_args:
+            encoder_args[name] = value or "default"
+    assume_yes = "--yes" in args
+    build_catalog = "--catalog" in args
+    binary_stl = "--binary-stl" in args
+    contact_sheets = "--contact-sheets" in args
+    dedup_hardlinks = "--dedup-hardlinks" in args
+    delete_mode = None
+    for mode in ("all", "few", "keep"):
+        if f"--cleanup={mode}" in args:
+            delete_mode = mode
+    args = [arg for arg in args if not arg.startswith("--")]
+    if len(args) < 1:
+        print("Usage: python pipeline.py /path/to/folder [max_workers|auto] [min_images] "
+              "[--no-combine] [--dedup-hardlinks] [--cleanup=all|few|keep] [--store] [--format=png|webp|jpeg] [--sizes=800,200] [--batch-small[=MAX_TRIANGLES]] [--binary-stl] [--contact-sheets] [--catalog] [--yes]")
+        return 1
+
+    folder_path = args[0]
+    if not os.path.isdir(folder_path):
+        print(f"Error: {folder_path} is not a valid directory")
+        return 1
+
+    max_workers = 4
+    min_images = 3
+    try:
+        if len(args) >= 2:
+            max_workers = parse_worker_count(args[1], None)
+            if max_workers is None:
+                raise ValueError(args[1])
+        if len(args) >= 3:
+            min_images = int(args[2])
+    except ValueError:
+        print("Error: max_workers must be a number or 'auto' and min_images a number")
+        return 1
+
+    import stlphoto18
+    try:
+        encoder = stlphoto18.parse_encoder_options(encoder_args["--format"], sizes=encoder_args["--sizes"])
+        batch_triangles = encoder_args["--batch-small"] or 0
+        if batch_triangles == "default":
+            batch_triangles = stlphoto18.DEFAULT_BATCH_TRIANGLES
+        batch_triangles = int(batch_triangles)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return 1
+
+    confirm = None if assume_yes else confirm_on_console
+    # Print throughput and ETA from the stages' progress events
+    progress.add_sink(progress.ConsoleProgress())
+    with Pipeline(max_workers, output_backend=output_backend, encoder=encoder,
+                  batch_triangles=batch_triangles) as pipeline:
+        success = pipeline.run(folder_path, combine=combine, cleanup=delete_mode is not None,
+                               min_images=min_images, delete_mode=delete_mode or "all",
+                               confirm=confirm, build_catalog=build_catalog,
+                               binary_stl=binary_stl, contact_sheets=contact_sheets,
+                               dedup_hardlinks=dedup_hardlinks)
+    print("Done." if success else "Finished with errors.")
+    return 0 if success else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,213 @@
+import os
+import sys
+import time
+import sqlite3
+
+# Folder inside the catalog root that holds the index and the shard files
+STORE_DIR = ".ezstl_previews"
+INDEX_FILE = "index.sqlite"
+# A new shard is started once the current one holds this many bytes
+SHARD_MAX_BYTES = 256 * 1024 * 1024
+
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS previews (
+    path TEXT NOT NULL,
+    view TEXT NOT NULL,
+    suffix TEXT NOT NULL,
+    shard INTEGER NOT NULL,
+    blob_id INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    model_size INTEGER,
+    model_mtime_ns INTEGER,
+    created REAL NOT NULL,
+    PRIMARY KEY (path, view)
+);
+CREATE TABLE IF NOT EXISTS shards (
+    shard INTEGER PRIMARY KEY,
+    bytes INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+SHARD_SCHEMA = "CREATE TABLE IF NOT EXISTS blobs (id INTEGER PRIMARY KEY, data BLOB NOT NULL)"
+
+class PreviewStore:
+    """
+    Preview images kept in a few size-capped SQLite shard files instead of loose PNGs
+
+    index.sqlite maps (model path, view) to a blob in one of the shard-NNNNN.sqlite
+    files. Model paths are stored relative to the catalog root so the store can be
+    read from any mount point. Only one process should write at a time; writes are
+    grouped into transactions and committed by commit().
+    """
+
+    def __init__(self, root, shard_max_bytes=SHARD_MAX_BYTES):
+        self.root = os.path.abspath(root)
+        self.store_dir = os.path.join(self.root, STORE_DIR)
+        self.shard_max_bytes = shard_max_bytes
+        os.makedirs(self.store_dir, exist_ok=True)
+        self.index = sqlite3.connect(os.path.join(self.store_dir, INDEX_FILE))
+        self.index.executescript(INDEX_SCHEMA)
+        self.index.commit()
+        self.shards = {}
+        row = self.index.execute("SELECT shard, bytes FROM shards ORDER BY shard DESC LIMIT 1").fetchone()
+        self.current_shard, self.current_bytes = row if row is not None else (0, 0)
+
+    def shard_path(self, shard):
+        return os.path.join(self.store_dir, f"shard-{shard:05d}.sqlite")
+
+    def _shard(self, shard):
+        conn = self.shards.get(shard)
+        if conn is None:
+            conn = sqlite3.connect(self.shard_path(shard))
+            conn.execute(SHARD_SCHEMA)
+            self.shards[shard] = conn
+        return conn
+
+    def to_key(self, path):
+        return os.path.relpath(os.path.abspath(path), self.root).replace(os.sep, "/")
+
+    def to_path(self, key):
+        return os.path.normpath(os.path.join(self.root, key))
+
+    def put(self, model_path, view, suffix, data, model_signature=None):
+        """Store one encoded preview, replacing an older one for the same model and view"""
+        key = self.to_key(model_path)
+        self.delete(model_path, view)
+        if self.current_bytes + len(data) > self.shard_max_bytes and self.current_bytes > 0:
+            self.current_shard += 1
+            self.current_bytes = 0
+        blob_id = self._shard(self.current_shard).execute(
+            "INSERT INTO blobs (data) VALUES (?)", (sqlite3.Binary(data),)).lastrowid
+        self.current_bytes += len(data)
+        model_size, model_mtime_ns = model_signature or (None, None)
+        self.index.execute(
+            "INSERT INTO previews (path, view, suffix, shard, blob_id, size, model_size, "
+            "model_mtime_ns, created) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (key, view, suffix, self.current_shard, blob_id, len(data),
+             model_size, model_mtime_ns, time.time()))
+        self.index.execute(
+            "INSERT INTO shards (shard, bytes) VALUES (?, ?) "
+            "ON CONFLICT (shard) DO UPDATE SET bytes = excluded.bytes",
+            (self.current_shard, self.current_bytes))
+
+    def get(self, model_path, view):
+        """Return the encoded preview bytes, or None"""
+        row = self.index.execute("SELECT shard, blob_id FROM previews WHERE path = ? AND view = ?",
+                                 (self.to_key(model_path), view)).fetchone()
+        if row is None:
+            return None
+        blob = self._shard(row[0]).execute("SELECT data FROM blobs WHERE id = ?", (row[1],)).fetchone()
+        return bytes(blob[0]) if blob is not None else None
+
+    def delete(self, model_path, view):
+        key = self.to_key(model_path)
+        row = self.index.execute("SELECT shard, blob_id FROM previews WHERE path = ? AND view = ?",
+                                 (key, view)).fetchone()
+        if row is None:
+            return False
+        self._shard(row[0]).execute("DELETE FROM blobs WHERE id = ?", (row[1],))
+        self.index.execute("DELETE FROM previews WHERE path = ? AND view = ?", (key, view))
+        return True
+
+    def stored_views(self):
+        """Return {model path: set of views} for everything in the store, from one query"""
+        stored = {}
+        for key, view in self.index.execute("SELECT path, view FROM previews"):
+            stored.setdefault(self.to_path(key), set()).add(view)
+        return stored
+
+    def entries(self, prefix=None):
+        """Yield (model path, view, suffix, size) sorted by path, optionally under prefix"""
+        query = "SELECT path, view, suffix, size FROM previews"
+        params = ()
+        if prefix:
+            key = self.to_key(prefix)
+            query += " WHERE path = ? OR path LIKE ? ESCAPE '\\'"
+            escaped = key.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            params = (key, escaped + "/%")
+        for key, view, suffix, size in self.index.execute(query + " ORDER BY path, view", params):
+            yield self.to_path(key), view, suffix, size
+
+    def stats(self):
+        previews, total = self.index.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM previews").fetchone()
+        shards = self.index.execute("SELECT COUNT(*) FROM shards").fetchone()[0]
+        return {"previews": previews, "bytes": total, "shards": shards}
+
+    def commit(self):
+        # Shards first: an index row must never point at an uncommitted blob
+        for conn in self.shards.values():
+            conn.commit()
+        self.index.commit()
+
+    def close(self):
+        self.commit()
+        for conn in self.shards.values():
+            conn.close()
+        self.shards = {}
+        self.index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+def export_previews(store, prefix=None, destination=None, overwrite=False):
+    """
+    Write stored previews as loose PNG files
+
+    Files go next to their models, or under destination mirroring the catalog layout.
+    Returns the number of files written.
+    """
+    written = 0
+    for model_path, view, suffix, _ in list(store.entries(prefix)):
+        out_path = os.path.splitext(model_path)[0] + suffix
+        if destination:
+            out_path = os.path.join(destination, os.path.relpath(out_path, store.root))
+        if os.path.exists(out_path) and not overwrite:
+            continue
+        data = store.get(model_path, view)
+        if data is None:
+            continue
+        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+        with open(out_path, "wb") as f:
+            f.write(data)
+        written += 1
+    return written
+
+def main():
+    args = sys.argv[1:]
+    usage = ("Usage: python previewstore.py export <catalog folder> [model or subfolder] "
+             "[--to DIR] [--overwrite]\n"
+             "       python previewstore.py stats <catalog folder>")
+    overwrite = "--overwrite" in args
+    args = [arg for arg in args if arg != "--overwrite"]
+    destination = None
+    if "--to" in args:
+        index = args.index("--to")
+        if index + 1 >= len(args):
+            print(usage)
+            return 1
+        destination = args[index + 1]
+        del args[index:index + 2]
+    if len(args) < 2 or args[0] not in ("export", "stats"):
+        print(usage)
+        return 1
+
+    root = args[1]
+    if not os.path.isdir(os.path.join(root, STORE_DIR)):
+        print(f"Error: no preview store in {root}")
+        return 1
+    with PreviewStore(root) as store:
+        if args[0] == "stats":
+            stats = store.stats()
+            print(f"{stats['previews']} previews, {stats['bytes'] / (1024 * 1024):.1f} MB "
+                  f"in {stats['shards']} shards")
+            return 0
+        prefix = args[2] if len(args) >= 3 else None
+        written = export_previews(store, prefix, destination, overwrite)
+    print(f"Exported {written} preview files")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
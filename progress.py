@@ -0,0 +1,266 @@
+import os
+import sys
+import json
+import time
+import tempfile
+import threading
+
+# Where stages send progress events: "fd:N" for an inherited pipe, or a file path
+EVENTS_ENV = "EZSTL_EVENTS"
+# What one item of each stage is, for rates such as "models/s"
+ITEM_NAMES = {"unzip": "archives", "7z": "archives", "combine": "archives",
+              "dedup": "files", "binarystl": "files", "render": "models", "cleanup": "folders",
+              "contactsheet": "folders", "catalog": "folders"}
+
+class EventEmitter:
+    """
+    Writes progress events as JSON lines, separate from the human-readable log
+
+    Events go to the channel named by EZSTL_EVENTS (if set) and to any sinks
+    registered with add_sink(), which is how in-process runs receive them.
+    """
+
+    def __init__(self, target=None):
+        self.lock = threading.Lock()
+        self.stream = None
+        self.sinks = []
+        if target:
+            try:
+                if target.startswith("fd:"):
+                    self.stream = os.fdopen(int(target[3:]), "w", encoding="utf-8", buffering=1)
+                else:
+                    self.stream = open(target, "a", encoding="utf-8", buffering=1)
+            except (OSError, ValueError) as e:
+                print(f"Could not open progress channel {target}: {e}", file=sys.stderr)
+
+    def emit(self, event, stage, **fields):
+        record = {"event": event, "stage": stage, "time": time.time()}
+        record.update(fields)
+        with self.lock:
+            if self.stream is not None:
+                try:
+                    self.stream.write(json.dumps(record) + "\n")
+                except (OSError, ValueError):
+                    # The reader went away; keep working without progress events
+                    self.stream = None
+            for sink in list(self.sinks):
+                sink(record)
+
+_emitter = None
+_emitter_lock = threading.Lock()
+
+def get_emitter():
+    global _emitter
+    with _emitter_lock:
+        if _emitter is None:
+            _emitter = EventEmitter(os.environ.get(EVENTS_ENV))
+        return _emitter
+
+def add_sink(sink):
+    """Call sink(event dict) for every event emitted in this process"""
+    emitter = get_emitter()
+    with emitter.lock:
+        emitter.sinks.append(sink)
+
+def remove_sink(sink):
+    emitter = get_emitter()
+    with emitter.lock:
+        if sink in emitter.sinks:
+            emitter.sinks.remove(sink)
+
+def stage_start(stage, total=None, total_bytes=None):
+    get_emitter().emit("stage_start", stage, total=total, total_bytes=total_bytes)
+
+def stage_add(stage, count, nbytes=0):
+    """Grow a running stage's totals, e.g. when a folder is added to a render in progress"""
+    get_emitter().emit("stage_add", stage, count=count, bytes=nbytes)
+
+def item_done(stage, item=None, nbytes=0, ok=True):
+    get_emitter().emit("item", stage, item=item, bytes=nbytes, ok=ok)
+
+def error(stage, message, item=None):
+    get_emitter().emit("error", stage, item=item, message=message)
+
+def stage_end(stage, ok=True):
+    get_emitter().emit("stage_end", stage, ok=ok)
+
+class StageProgress:
+    def __init__(self, stage, started):
+        self.stage = stage
+        self.started = started
+        self.ended = None
+        self.ok = None
+        self.total = None
+        self.total_bytes = None
+        self.done = 0
+        self.bytes = 0
+        self.errors = 0
+
+    def elapsed(self, now=None):
+        return max((self.ended or now or time.time()) - self.started, 1e-6)
+
+    def fraction(self):
+        if self.ended is not None:
+            return 1.0
+        if self.total:
+            return min(1.0, self.done / self.total)
+        if self.total_bytes:
+            return min(1.0, self.bytes / self.total_bytes)
+        return 0.0
+
+    def eta(self, now=None):
+        """Seconds left, from the bytes rate when sizes are known, else the item rate"""
+        if self.ended is not None or self.done == 0:
+            return None
+        elapsed = self.elapsed(now)
+        if self.total_bytes and self.bytes:
+            return max(0.0, (self.total_bytes - self.bytes) / (self.bytes / elapsed))
+        if self.total:
+            return max(0.0, (self.total - self.done) / (self.done / elapsed))
+        return None
+
+class ProgressTracker:
+    """Turns progress events into per-stage counts, items/s, MB/s and ETA"""
+
+    def __init__(self):
+        self.stages = {}
+        self.current = None
+
+    def update(self, event):
+        stage = self.stages.get(event["stage"])
+        if stage is None or event["event"] == "stage_start":
+            stage = StageProgress(event["stage"], event.get("time", time.time()))
+            self.stages[event["stage"]] = stage
+        self.current = stage
+        if event["event"] == "stage_start":
+            stage.total = event.get("total")
+            stage.total_bytes = event.get("total_bytes")
+        elif event["event"] == "stage_add":
+            stage.total = (stage.total or 0) + (event.get("count") or 0)
+            stage.total_bytes = (stage.total_bytes or 0) + (event.get("bytes") or 0)
+        elif event["event"] == "item":
+            stage.done += 1
+            stage.bytes += event.get("bytes") or 0
+        elif event["event"] == "error":
+            stage.errors += 1
+        elif event["event"] == "stage_end":
+            stage.ended = event.get("time", time.time())
+            stage.ok = event.get("ok", True)
+        return stage
+
+    def summary(self, stage=None, now=None):
+        """One line such as 'render: 12/40 (30.0%), 1.50 models/s, 3.2 MB/s, ETA 0:18'"""
+        stage = self.stages.get(stage) if isinstance(stage, str) else (stage or self.current)
+        if stage is None:
+            return ""
+        elapsed = stage.elapsed(now)
+        count = f"{stage.done}/{stage.total}" if stage.total is not None else f"{stage.done}"
+        parts = [f"{stage.stage}: {count} ({stage.fraction() * 100:.1f}%)",
+                 f"{stage.done / elapsed:.2f} {ITEM_NAMES.get(stage.stage, 'items')}/s"]
+        if stage.bytes:
+            parts.append(f"{stage.bytes / (1024 * 1024) / elapsed:.1f} MB/s")
+        if stage.errors:
+            parts.append(f"{stage.errors} errors")
+        eta = stage.eta(now)
+        if stage.ended is not None:
+            parts.append(f"finished in {format_duration(elapsed)}")
+        elif eta is not None:
+            parts.append(f"ETA {format_duration(eta)}")
+        return ", ".join(parts)
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
+class ConsoleProgress:
+    """Event sink for headless runs: prints a progress line at most every interval seconds"""
+
+    def __init__(self, interval=10.0):
+        self.tracker = ProgressTracker()
+        self.interval = interval
+        self.last_print = 0.0
+
+    def __call__(self, event):
+        stage = self.tracker.update(event)
+        now = time.time()
+        if event["event"] in ("stage_end", "error") or now - self.last_print >= self.interval:
+            self.last_print = now
+            print(f"[progress] {self.tracker.summary(stage, now)}")
+
+class EventChannel:
+    """
+    Receives the events of one child process
+
+    On POSIX the child writes to an inherited pipe; elsewhere it appends to a
+    temporary file that is read back while the child runs.
+    """
+
+    def __init__(self):
+        self.path = None
+        self.read_fd = self.write_fd = None
+        if os.name == "posix":
+            self.read_fd, self.write_fd = os.pipe()
+            self.target = f"fd:{self.write_fd}"
+            self.pass_fds = (self.write_fd,)
+        else:
+            fd, self.path = tempfile.mkstemp(prefix="ezstl_events_", suffix=".jsonl")
+            os.close(fd)
+            self.target = self.path
+            self.pass_fds = ()
+
+    def child_env(self):
+        env = dict(os.environ)
+        env[EVENTS_ENV] = self.target
+        return env
+
+    def child_started(self):
+        """Close the parent's copy of the write end so the reader sees EOF when the child exits"""
+        if self.write_fd is not None:
+            os.close(self.write_fd)
+            self.write_fd = None
+
+    def events(self, is_running):
+        """Yield event dicts until the child has exited and the channel is drained"""
+        if self.read_fd is not None:
+            with os.fdopen(self.read_fd, encoding="utf-8") as f:
+                self.read_fd = None
+                for line in f:
+                    event = parse_event(line)
+                    if event is not None:
+                        yield event
+            return
+        with open(self.path, encoding="utf-8") as f:
+            partial = ""
+            while True:
+                running = is_running()
+                chunk = f.read()
+                if chunk:
+                    lines = (partial + chunk).split("\n")
+                    partial = lines.pop()
+                    for line in lines:
+                        event = parse_event(line)
+                        if event is not None:
+                            yield event
+                elif not running:
+                    return
+                else:
+                    time.sleep(0.1)
+
+    def close(self):
+        for fd in (self.read_fd, self.write_fd):
+            if fd is not None:
+                os.close(fd)
+        self.read_fd = self.write_fd = None
+        if self.path:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+def parse_event(line):
+    try:
+        event = json.loads(line)
+    except ValueError:
+        return None
+    return event if isinstance(event, dict) and "event" in event else None
@@ -0,0 +1,340 @@
+import os
+import sys
+import time
+import heapq
+import itertools
+import threading
+import collections
+import multiprocessing
+import multiprocessing.connection
+from concurrent.futures import Future
+
+# Queued tasks run lowest priority first, in submission order within a priority
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+class TaskTimeout(Exception):
+    """A task ran longer than its timeout; its worker was killed"""
+
+class WorkerCrashed(Exception):
+    """The worker process died while running a task"""
+
+def current_rss_mb():
+    """Resident memory of this process in MB, or None if it cannot be measured"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+    except ImportError:
+        return None
+
+def reset_peak_rss():
+    """Reset the peak RSS (VmHWM) of this process so the next task is measured alone; Linux only"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+def peak_rss_mb():
+    """Peak resident memory of this process in MB since the last reset, or None"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+def _worker_main(conn, initializer, max_tasks, max_rss_mb):
+    if initializer is not None:
+        initializer()
+    tasks_done = 0
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            return
+        if message is None:
+            return
+        fn, args = message
+        measure_peak = reset_peak_rss()
+        try:
+            outcome = (True, fn(*args))
+        except Exception as e:
+            outcome = (False, e)
+        tasks_done += 1
+        rss = current_rss_mb()
+        peak = peak_rss_mb() if measure_peak else None
+        recycle = bool((max_tasks and tasks_done >= max_tasks)
+                       or (max_rss_mb and rss is not None and rss > max_rss_mb))
+        try:
+            conn.send(outcome + (rss, peak, recycle))
+        except Exception as e:
+            # The result or exception could not be pickled
+            conn.send((False, RuntimeError(f"{type(e).__name__}: {e}"), rss, peak, recycle))
+        if recycle:
+            return
+
+class _Worker:
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+        self.task = None
+        self.started = None
+
+class RenderPool:
+    """
+    Process pool that isolates every task in its own worker
+
+    Workers run one task at a time. A task that exceeds its timeout gets its
+    worker killed and replaced; a worker that crashes only fails the task it
+    was running. Workers are recycled after max_tasks_per_worker tasks or when
+    their RSS exceeds max_rss_mb. submit() returns concurrent.futures.Future
+    objects, so the pool can be used like a ProcessPoolExecutor.
+
+    Queued tasks wait in a priority heap: a task submitted (or later moved)
+    with PRIORITY_INTERACTIVE starts on the next free worker, ahead of the
+    PRIORITY_BACKGROUND backlog.
+    """
+
+    def __init__(self, max_workers, task_timeout=None, max_tasks_per_worker=None,
+                 max_rss_mb=None, mp_context=None, initializer=None):
+        self.max_workers = max_workers
+        self.task_timeout = task_timeout
+        self.max_tasks_per_worker = max_tasks_per_worker
+        self.max_rss_mb = max_rss_mb
+        self.initializer = initializer
+        self._ctx = mp_context or multiprocessing.get_context()
+        # Heap of [priority, sequence, task]; task is (future, fn, args, timeout, items)
+        self._pending = []
+        self._sequence = itertools.count()
+        self._workers = []
+        self._lock = threading.Lock()
+        self._wake_reader, self._wake_writer = multiprocessing.Pipe(duplex=False)
+        self._shutdown = False
+        self.stats = collections.Counter()
+        # Last RSS (MB) reported by each worker, keyed by pid
+        self.worker_rss = {}
+        with self._lock:
+            self._fill_workers()
+        self._thread = threading.Thread(target=self._supervise, daemon=True)
+        self._thread.start()
+
+    def submit(self, fn, *args, timeout=None, priority=PRIORITY_BACKGROUND, items=1):
+        """
+        Queue fn(*args); timeout overrides the pool's task_timeout
+
+        items is how many models the task renders (more than one for a batch);
+        stats["items_done"] adds it up so throughput is measured in models.
+        """
+        future = Future()
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError("cannot submit after shutdown")
+            heapq.heappush(self._pending, [priority, next(self._sequence),
+                                           (future, fn, args, timeout or self.task_timeout, items)])
+        self._wake()
+        return future
+
+    def set_priority(self, futures, priority):
+        """Move queued tasks to another priority; returns how many were still queued"""
+        futures = set(futures)
+        moved = 0
+        with self._lock:
+            for entry in self._pending:
+                if entry[2][0] in futures and entry[0] != priority:
+                    entry[0] = priority
+                    moved += 1
+            if moved:
+                heapq.heapify(self._pending)
+        return moved
+
+    def set_max_workers(self, max_workers):
+        """Change the pool size; surplus workers retire as soon as they are idle"""
+        with self._lock:
+            self.max_workers = max(1, int(max_workers))
+        self._wake()
+
+    def outstanding(self):
+        """Number of tasks queued or running"""
+        with self._lock:
+            return len(self._pending) + sum(1 for w in self._workers if w.task is not None)
+
+    def worker_pids(self):
+        with self._lock:
+            return [worker.process.pid for worker in self._workers]
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        with self._lock:
+            self._shutdown = True
+            if cancel_futures:
+                self._cancel_pending()
+        self._wake()
+        if wait:
+            self._thread.join()
+
+    def kill(self):
+        """Kill every worker at once and fail their tasks"""
+        with self._lock:
+            self._shutdown = True
+            self._cancel_pending()
+            for worker in self._workers:
+                worker.process.kill()
+        self._wake()
+        self._thread.join()
+
+    def _cancel_pending(self):
+        for _, _, task in self._pending:
+            task[0].cancel()
+        self._pending.clear()
+
+    def _wake(self):
+        try:
+            self._wake_writer.send(None)
+        except OSError:
+            pass
+
+    def _start_worker(self):
+        parent_conn, child_conn = self._ctx.Pipe()
+        process = self._ctx.Process(
+            target=_worker_main,
+            args=(child_conn, self.initializer, self.max_tasks_per_worker, self.max_rss_mb),
+            daemon=True)
+        process.start()
+        child_conn.close()
+        self._workers.append(_Worker(process, parent_conn))
+        self.stats["workers_started"] += 1
+
+    def _fill_workers(self):
+        while not self._shutdown and len(self._workers) < self.max_workers:
+            self._start_worker()
+        for worker in [w for w in self._workers if w.task is None]:
+            if len(self._workers) <= self.max_workers:
+                break
+            try:
+                worker.conn.send(None)
+            except OSError:
+                pass
+            self._retire(worker)
+
+    def _retire(self, worker, kill=False):
+        if kill:
+            worker.process.kill()
+        worker.process.join()
+        worker.conn.close()
+        self._workers.remove(worker)
+        self.worker_rss.pop(worker.process.pid, None)
+
+    def _crashed(self, worker):
+        """Reap a worker that exited or closed its pipe and fail the task it was running"""
+        worker.process.join(5)
+        if worker.process.is_alive():
+            worker.process.kill()
+            worker.process.join()
+        if worker.task is not None:
+            self.stats["workers_crashed"] += 1
+            worker.task[0].set_exception(
+                WorkerCrashed(f"worker {worker.process.pid} exited with code {worker.process.exitcode}"))
+            worker.task = None
+        self._retire(worker)
+
+    def _assign_tasks(self):
+        for worker in self._workers:
+            if worker.task is not None or not self._pending:
+                continue
+            while self._pending:
+                task = heapq.heappop(self._pending)[2]
+                if task[0].set_running_or_notify_cancel():
+                    break
+            else:
+                return
+            future, fn, args = task[:3]
+            try:
+                worker.conn.send((fn, args))
+            except Exception as e:
+                future.set_exception(e)
+                continue
+            worker.task = task
+            worker.started = time.time()
+
+    def _supervise(self):
+        while True:
+            with self._lock:
+                if self._shutdown and not self._pending and all(w.task is None for w in self._workers):
+                    break
+                self._fill_workers()
+                self._assign_tasks()
+                deadlines = [w.started + w.task[3] for w in self._workers
+                             if w.task is not None and w.task[3]]
+                waitables = [self._wake_reader]
+                for worker in self._workers:
+                    waitables.append(worker.process.sentinel)
+                    if worker.task is not None:
+                        waitables.append(worker.conn)
+
+            wait_time = 1.0
+            if deadlines:
+                wait_time = max(0.0, min(wait_time, min(deadlines) - time.time()))
+            ready = multiprocessing.connection.wait(waitables, wait_time)
+
+            with self._lock:
+                if self._wake_reader in ready:
+                    while self._wake_reader.poll():
+                        self._wake_reader.recv()
+                self._collect(ready)
+
+        for worker in list(self._workers):
+            try:
+                worker.conn.send(None)
+            except OSError:
+                pass
+            self._retire(worker)
+
+    def _collect(self, ready):
+        now = time.time()
+        for worker in list(self._workers):
+            future = worker.task[0] if worker.task is not None else None
+            if future is not None and worker.conn in ready:
+                try:
+                    ok, value, rss, peak, recycle = worker.conn.recv()
+                except (EOFError, OSError):
+                    # The worker died mid-task. Its pipe stays readable until the process is
+                    # reaped, so handle the crash now instead of spinning on it
+                    self._crashed(worker)
+                    continue
+                else:
+                    items = worker.task[4]
+                    worker.task = None
+                    self.stats["tasks_done"] += 1
+                    self.stats["items_done"] += items
+                    if rss is not None:
+                        self.worker_rss[worker.process.pid] = rss
+                    if peak is not None:
+                        # Peak RSS of the worker while it ran this task, read by callers per model
+                        future.peak_rss_mb = peak
+                        self.stats["peak_rss_mb"] = max(self.stats["peak_rss_mb"], round(peak))
+                    if ok:
+                        future.set_result(value)
+                    else:
+                        future.set_exception(value)
+                    if recycle:
+                        self.stats["workers_recycled"] += 1
+                        self._retire(worker)
+                    continue
+
+            if worker.process.sentinel in ready or not worker.process.is_alive():
+                self._crashed(worker)
+                continue
+
+            if future is not None and worker.task[3] and now - worker.started > worker.task[3]:
+                self.stats["tasks_timed_out"] += 1
+                future.set_exception(TaskTimeout(f"task exceeded {worker.task[3]:g}s"))
+                self._retire(worker, kill=True)
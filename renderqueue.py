@@ -0,0 +1,308 @@
+import os
+import sys
+import time
+import socket
+import sqlite3
+import threading
+import multiprocessing
+
+# Seconds a worker owns a job before another worker may take it over
+DEFAULT_LEASE_SECONDS = 120
+# Leases are taken over this many times before a job is marked failed
+DEFAULT_MAX_ATTEMPTS = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    path TEXT PRIMARY KEY,
+    views TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    published REAL NOT NULL,
+    finished REAL,
+    message TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, lease_expires);
+"""
+
+class RenderQueue:
+    """
+    Render job queue stored in a SQLite file on the shared volume
+
+    Job paths are stored relative to the folder holding the database, so hosts
+    that mount the share at different locations resolve them correctly. The
+    default rollback journal is used because WAL does not work over network
+    filesystems.
+    """
+
+    def __init__(self, db_path, lease_seconds=DEFAULT_LEASE_SECONDS,
+                 max_attempts=DEFAULT_MAX_ATTEMPTS):
+        self.db_path = os.path.abspath(db_path)
+        self.base_dir = os.path.dirname(self.db_path)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._local = threading.local()
+        self._connect().executescript(SCHEMA)
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+            conn.execute("PRAGMA busy_timeout = 60000")
+            self._local.conn = conn
+        return conn
+
+    def connection(self):
+        """Return a transaction on this thread's connection, for use with 'with'"""
+        return Transaction(self._connect())
+
+    def to_key(self, path):
+        path = os.path.abspath(path)
+        try:
+            relative = os.path.relpath(path, self.base_dir)
+        except ValueError:
+            return path
+        return relative.replace(os.sep, "/")
+
+    def to_path(self, key):
+        return os.path.normpath(os.path.join(self.base_dir, key))
+
+    def publish(self, files_to_process):
+        """
+        Add {model path: views} as pending jobs
+
+        Finished jobs are queued again (their previews are missing again);
+        pending, leased and failed jobs are left alone.
+        """
+        now = time.time()
+        with self.connection() as conn:
+            conn.executemany(
+                "INSERT INTO jobs (path, views, published) VALUES (?, ?, ?) "
+                "ON CONFLICT (path) DO UPDATE SET state = 'pending', views = excluded.views, "
+                "attempts = 0, worker = NULL, lease_expires = NULL, published = excluded.published "
+                "WHERE jobs.state = 'done'",
+                [(self.to_key(path), ",".join(views), now) for path, views in files_to_process.items()])
+
+    def _reclaim_expired(self, conn, now):
+        """Return jobs whose lease expired to pending, or fail them after max_attempts"""
+        # Jobs whose workers died too often are given up on
+        conn.execute(
+            "UPDATE jobs SET state = 'failed', finished = ?, "
+            "message = 'Lease expired ' || attempts || ' times' "
+            "WHERE state = 'leased' AND lease_expires < ? AND attempts >= ?",
+            (now, now, self.max_attempts))
+        return conn.execute(
+            "UPDATE jobs SET state = 'pending', worker = NULL, lease_expires = NULL "
+            "WHERE state = 'leased' AND lease_expires < ?", (now,)).rowcount
+
+    def reclaim_expired(self):
+        """
+        Requeue (or fail) jobs whose worker stopped renewing its lease
+
+        Workers do this whenever they lease; the coordinator calls it too, so a
+        job held by a dead worker is not counted as in progress forever.
+        Returns the number of jobs put back to pending.
+        """
+        with self.connection() as conn:
+            return self._reclaim_expired(conn, time.time())
+
+    def lease(self, worker_id):
+        """Take the oldest available job; returns (path, views) or None"""
+        now = time.time()
+        with self.connection() as conn:
+            self._reclaim_expired(conn, now)
+            row = conn.execute(
+                "SELECT path, views FROM jobs WHERE state = 'pending' "
+                "ORDER BY published LIMIT 1").fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE jobs SET state = 'leased', worker = ?, lease_expires = ?, "
+                "attempts = attempts + 1 WHERE path = ?",
+                (worker_id, now + self.lease_seconds, row[0]))
+        return self.to_path(row[0]), tuple(row[1].split(","))
+
+    def heartbeat(self, path, worker_id):
+        """Extend a lease; returns False if the job was taken over by another worker"""
+        with self.connection() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET lease_expires = ? WHERE path = ? AND worker = ? AND state = 'leased'",
+                (time.time() + self.lease_seconds, self.to_key(path), worker_id))
+            return cursor.rowcount == 1
+
+    def finish(self, path, worker_id, success, message):
+        with self.connection() as conn:
+            conn.execute(
+                "UPDATE jobs SET state = ?, finished = ?, message = ?, lease_expires = NULL "
+                "WHERE path = ? AND worker = ? AND state = 'leased'",
+                ("done" if success else "failed", time.time(), message,
+                 self.to_key(path), worker_id))
+
+    def counts(self):
+        """Return {state: number of jobs}"""
+        with self.connection() as conn:
+            return dict(conn.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+
+    def failures(self):
+        with self.connection() as conn:
+            return [(self.to_path(path), message) for path, message in conn.execute(
+                "SELECT path, message FROM jobs WHERE state = 'failed' ORDER BY path")]
+
+class Transaction:
+    """BEGIN IMMEDIATE ... COMMIT around a block, so leases never race"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+
+class Heartbeat(threading.Thread):
+    """Keeps a lease alive while the job renders"""
+
+    def __init__(self, queue, path, worker_id):
+        super().__init__(daemon=True)
+        self.queue = queue
+        self.path = path
+        self.worker_id = worker_id
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.queue.lease_seconds / 3):
+            try:
+                if not self.queue.heartbeat(self.path, self.worker_id):
+                    print(f"Lost lease on {self.path}")
+                    return
+            except sqlite3.Error as e:
+                print(f"Heartbeat failed for {self.path}: {e}")
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+def run_worker(db_path, lease_seconds=DEFAULT_LEASE_SECONDS, idle_exit=None, poll_interval=2.0):
+    """
+    Lease and render jobs until the queue stays empty for idle_exit seconds (None: forever)
+
+    The queue only counts as empty once no job is leased either: a job held by
+    a worker that died comes back when its lease expires, and someone has to
+    be left to render it.
+    """
+    import stlphoto18
+    queue = RenderQueue(db_path, lease_seconds)
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    idle_since = time.time()
+    rendered = 0
+    # Render in a child process so a hang or crash only fails the current job
+    pool = stlphoto18.create_render_pool(1)
+    print(f"Worker {worker_id} started on {queue.db_path}")
+    while True:
+        job = queue.lease(worker_id)
+        if job is None:
+            if (idle_exit is not None and time.time() - idle_since >= idle_exit
+                    and not queue.counts().get("leased")):
+                break
+            time.sleep(poll_interval)
+            continue
+
+        path, views = job
+        heartbeat = Heartbeat(queue, path, worker_id)
+        heartbeat.start()
+        try:
+            message, written = pool.submit(stlphoto18.process_one_file_in_subprocess,
+                                           path, views).result()
+            success = len(written) == len(views) or message.startswith("Skipping")
+        except Exception as e:
+            message, success = f"Error rendering {path}: {e}", False
+        finally:
+            heartbeat.stop()
+        queue.finish(path, worker_id, success, message)
+        print(message)
+        rendered += 1
+        idle_since = time.time()
+    pool.shutdown()
+    print(f"Worker {worker_id} finished after {rendered} jobs")
+    return rendered
+
+def start_local_workers(db_path, processes, lease_seconds=DEFAULT_LEASE_SECONDS, idle_exit=None):
+    """Start worker processes on this host; returns the Process objects"""
+    workers = []
+    for _ in range(processes):
+        worker = multiprocessing.Process(target=run_worker, args=(db_path, lease_seconds, idle_exit))
+        worker.start()
+        workers.append(worker)
+    return workers
+
+def wait_for_queue(queue, interval=5.0, workers=None):
+    """
+    Block until no job is pending or leased, printing progress
+
+    Expired leases are reclaimed on every poll. With workers (local worker
+    processes), it also returns once all of them have exited, since nothing
+    on this host is left to render the remaining jobs.
+    """
+    while True:
+        reclaimed = queue.reclaim_expired()
+        if reclaimed:
+            print(f"Queue: {reclaimed} expired leases returned to pending")
+        counts = queue.counts()
+        remaining = counts.get("pending", 0) + counts.get("leased", 0)
+        print(f"Queue: {counts.get('done', 0)} done, {counts.get('leased', 0)} rendering, "
+              f"{counts.get('pending', 0)} pending, {counts.get('failed', 0)} failed")
+        if remaining == 0:
+            return counts
+        if workers is not None and not any(worker.is_alive() for worker in workers):
+            print(f"Queue: all local workers exited with {remaining} jobs left")
+            return counts
+        time.sleep(interval)
+
+def main():
+    args = sys.argv[1:]
+    usage = ("Usage: python renderqueue.py publish <queue.db> <folder>\n"
+             "       python renderqueue.py worker <queue.db> [processes] [--idle-exit SECONDS]\n"
+             "       python renderqueue.py status <queue.db>")
+    idle_exit = None
+    if "--idle-exit" in args:
+        index = args.index("--idle-exit")
+        try:
+            idle_exit = float(args[index + 1])
+        except (IndexError, ValueError):
+            print("Error: --idle-exit needs a number of seconds")
+            return 1
+        del args[index:index + 2]
+    if len(args) < 2:
+        print(usage)
+        return 1
+
+    command, db_path = args[0], args[1]
+    if command == "publish" and len(args) == 3:
+        import stlphoto18
+        if not os.path.isdir(args[2]):
+            print(f"Error: {args[2]} is not a valid directory")
+            return 1
+        files_to_process = stlphoto18.collect_files_to_process(args[2])
+        queue = RenderQueue(db_path)
+        queue.publish(files_to_process)
+        print(f"Published {len(files_to_process)} render jobs to {queue.db_path}")
+        return 0
+    if command == "worker":
+        processes = int(args[2]) if len(args) >= 3 else 1
+        for worker in start_local_workers(db_path, processes, idle_exit=idle_exit):
+            worker.join()
+        return 0
+    if command == "status":
+        queue = RenderQueue(db_path)
+        print(queue.counts())
+        for path, message in queue.failures():
+            print(f"Failed: {path}: {message}")
+        return 0
+    print(usage)
+    return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
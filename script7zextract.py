@@ -2,6 +2,8 @@ import os
 import py7zr
 import sys
 import traceback
+import progress
+from treesnapshot import pop_snapshot_option, open_snapshot
 
 def test_py7zr():
     """Test if py7zr is working properly"""
@@ -13,9 +15,10 @@ def test_py7zr():
         print(f"Error with py7zr: {e}")
         return False
 
-def extract_7z_and_delete(file_path):
+def extract_7z_and_delete(file_path, snapshot=None):
     """Extract a .7z file and delete it after successful extraction"""
     try:
+        archive_size = os.path.getsize(file_path)
         # Create extraction directory
         extract_to = os.path.join(os.path.dirname(file_path), 
                                 os.path.splitext(os.path.basename(file_path))[0])
@@ -28,16 +31,22 @@ def extract_7z_and_delete(file_path):
         
         # Delete the original archive
         os.remove(file_path)
+        if snapshot is not None:
+            snapshot.remove_file(file_path)
+            snapshot.add_tree(extract_to)
         print(f"Successfully extracted and deleted: {file_path}")
+        progress.item_done("7z", file_path, archive_size)
         return True
     except Exception as e:
         print(f"Error processing {file_path}:")
         print(traceback.format_exc())
+        progress.error("7z", str(e), file_path)
+        progress.item_done("7z", file_path, ok=False)
         return False
 
-def process_7z_folder(folder_path):
+def process_7z_folder(folder_path, snapshot=None):
     """Process all .7z files in a folder and its subfolders"""
-    if not os.path.exists(folder_path):
+    if not (snapshot.isdir(folder_path) if snapshot is not None else os.path.exists(folder_path)):
         print(f"Error: Folder does not exist: {folder_path}")
         return False
 
@@ -47,7 +56,10 @@ def process_7z_folder(folder_path):
     
     try:
         print(f"Scanning for .7z files in: {folder_path}")
-        for root, dirs, files in os.walk(folder_path):
+        # The number of archives is not known up front: extracted folders are walked too
+        progress.stage_start("7z")
+        walker = snapshot.walk(folder_path) if snapshot is not None else os.walk(folder_path)
+        for root, dirs, files in walker:
             print(f"Checking directory: {root}")
             for file in files:
                 print(f"Found file: {file}")
@@ -55,9 +67,10 @@ def process_7z_folder(folder_path):
                     found_files = True
                     file_path = os.path.join(root, file)
                     print(f"Found .7z file: {file_path}")
-                    if not extract_7z_and_delete(file_path):
+                    if not extract_7z_and_delete(file_path, snapshot):
                         success = False
-        
+        progress.stage_end("7z", success)
+
         if not found_files:
             print("\nNo .7z files found in the specified folder.")
             print("Make sure you have .7z files in the folder and try again.")
@@ -66,6 +79,8 @@ def process_7z_folder(folder_path):
     except Exception as e:
         print(f"Error walking through folder {folder_path}:")
         print(traceback.format_exc())
+        progress.error("7z", str(e))
+        progress.stage_end("7z", False)
         success = False
     
     return success
@@ -77,11 +92,17 @@ def main():
         return 1
 
     # Check command line arguments
-    if len(sys.argv) != 2:
-        print("Usage: python script7zextract.py <folder_path>")
+    args = sys.argv[1:]
+    try:
+        snapshot_path = pop_snapshot_option(args)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return 1
+    if len(args) != 1:
+        print("Usage: python script7zextract.py <folder_path> [--snapshot FILE]")
         return 1
 
-    folder_path = sys.argv[1]
+    folder_path = args[0]
     
     # Verify folder exists
     if not os.path.isdir(folder_path):
@@ -90,7 +111,10 @@ def main():
 
     # Process the folder
     print(f"Starting to process folder: {folder_path}")
-    success = process_7z_folder(folder_path)
+    snapshot = open_snapshot(snapshot_path, folder_path) if snapshot_path else None
+    success = process_7z_folder(folder_path, snapshot)
+    if snapshot is not None:
+        snapshot.save(snapshot_path)
     
     if success:
         print("Processing completed successfully")
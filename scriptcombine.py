@@ -2,55 +2,100 @@ import os
 import shutil
 import sys
 import re
+import stat
+import errno
+import hashlib
+import tempfile
 import py7zr
 import zipfile
 import rarfile
+from concurrent.futures import ThreadPoolExecutor
+import progress
+from treesnapshot import pop_snapshot_option, open_snapshot
 
-def extract_archive(archive_path, extract_path):
+# Bytes read from each end of a file for the quick duplicate check
+EDGE_BLOCK_SIZE = 64 * 1024
+# Bytes read per call when hashing a whole file
+HASH_CHUNK_SIZE = 1024 * 1024
+# ioctl request number of FICLONE on Linux (btrfs, xfs, ...)
+FICLONE = 0x40049409
+
+def extract_archive(archive_path, extract_path, member_names=None):
     """
     Extract various archive formats (7z, zip, rar)
+
+    If member_names is a list, the archive's member names are appended to it.
     """
     try:
         file_lower = archive_path.lower()
+        names = []
         if file_lower.endswith('.7z'):
             with py7zr.SevenZipFile(archive_path, 'r') as archive:
+                names = archive.getnames()
                 archive.extractall(extract_path)
         elif file_lower.endswith('.zip'):
             with zipfile.ZipFile(archive_path, 'r') as archive:
+                names = archive.namelist()
                 archive.extractall(extract_path)
         elif file_lower.endswith('.rar'):
             with rarfile.RarFile(archive_path, 'r') as archive:
+                names = archive.namelist()
                 archive.extractall(extract_path)
+        if member_names is not None:
+            member_names.extend(names)
         return True
     except Exception as e:
         print(f"Error extracting {archive_path}: {e}")
         return False
 
-def process_folder(folder_path):
+def update_snapshot_after_extract(snapshot, folder_path, archive_path, member_names):
+    """
+    Record an extraction in the snapshot by rescanning only the archive's top-level entries
+    """
+    snapshot.remove_file(archive_path)
+    top_level = {re.split(r'[\\/]', name, 1)[0] for name in member_names}
+    for name in top_level:
+        path = os.path.join(folder_path, name)
+        if os.path.isdir(path):
+            snapshot.add_tree(path)
+        elif os.path.exists(path):
+            snapshot.add_file(path)
+
+def process_folder(folder_path, snapshot=None):
     """
     Process a folder for archives and extract them
     """
     found_archives = False
     print(f"Scanning folder: {folder_path}")
     
-    for item in os.listdir(folder_path):
+    if snapshot is not None:
+        items = sorted(snapshot.listdir(folder_path)[1])
+    else:
+        items = [item for item in os.listdir(folder_path)
+                 if os.path.isfile(os.path.join(folder_path, item))]
+    for item in items:
         item_path = os.path.join(folder_path, item)
-        if os.path.isfile(item_path):
-            if item_path.lower().endswith(('.7z', '.zip', '.rar')):
-                found_archives = True
-                print(f"Found archive: {item}")
-                extract_dir = os.path.splitext(item_path)[0]
-                if extract_archive(item_path, folder_path):
-                    os.remove(item_path)  # Remove archive after successful extraction
-                    if os.path.exists(extract_dir):
-                        process_folder(extract_dir)  # Recursively process extracted folder
+        if item_path.lower().endswith(('.7z', '.zip', '.rar')):
+            found_archives = True
+            print(f"Found archive: {item}")
+            extract_dir = os.path.splitext(item_path)[0]
+            member_names = []
+            archive_size = os.path.getsize(item_path)
+            if extract_archive(item_path, folder_path, member_names):
+                progress.item_done("combine", item_path, archive_size)
+                os.remove(item_path)  # Remove archive after successful extraction
+                if snapshot is not None:
+                    update_snapshot_after_extract(snapshot, folder_path, item_path, member_names)
+                if (snapshot.isdir(extract_dir) if snapshot is not None
+                        else os.path.exists(extract_dir)):
+                    process_folder(extract_dir, snapshot)  # Recursively process extracted folder
     
     if not found_archives:
         print("No archives found to process.")
         return True
     return True
 
-def merge_folders(root_folder, base_folder_name=None):
+def merge_folders(root_folder, base_folder_name=None, snapshot=None):
     """
     Merge the contents of folders matching a pattern
     """
@@ -59,13 +104,17 @@ def merge_folders(root_folder, base_folder_name=None):
         if not base_folder_name:
             pattern = r"(.*?)-\d{3}$"
             folders_found = False
-            for item in os.listdir(root_folder):
-                if os.path.isdir(os.path.join(root_folder, item)):
-                    match = re.match(pattern, item)
-                    if match:
-                        folders_found = True
-                        base_folder_name = match.group(1)
-                        break
+            if snapshot is not None:
+                folders = snapshot.listdir(root_folder)[0]
+            else:
+                folders = [item for item in os.listdir(root_folder)
+                           if os.path.isdir(os.path.join(root_folder, item))]
+            for item in folders:
+                match = re.match(pattern, item)
+                if match:
+                    folders_found = True
+                    base_folder_name = match.group(1)
+                    break
             
             if not folders_found:
                 print("No folders found matching the expected pattern.")
@@ -79,18 +128,254 @@ def merge_folders(root_folder, base_folder_name=None):
         print(f"An error occurred: {e}")
         return False
 
+def hash_file_edges(file_path, size):
+    """
+    Hash the first and last block of a file
+    """
+    digest = hashlib.blake2b()
+    with open(file_path, 'rb') as f:
+        digest.update(f.read(EDGE_BLOCK_SIZE))
+        if size > EDGE_BLOCK_SIZE:
+            f.seek(max(size - EDGE_BLOCK_SIZE, EDGE_BLOCK_SIZE))
+            digest.update(f.read(EDGE_BLOCK_SIZE))
+    return digest.hexdigest()
+
+def hash_file_full(file_path):
+    """
+    Hash the complete contents of a file
+    """
+    digest = hashlib.blake2b()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def group_by_hash(paths, hash_func, executor):
+    """
+    Hash files in parallel and return the groups that share a hash
+    """
+    groups = {}
+    for path, digest in zip(paths, executor.map(hash_func, paths)):
+        if digest is not None:
+            groups.setdefault(digest, []).append(path)
+    return [group for group in groups.values() if len(group) > 1]
+
+def iter_file_stats(folder_path, snapshot=None):
+    """
+    Yield (path, device, inode, size) for every regular file below folder_path
+    """
+    if snapshot is not None:
+        for root, _, _ in snapshot.walk(folder_path):
+            for file, info in snapshot.listdir(root)[1].items():
+                if info.is_file:
+                    yield os.path.join(root, file), info.device, info.inode, info.size
+        return
+    for root, _, files in os.walk(folder_path):
+        for file in files:
+            file_path = os.path.join(root, file)
+            try:
+                st = os.stat(file_path, follow_symlinks=False)
+            except OSError as e:
+                print(f"Error reading {file_path}: {e}")
+                continue
+            if stat.S_ISREG(st.st_mode):
+                yield file_path, st.st_dev, st.st_ino, st.st_size
+
+def find_duplicate_files(folder_path, max_workers=4, snapshot=None):
+    """
+    Find byte-identical files in tiers: size, then first/last block, then full hash
+
+    Returns a list of (size, paths) groups.
+    """
+    by_size = {}
+    seen_inodes = set()
+    for file_path, device, inode, size in iter_file_stats(folder_path, snapshot):
+        if size == 0:
+            continue
+        # Files that are already hardlinked together only need one entry
+        if (device, inode) in seen_inodes:
+            continue
+        seen_inodes.add((device, inode))
+        by_size.setdefault((device, size), []).append(file_path)
+
+    candidates = [(size, paths) for (_, size), paths in by_size.items() if len(paths) > 1]
+    print(f"Size check: {sum(len(paths) for _, paths in candidates)} candidate files")
+
+    def safe_hash(hash_func):
+        def wrapper(args):
+            try:
+                return hash_func(*args)
+            except OSError as e:
+                print(f"Error hashing {args[0]}: {e}")
+                return None
+        return wrapper
+
+    duplicate_groups = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for size, paths in candidates:
+            edge_groups = group_by_hash([(p, size) for p in paths],
+                                        safe_hash(hash_file_edges), executor)
+            for edge_group in edge_groups:
+                if size <= 2 * EDGE_BLOCK_SIZE:
+                    # The edge blocks already covered the whole file
+                    duplicate_groups.append((size, [p for p, _ in edge_group]))
+                    continue
+                full_groups = group_by_hash([(p,) for p, _ in edge_group],
+                                            safe_hash(hash_file_full), executor)
+                duplicate_groups.extend((size, [p for p, in group]) for group in full_groups)
+
+    return duplicate_groups
+
+def reflink_file(source, target):
+    """
+    Create target as a copy-on-write clone of source, if the filesystem supports it
+    """
+    if not sys.platform.startswith('linux'):
+        return False
+    import fcntl
+    try:
+        with open(source, 'rb') as src, open(target, 'wb') as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        return True
+    except OSError as e:
+        if os.path.exists(target):
+            os.remove(target)
+        if e.errno in (errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.ENOSYS):
+            return False
+        raise
+
+def supports_reflinks(folder_path):
+    """
+    Check once, with two small probe files in folder_path, whether its filesystem can reflink
+    """
+    source = target = None
+    try:
+        fd, source = tempfile.mkstemp(prefix=".dedup-probe-", dir=folder_path)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(b"probe")
+        fd, target = tempfile.mkstemp(prefix=".dedup-probe-", dir=folder_path)
+        os.close(fd)
+        return reflink_file(source, target)
+    except OSError:
+        return False
+    finally:
+        for path in (source, target):
+            if path is not None and os.path.exists(path):
+                os.remove(path)
+
+def replace_with_link(original, duplicate, hardlinks=False):
+    """
+    Replace duplicate with a reflink to original, or a hardlink if hardlinks is set
+
+    Reflinks are copy-on-write, so the files stay independent. Hardlinks share
+    one file: editing either path changes both, so they are only used on request.
+    Returns the method used, or None if duplicate was left as it is.
+    """
+    # A fresh name next to duplicate, so no existing file is overwritten
+    fd, temp_path = tempfile.mkstemp(prefix=".dedup-", dir=os.path.dirname(duplicate))
+    os.close(fd)
+    try:
+        if reflink_file(original, temp_path):
+            shutil.copystat(duplicate, temp_path)
+            method = "reflink"
+        elif hardlinks:
+            # os.link needs a free name; it fails rather than overwrite if the name was taken meanwhile
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            os.link(original, temp_path)
+            method = "hardlink"
+        else:
+            return None
+        os.replace(temp_path, duplicate)
+        return method
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+def deduplicate_files(folder_path, max_workers=4, snapshot=None, hardlinks=False):
+    """
+    Replace byte-identical files with reflinks and report the reclaimed space
+
+    Without reflink support duplicates are kept as copies unless hardlinks is
+    set, and the costly duplicate search is skipped altogether.
+    """
+    if not hardlinks and not supports_reflinks(folder_path):
+        print(f"Skipping duplicate search in {folder_path}: the filesystem has no reflinks "
+              f"(--dedup-hardlinks links duplicates instead)")
+        return True
+    print(f"Looking for duplicate files in: {folder_path}")
+    reclaimed_bytes = 0
+    linked_files = 0
+    kept_files = 0
+    progress.stage_start("dedup")
+    try:
+        for size, group in find_duplicate_files(folder_path, max_workers, snapshot):
+            group.sort()
+            original = group[0]
+            for duplicate in group[1:]:
+                try:
+                    method = replace_with_link(original, duplicate, hardlinks)
+                except OSError as e:
+                    print(f"Error linking {duplicate}: {e}")
+                    progress.error("dedup", str(e), duplicate)
+                    continue
+                if method is None:
+                    kept_files += 1
+                    continue
+                print(f"Linked duplicate ({method}): {duplicate} -> {original}")
+                progress.item_done("dedup", duplicate, size)
+                if snapshot is not None:
+                    snapshot.add_file(duplicate)
+                reclaimed_bytes += size
+                linked_files += 1
+    except Exception as e:
+        print(f"An error occurred during deduplication: {e}")
+        progress.error("dedup", str(e))
+        progress.stage_end("dedup", False)
+        return False
+
+    print(f"Duplicates replaced: {linked_files}, reclaimed {reclaimed_bytes / (1024 * 1024):.1f} MB")
+    if kept_files:
+        print(f"{kept_files} duplicates kept as copies: they are on a filesystem without reflinks "
+              f"(--dedup-hardlinks links them instead)")
+    progress.stage_end("dedup")
+    return True
+
+def combine_folder(folder_path, dedup=True, snapshot=None, hardlinks=False):
+    """
+    Extract nested archives, merge numbered folders and link duplicates
+    """
+    progress.stage_start("combine")
+    success = (process_folder(folder_path, snapshot)
+               and merge_folders(folder_path, snapshot=snapshot))
+    progress.stage_end("combine", success)
+    return success and (not dedup or deduplicate_files(folder_path, snapshot=snapshot, hardlinks=hardlinks))
+
 def main():
-    if len(sys.argv) != 2:
-        print("Usage: python scriptcombine.py /path/to/folder")
+    args = sys.argv[1:]
+    dedup = "--no-dedup" not in args
+    hardlinks = "--dedup-hardlinks" in args
+    args = [arg for arg in args if arg not in ("--no-dedup", "--dedup-hardlinks")]
+    try:
+        snapshot_path = pop_snapshot_option(args)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return 1
+    if len(args) != 1:
+        print("Usage: python scriptcombine.py /path/to/folder [--no-dedup] [--dedup-hardlinks] [--snapshot FILE]")
         return 1
 
-    folder_path = sys.argv[1]
+    folder_path = args[0]
     if not os.path.isdir(folder_path):
         print(f"Error: {folder_path} is not a valid directory")
         return 1
 
     print(f"Processing folder: {folder_path}")
-    if process_folder(folder_path) and merge_folders(folder_path):
+    snapshot = open_snapshot(snapshot_path, folder_path) if snapshot_path else None
+    success = combine_folder(folder_path, dedup, snapshot, hardlinks)
+    if snapshot is not None:
+        snapshot.save(snapshot_path)
+    if success:
         print("Processing completed successfully")
         return 0
     else:
@@ -0,0 +1,238 @@
+import os
+import sys
+import json
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, ImageDraw, ImageFont
+import progress
+from treesnapshot import pop_snapshot_option, open_snapshot
+
+SHEET_NAME = "_contact_sheet"
+SHEET_EXTENSION = ".jpg"
+# Signatures of the sheets written so far, kept in the root of the processed folder
+MANIFEST_FILE = ".contact_sheets.json"
+MODEL_EXTENSIONS = ('.stl', '.obj')
+# Previews tried for each model, smallest first so little has to be decoded
+PREVIEW_SUFFIXES = [f"_top_view_200{ext}" for ext in (".jpg", ".webp", ".png")] + \
+                   [f"_top_view{ext}" for ext in (".jpg", ".webp", ".png")]
+THUMB_SIZE = 200
+COLUMNS = 6
+LABEL_HEIGHT = 18
+GAP = 6
+# Larger folders get several sheets (_contact_sheet.jpg, _contact_sheet_2.jpg, ...)
+MODELS_PER_SHEET = 120
+SKIP_DIRS = ("_catalog", ".ezstl_previews")
+
+def sheet_name(page):
+    return SHEET_NAME + (f"_{page}" if page > 1 else "") + SHEET_EXTENSION
+
+def load_thumbnail(path, size=THUMB_SIZE):
+    """
+    Decode a preview at roughly size x size without decoding it at full resolution
+
+    JPEGs are decoded at a reduced scale with draft(); other formats are
+    shrunk by an integer factor with reduce() before the final resize.
+    """
+    with Image.open(path) as img:
+        if img.format == "JPEG":
+            img.draft("RGB", (size, size))
+        img = img.convert("RGB")
+    factor = min(img.width, img.height) // size
+    if factor > 1:
+        img = img.reduce(factor)
+    img.thumbnail((size, size), Image.LANCZOS)
+    return img
+
+def fit_label(draw, text, font, width):
+    """Shorten text with an ellipsis until it fits in width pixels"""
+    if draw.textlength(text, font=font) <= width:
+        return text
+    while text and draw.textlength(text + "...", font=font) > width:
+        text = text[:-1]
+    return text + "..."
+
+def build_sheet(entries, executor, columns=COLUMNS, size=THUMB_SIZE):
+    """
+    Compose one contact sheet from [(label, preview path)]; returns the image
+
+    Previews are decoded in parallel on executor; unreadable ones leave an empty cell.
+    """
+    rows = (len(entries) + columns - 1) // columns
+    cell_width = size + GAP
+    cell_height = size + LABEL_HEIGHT + GAP
+    sheet = Image.new("RGB", (columns * cell_width + GAP, rows * cell_height + GAP), (25, 25, 25))
+    draw = ImageDraw.Draw(sheet)
+    font = ImageFont.load_default()
+    thumbnails = executor.map(lambda entry: try_load_thumbnail(entry[1], size), entries)
+    for index, ((label, _), thumb) in enumerate(zip(entries, thumbnails)):
+        row, column = divmod(index, columns)
+        x, y = GAP + column * cell_width, GAP + row * cell_height
+        if thumb is not None:
+            sheet.paste(thumb, (x + (size - thumb.width) // 2, y + (size - thumb.height) // 2))
+        draw.text((x + 4, y + size + 3), fit_label(draw, label, font, size - 8), fill=(220, 220, 220), font=font)
+    return sheet
+
+def try_load_thumbnail(path, size):
+    try:
+        return load_thumbnail(path, size)
+    except Exception as e:
+        print(f"Could not read {path}: {e}")
+        return None
+
+def folder_entries(files):
+    """Return [(model name, preview name)] for the models in a folder listing that have a preview"""
+    entries = []
+    for name in sorted(files, key=str.lower):
+        if not name.lower().endswith(MODEL_EXTENSIONS):
+            continue
+        base_name = os.path.splitext(name)[0]
+        for suffix in PREVIEW_SUFFIXES:
+            if base_name + suffix in files:
+                entries.append((name, base_name + suffix))
+                break
+    return entries
+
+def list_folders(folder_path, snapshot=None):
+    """Yield (folder, {file name: (size, mtime_ns)}) for every folder under folder_path"""
+    if snapshot is not None:
+        for root, dirs, files in snapshot.walk(folder_path):
+            dirs[:] = [d for d in dirs if d not in SKIP_DIRS]
+            yield root, {name: (info.size, info.mtime_ns)
+                         for name, info in snapshot.listdir(root)[1].items()}
+        return
+    stack = [folder_path]
+    while stack:
+        root = stack.pop()
+        listing = {}
+        try:
+            with os.scandir(root) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name not in SKIP_DIRS:
+                            stack.append(entry.path)
+                        continue
+                    st = entry.stat(follow_symlinks=False)
+                    listing[entry.name] = (st.st_size, st.st_mtime_ns)
+        except OSError as e:
+            print(f"Error listing {root}: {e}")
+            continue
+        yield root, listing
+
+def build_contact_sheets(folder_path, snapshot=None, columns=COLUMNS, size=THUMB_SIZE, max_workers=8):
+    """
+    Write a contact sheet into every folder under folder_path that has rendered models
+
+    A folder's sheets are only rebuilt when its models or previews changed
+    since the last run, according to the manifest in folder_path. Returns the
+    number of folders whose sheets were written.
+    """
+    folder_path = os.path.abspath(folder_path)
+    manifest_path = os.path.join(folder_path, MANIFEST_FILE)
+    try:
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+
+    work = []
+    seen = set()
+    for root, listing in list_folders(folder_path, snapshot):
+        entries = folder_entries(listing)
+        if not entries:
+            continue
+        key = os.path.relpath(root, folder_path).replace(os.sep, "/")
+        seen.add(key)
+        signature_data = [(model, preview, listing[model], listing[preview]) for model, preview in entries]
+        signature = hashlib.sha1(json.dumps([columns, size, signature_data]).encode("utf-8")).hexdigest()
+        if manifest.get(key, {}).get("signature") == signature and sheet_name(1) in listing:
+            continue
+        work.append((root, key, entries, signature))
+
+    progress.stage_start("contactsheet", len(work))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for root, key, entries, signature in work:
+            pages = [entries[i:i + MODELS_PER_SHEET] for i in range(0, len(entries), MODELS_PER_SHEET)]
+            try:
+                for page, page_entries in enumerate(pages, start=1):
+                    sheet = build_sheet([(model, os.path.join(root, preview)) for model, preview in page_entries],
+                                        executor, columns, size)
+                    out_path = os.path.join(root, sheet_name(page))
+                    temp_path = out_path + ".tmp"
+                    sheet.save(temp_path, format="JPEG", quality=80, optimize=True)
+                    os.replace(temp_path, out_path)
+                    if snapshot is not None:
+                        snapshot.add_file(out_path)
+                # Remove sheets left over from when the folder had more models
+                for page in range(len(pages) + 1, manifest.get(key, {}).get("pages", 0) + 1):
+                    remove_sheet(os.path.join(root, sheet_name(page)), snapshot)
+            except OSError as e:
+                print(f"Error writing contact sheet for {root}: {e}")
+                progress.error("contactsheet", str(e), root)
+                progress.item_done("contactsheet", root, ok=False)
+                continue
+            manifest[key] = {"signature": signature, "pages": len(pages)}
+            print(f"Contact sheet: {root} ({len(entries)} models)")
+            progress.item_done("contactsheet", root)
+
+    # Folders that no longer have rendered models lose their sheets
+    for key in [key for key in manifest if key not in seen]:
+        root = os.path.normpath(os.path.join(folder_path, key))
+        for page in range(1, manifest[key].get("pages", 0) + 1):
+            remove_sheet(os.path.join(root, sheet_name(page)), snapshot)
+        del manifest[key]
+    temp_path = manifest_path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(temp_path, manifest_path)
+    if snapshot is not None:
+        snapshot.add_file(manifest_path)
+    progress.stage_end("contactsheet")
+    print(f"Contact sheets: {len(work)} folders rebuilt, {len(seen) - len(work)} unchanged")
+    return len(work)
+
+def remove_sheet(path, snapshot=None):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        return
+    if snapshot is not None:
+        snapshot.remove_file(path)
+
+def main():
+    args = sys.argv[1:]
+    try:
+        snapshot_path = pop_snapshot_option(args)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return 1
+    columns = COLUMNS
+    size = THUMB_SIZE
+    for name in ("--columns", "--thumb"):
+        if name in args:
+            index = args.index(name)
+            try:
+                value = int(args[index + 1])
+            except (IndexError, ValueError):
+                print(f"Error: {name} needs a number")
+                return 1
+            del args[index:index + 2]
+            if name == "--columns":
+                columns = max(1, value)
+            else:
+                size = max(32, value)
+    if len(args) != 1:
+        print("Usage: python scriptcontactsheet.py /path/to/folder [--columns N] [--thumb PX] [--snapshot FILE]")
+        return 1
+
+    folder_path = args[0]
+    if not os.path.isdir(folder_path):
+        print(f"Error: {folder_path} is not a valid directory")
+        return 1
+    snapshot = open_snapshot(snapshot_path, folder_path) if snapshot_path else None
+    build_contact_sheets(folder_path, snapshot, columns, size)
+    if snapshot is not None:
+        snapshot.save(snapshot_path)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
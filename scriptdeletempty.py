@@ -1,131 +1,417 @@
 import os
 import sys
+import json
+import time
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+import progress
+from treesnapshot import pop_snapshot_option, open_snapshot
 
-def count_images_in_folder(folder_path):
-    """Count the number of image files in a folder"""
-    image_count = 0
-    for item in os.listdir(folder_path):
-        if item.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tiff')):
-            image_count += 1
-    return image_count
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tiff', '.webp')
+MODEL_EXTENSIONS = ('.stl', '.obj')
+# Folders with at least this many files are removed with the parallel unlinker
+PARALLEL_UNLINK_THRESHOLD = 2000
 
-def is_folder_empty_or_images_only(folder_path, min_images=3, delete_mode="all"):
+def summarize_folder(folder_path, files, child_summaries):
     """
-    Check folder contents based on specified criteria
-    
+    Build the summary of one folder from its own (name, size) files and its children's summaries
+    """
+    summary = {
+        "path": folder_path,
+        "images": 0,
+        "has_model": False,
+        "has_other": False,
+        "size": 0,
+        "files": 0,
+        "children": child_summaries,
+    }
+    for name, size in files:
+        name = name.lower()
+        if name.endswith(MODEL_EXTENSIONS):
+            summary["has_model"] = True
+        elif name.endswith(IMAGE_EXTENSIONS):
+            summary["images"] += 1
+        else:
+            summary["has_other"] = True
+        summary["size"] += size
+        summary["files"] += 1
+    for child in child_summaries:
+        summary["size"] += child["size"]
+        summary["files"] += child["files"]
+    return summary
+
+def list_folder(folder_path, snapshot=None):
+    """
+    Return (subfolder paths, [(file name, size)]) from the snapshot or one os.scandir call
+    """
+    if snapshot is not None:
+        dirnames, files = snapshot.listdir(folder_path)
+        return ([os.path.join(folder_path, name) for name in dirnames],
+                [(name, info.size) for name, info in files.items()])
+    subfolders = []
+    files = []
+    with os.scandir(folder_path) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                subfolders.append(entry.path)
+                continue
+            try:
+                size = entry.stat(follow_symlinks=False).st_size
+            except OSError:
+                size = 0
+            files.append((entry.name, size))
+    return subfolders, files
+
+def scan_folder_tree(start_path, snapshot=None):
+    """
+    Scan a folder tree once, bottom-up, and return the summary of start_path
+
+    Every directory is listed exactly once; each summary holds the direct image
+    count, whether models or other files are present, and the subtree size.
+    """
+    # Iterative post-order walk: (path, child summaries, files, pending subdirs)
+    stack = [(start_path, [], [], None)]
+    while True:
+        folder_path, child_summaries, files, pending = stack[-1]
+        if pending is None:
+            try:
+                pending, files = list_folder(folder_path, snapshot)
+            except OSError as e:
+                print(f"Error checking folder {folder_path}: {e}")
+                summary = summarize_folder(folder_path, [], [])
+                summary["error"] = True
+                stack.pop()
+                if not stack:
+                    return summary
+                stack[-1][1].append(summary)
+                continue
+            stack[-1] = (folder_path, child_summaries, files, pending)
+        if pending:
+            stack.append((pending.pop(), [], [], None))
+            continue
+        summary = summarize_folder(folder_path, files, child_summaries)
+        stack.pop()
+        if not stack:
+            return summary
+        stack[-1][1].append(summary)
+
+def classify_folders(summary, min_images=3, delete_mode="all"):
+    """
+    Mark each summary as matching the delete criteria, combining children into parents
+
     Args:
-        folder_path: Path to the folder
+        summary: Folder summary from scan_folder_tree
         min_images: Minimum number of images required to keep folder
-        delete_mode: 
+        delete_mode:
             "all" - Delete folders with only images
             "few" - Delete folders with fewer than min_images
             "keep" - Keep images, delete empty folders only
     """
-    try:
-        has_non_image = False
-        has_model = False
-        image_count = 0
-        
-        for item in os.listdir(folder_path):
-            item_path = os.path.join(folder_path, item)
-            if os.path.isfile(item_path):
-                if item.lower().endswith(('.stl', '.obj')):
-                    has_model = True
-                    return False
-                elif item.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tiff')):
-                    image_count += 1
-                else:
-                    has_non_image = True
-            elif os.path.isdir(item_path):
-                if not is_folder_empty_or_images_only(item_path, min_images, delete_mode):
-                    return False
-
-        if has_model:
-            return False
-        
+    children_match = True
+    for child in summary["children"]:
+        if not classify_folders(child, min_images, delete_mode):
+            children_match = False
+
+    matches = False
+    if children_match and not summary["has_model"] and not summary.get("error"):
         if delete_mode == "all":
-            return not has_non_image
+            matches = not summary["has_other"]
         elif delete_mode == "few":
-            return not has_non_image and image_count < min_images
+            matches = not summary["has_other"] and summary["images"] < min_images
         elif delete_mode == "keep":
-            return not has_non_image and image_count == 0
-        
-        return False
-    except Exception as e:
-        print(f"Error checking folder {folder_path}: {e}")
-        return False
+            matches = not summary["has_other"] and summary["images"] == 0
+    summary["matches"] = matches
+    return matches
+
+def build_deletion_plan(start_path, min_images=3, delete_mode="all", snapshot=None):
+    """
+    Return the folders under start_path matching the delete criteria, children first
+    """
+    root_summary = scan_folder_tree(start_path, snapshot)
+    classify_folders(root_summary, min_images, delete_mode)
 
-def delete_empty_folders(start_path, min_images=3, delete_mode="all"):
+    plan = []
+    def collect(summary):
+        for child in summary["children"]:
+            collect(child)
+            if child["matches"]:
+                plan.append({
+                    "path": child["path"],
+                    "size": child["size"],
+                    "images": child["images"],
+                    "files": child["files"],
+                })
+    collect(root_summary)
+    return plan
+
+def delete_empty_folders(start_path, min_images=3, delete_mode="all", snapshot=None):
     """Delete folders based on specified criteria"""
     print(f"Scanning: {start_path}")
     print(f"Mode: {delete_mode}, Minimum images: {min_images}")
     folders_deleted = 0
-    
-    for root, dirs, files in os.walk(start_path, topdown=False):
-        for dir_name in dirs:
-            folder_path = os.path.join(root, dir_name)
-            
-            try:
-                if is_folder_empty_or_images_only(folder_path, min_images, delete_mode):
-                    print(f"\nFound folder matching criteria: {folder_path}")
-                    image_count = count_images_in_folder(folder_path)
-                    print(f"Images in folder: {image_count}")
-                    
-                    while True:
-                        response = input(f"Delete this folder and its contents? (y/n): ").lower().strip()
-                        if response in ['y', 'n']:
-                            break
-                        print("Please enter 'y' for yes or 'n' for no.")
-                    
-                    if response == 'y':
-                        # Delete all files in the folder first
-                        for file in os.listdir(folder_path):
-                            file_path = os.path.join(folder_path, file)
-                            if os.path.isfile(file_path):
-                                os.remove(file_path)
-                                print(f"Deleted file: {file_path}")
-                        # Then delete the folder
-                        os.rmdir(folder_path)
-                        print(f"Deleted folder: {folder_path}")
-                        folders_deleted += 1
-                    else:
-                        print(f"Skipped folder: {folder_path}")
-            except Exception as e:
-                print(f"Error processing {folder_path}: {e}")
-                continue
+
+    for folder in build_deletion_plan(start_path, min_images, delete_mode, snapshot):
+        folder_path = folder["path"]
+        try:
+            print(f"\nFound folder matching criteria: {folder_path}")
+            print(f"Images in folder: {folder['images']}")
+
+            while True:
+                response = input(f"Delete this folder and its contents? (y/n): ").lower().strip()
+                if response in ['y', 'n']:
+                    break
+                print("Please enter 'y' for yes or 'n' for no.")
+
+            if response == 'y':
+                # Delete all files in the folder first
+                for file in os.listdir(folder_path):
+                    file_path = os.path.join(folder_path, file)
+                    if os.path.isfile(file_path):
+                        os.remove(file_path)
+                        print(f"Deleted file: {file_path}")
+                # Then delete the folder
+                os.rmdir(folder_path)
+                if snapshot is not None:
+                    snapshot.remove_tree(folder_path)
+                print(f"Deleted folder: {folder_path}")
+                folders_deleted += 1
+            else:
+                print(f"Skipped folder: {folder_path}")
+        except Exception as e:
+            print(f"Error processing {folder_path}: {e}")
+            continue
 
     print(f"\nTotal folders deleted: {folders_deleted}")
 
+def make_plan_data(plan, start_path, min_images, delete_mode):
+    """Wrap a list of planned folders with the settings needed to apply it"""
+    return {
+        "root": start_path,
+        "min_images": min_images,
+        "delete_mode": delete_mode,
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        # A folder's size includes its subfolders, so nested entries are not added again
+        "total_size": sum(folder["size"] for folder in top_level_folders(plan)),
+        "folders": plan,
+    }
+
+def write_deletion_plan(plan, plan_path, start_path, min_images, delete_mode):
+    """Write a deletion plan to a JSON file"""
+    data = make_plan_data(plan, start_path, min_images, delete_mode)
+    with open(plan_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+    return data
+
+def load_deletion_plan(plan_path):
+    """Read a deletion plan written by write_deletion_plan"""
+    with open(plan_path, encoding="utf-8") as f:
+        return json.load(f)
+
+def top_level_folders(folders):
+    """Drop plan entries that are inside another entry; removing the parent covers them"""
+    kept = set()
+    result = []
+    # A parent's path is shorter than any path inside it, so parents are kept first
+    for folder in sorted(folders, key=lambda f: len(f["path"])):
+        path = folder["path"]
+        parent = os.path.dirname(path)
+        while parent != path and parent not in kept:
+            path, parent = parent, os.path.dirname(parent)
+        if parent in kept and parent != path:
+            continue
+        kept.add(folder["path"])
+        result.append(folder)
+    return sorted(result, key=lambda f: f["path"])
+
+def describe_plan(data):
+    """Return a one-line summary of a deletion plan"""
+    folders = data["folders"]
+    images = sum(folder["images"] for folder in folders)
+    return (f"{len(folders)} folders, {images} images, "
+            f"{data['total_size'] / (1024 * 1024):.1f} MB")
+
+def parallel_unlink(folder_path, max_workers=8):
+    """Remove a large folder tree, unlinking files on a thread pool"""
+    files = []
+    dirs = []
+    stack = [folder_path]
+    while stack:
+        current = stack.pop()
+        dirs.append(current)
+        with os.scandir(current) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                else:
+                    files.append(entry.path)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(os.unlink, files, chunksize=256))
+
+    # Parents were appended before their children
+    for current in reversed(dirs):
+        os.rmdir(current)
+
+def apply_deletion_plan(data, max_workers=8, snapshot=None):
+    """
+    Delete every folder of a plan in one pass
+
+    Folders whose contents changed since the plan was written are skipped.
+    """
+    folders_deleted = 0
+    bytes_freed = 0
+    folders = top_level_folders(data["folders"])
+    progress.stage_start("cleanup", len(folders), sum(folder["size"] for folder in folders))
+    for folder in folders:
+        folder_path = folder["path"]
+        deleted = False
+        try:
+            if not os.path.isdir(folder_path):
+                print(f"Skipped (no longer exists): {folder_path}")
+                continue
+            summary = scan_folder_tree(folder_path)
+            classify_folders(summary, data["min_images"], data["delete_mode"])
+            if (not summary["matches"] or summary["files"] != folder["files"]
+                    or summary["size"] != folder["size"]):
+                print(f"Skipped (changed since plan was written): {folder_path}")
+                continue
+
+            if folder["files"] >= PARALLEL_UNLINK_THRESHOLD:
+                parallel_unlink(folder_path, max_workers)
+            else:
+                shutil.rmtree(folder_path)
+            if snapshot is not None:
+                snapshot.remove_tree(folder_path)
+            print(f"Deleted folder: {folder_path}")
+            folders_deleted += 1
+            bytes_freed += folder["size"]
+            deleted = True
+        except Exception as e:
+            print(f"Error processing {folder_path}: {e}")
+            progress.error("cleanup", str(e), folder_path)
+            continue
+        finally:
+            progress.item_done("cleanup", folder_path, folder["size"], ok=deleted)
+
+    progress.stage_end("cleanup")
+    print(f"\nTotal folders deleted: {folders_deleted}, "
+          f"freed {bytes_freed / (1024 * 1024):.1f} MB")
+    return folders_deleted
+
+def confirm_plan(data):
+    """Ask once for the whole plan"""
+    if sys.stdin is None or not sys.stdin.isatty():
+        print("No interactive input available; run with --yes to apply the plan.")
+        return False
+    while True:
+        response = input(f"Delete {describe_plan(data)}? (y/n): ").lower().strip()
+        if response in ['y', 'n']:
+            return response == 'y'
+        print("Please enter 'y' for yes or 'n' for no.")
+
+def pop_option(args, name, has_value=False):
+    """Remove a --flag (and its value) from args and return it"""
+    if name not in args:
+        return None
+    index = args.index(name)
+    if not has_value:
+        del args[index]
+        return True
+    if index + 1 >= len(args):
+        raise ValueError(f"{name} requires a value")
+    value = args[index + 1]
+    del args[index:index + 2]
+    return value
+
 def main():
-    if len(sys.argv) < 2:
+    args = sys.argv[1:]
+    try:
+        batch = pop_option(args, "--batch")
+        dry_run = pop_option(args, "--dry-run")
+        assume_yes = pop_option(args, "--yes")
+        plan_path = pop_option(args, "--plan", has_value=True) or "deletion_plan.json"
+        apply_path = pop_option(args, "--apply", has_value=True)
+        max_workers = int(pop_option(args, "--workers", has_value=True) or 8)
+        snapshot_path = pop_snapshot_option(args)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return 1
+
+    if apply_path:
+        data = load_deletion_plan(apply_path)
+        if args and os.path.abspath(args[0].strip('"\'')) != data["root"]:
+            print(f"Error: plan was written for {data['root']}")
+            return 1
+        print(f"Applying plan {apply_path}: {describe_plan(data)}")
+        if not assume_yes and not confirm_plan(data):
+            print("Plan not applied.")
+            return 0
+        snapshot = open_snapshot(snapshot_path, data["root"]) if snapshot_path else None
+        apply_deletion_plan(data, max_workers, snapshot)
+        if snapshot is not None:
+            snapshot.save(snapshot_path)
+        return 0
+
+    if len(args) < 1:
         print("Usage: python scriptdeletempty.py <folder_path> [min_images] [delete_mode]")
+        print("       python scriptdeletempty.py <folder_path> [min_images] [delete_mode] --batch [--plan FILE] [--dry-run] [--yes]")
+        print("       python scriptdeletempty.py --apply FILE [--yes]")
+        print("Add --snapshot FILE to reuse (and update) a shared folder snapshot.")
         print("Delete modes:")
         print("  all  - Delete folders with only images (default)")
         print("  few  - Delete folders with fewer than min_images")
         print("  keep - Keep images, delete empty folders only")
+        print("Batch mode writes the deletion plan to FILE and confirms once for the whole plan.")
         return 1
 
-    folder_path = ' '.join(sys.argv[1:-2] if len(sys.argv) > 3 else [sys.argv[1]])
+    # Unquoted paths with spaces arrive as several arguments
+    if len(args) > 3:
+        folder_parts, extra = args[:-2], args[-2:]
+    else:
+        folder_parts, extra = args[:1], args[1:]
+    folder_path = ' '.join(folder_parts)
     folder_path = folder_path.strip('"\'')
     folder_path = os.path.abspath(folder_path)
 
     min_images = 3
     delete_mode = "all"
 
-    if len(sys.argv) > 2:
+    if extra:
         try:
-            min_images = int(sys.argv[-2])
+            min_images = int(extra[0])
         except ValueError:
-            delete_mode = sys.argv[-2]
+            delete_mode = extra[0]
     
-    if len(sys.argv) > 3:
-        delete_mode = sys.argv[-1]
+    if len(extra) > 1:
+        delete_mode = extra[1]
 
     if not os.path.isdir(folder_path):
         print(f"Error: '{folder_path}' is not a valid directory")
         return 1
 
-    delete_empty_folders(folder_path, min_images, delete_mode)
+    snapshot = open_snapshot(snapshot_path, folder_path) if snapshot_path else None
+    if not batch:
+        delete_empty_folders(folder_path, min_images, delete_mode, snapshot)
+        if snapshot is not None:
+            snapshot.save(snapshot_path)
+        return 0
+
+    print(f"Scanning: {folder_path}")
+    print(f"Mode: {delete_mode}, Minimum images: {min_images}")
+    plan = build_deletion_plan(folder_path, min_images, delete_mode, snapshot)
+    data = write_deletion_plan(plan, plan_path, folder_path, min_images, delete_mode)
+    for folder in plan:
+        print(f"Planned: {folder['path']} ({folder['images']} images, {folder['size']} bytes)")
+    print(f"Deletion plan written to {plan_path}: {describe_plan(data)}")
+
+    if dry_run or not plan:
+        return 0
+    if not assume_yes and not confirm_plan(data):
+        print("Plan not applied.")
+        return 0
+    apply_deletion_plan(data, max_workers, snapshot)
+    if snapshot is not None:
+        snapshot.save(snapshot_path)
     return 0
 
 if __name__ == "__main__":
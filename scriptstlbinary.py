@@ -0,0 +1,250 @@
+import os
+import re
+import sys
+import time
+import shutil
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import progress
+from treesnapshot import pop_snapshot_option, open_snapshot
+from objreader import parse_numbers
+
+# Binary STL: 80-byte header, uint32 triangle count, then one record per triangle
+STL_RECORD = np.dtype([("normal", "<f4", (3,)), ("vertices", "<f4", (3, 3)), ("attributes", "<u2")])
+STL_HEADER = b"EZ STL Cataloger: converted from ASCII STL".ljust(80, b" ")
+# ASCII files are parsed this many bytes at a time, so memory stays flat on huge files
+READ_CHUNK = 16 * 1024 * 1024
+# Suffix of the ASCII original when it is kept; not a model extension, so it is never rendered
+ORIGINAL_SUFFIX = ".ascii"
+# The coordinates following each keyword, up to the end of its line
+NORMAL_VALUES = re.compile(rb"\bnormal[ \t]+([^\r\n]*)")
+VERTEX_VALUES = re.compile(rb"\bvertex[ \t]+([^\r\n]*)")
+
+def is_ascii_stl(file_path):
+    """
+    Return True if file_path is an ASCII STL
+
+    Binary files whose 80-byte header happens to start with "solid" are told
+    apart by their size, which is exactly 84 + 50 * triangle count.
+    """
+    with open(file_path, "rb") as f:
+        head = f.read(512)
+    if not head.lstrip().lower().startswith(b"solid"):
+        return False
+    if len(head) >= 84:
+        count = int.from_bytes(head[80:84], "little")
+        if os.path.getsize(file_path) == 84 + 50 * count:
+            return False
+    return b"facet" in head.lower() or len(head) < 512
+
+def parse_ascii_chunk(data):
+    """
+    Parse whole facets from ASCII STL text into STL records, vectorized
+
+    Only the text after each "normal" and "vertex" keyword is kept and parsed
+    by numpy, so memory stays close to the size of the chunk whatever the
+    solid names, blank lines and indentation look like.
+    """
+    data = data.lower()
+    normals = NORMAL_VALUES.findall(data)
+    vertices = VERTEX_VALUES.findall(data)
+    if len(vertices) != 3 * len(normals):
+        raise ValueError(f"{len(normals)} facets but {len(vertices)} vertices; only triangles are supported")
+    records = np.zeros(len(normals), dtype=STL_RECORD)
+    if not normals:
+        return records
+    normal_values = parse_numbers(b" ".join(normals), np.float32)
+    vertex_values = parse_numbers(b" ".join(vertices), np.float32)
+    if len(normal_values) != 3 * len(normals) or len(vertex_values) != 3 * len(vertices):
+        raise ValueError("normals and vertices need exactly three coordinates")
+    records["normal"] = normal_values.reshape(-1, 3)
+    records["vertices"] = vertex_values.reshape(-1, 3, 3)
+    return records
+
+def convert_to_binary(file_path, out_path):
+    """Stream an ASCII STL into a binary STL at out_path; returns the triangle count"""
+    count = 0
+    with open(file_path, "rb") as src, open(out_path, "wb") as dst:
+        dst.write(STL_HEADER)
+        dst.write(b"\0\0\0\0")
+        carry = b""
+        while True:
+            chunk = src.read(READ_CHUNK)
+            data = carry + chunk
+            if chunk:
+                # Only parse up to the last complete facet; the rest waits for the next chunk
+                end = data.lower().rfind(b"endfacet")
+                if end < 0:
+                    carry = data
+                    continue
+                end += len(b"endfacet")
+                data, carry = data[:end], data[end:]
+            records = parse_ascii_chunk(data)
+            records.tofile(dst)
+            count += len(records)
+            if not chunk:
+                break
+        dst.seek(80)
+        dst.write(np.uint32(count).tobytes())
+    return count
+
+def time_load(file_path):
+    import trimesh
+    started = time.perf_counter()
+    with open(file_path, "rb") as f:
+        trimesh.load(f, file_type="stl", force="mesh")
+    return time.perf_counter() - started
+
+def normalize_file(file_path, keep_original=False, measure=False):
+    """
+    Convert one ASCII STL to binary in place
+
+    The binary file is written next to the original and swapped in with
+    os.replace, so the model is never missing or half-written. Returns
+    (file path, ascii size, binary size, triangles, ascii load s, binary load s, kept path);
+    load times are None unless measure is set.
+    """
+    temp_path = file_path + ".binary.tmp"
+    try:
+        stat = os.stat(file_path)
+        triangles = convert_to_binary(file_path, temp_path)
+        if triangles == 0:
+            raise ValueError("no facets found")
+        ascii_load = binary_load = None
+        if measure:
+            ascii_load = time_load(file_path)
+            binary_load = time_load(temp_path)
+        # Keep the model's timestamps: the geometry did not change
+        os.utime(temp_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        kept_path = None
+        if keep_original:
+            kept_path = file_path + ORIGINAL_SUFFIX
+            try:
+                os.link(file_path, kept_path)
+            except (OSError, AttributeError):
+                # No hard links on this filesystem (e.g. FAT drives)
+                shutil.copy2(file_path, kept_path)
+        os.replace(temp_path, file_path)
+        return file_path, stat.st_size, os.path.getsize(file_path), triangles, ascii_load, binary_load, kept_path
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def collect_ascii_stls(folder_path, snapshot=None):
+    """Return [(path, size)] of the ASCII STL files under folder_path"""
+    found = []
+    walker = snapshot.walk(folder_path) if snapshot is not None else os.walk(folder_path)
+    for root, dirs, files in walker:
+        for file in files:
+            if not file.lower().endswith(".stl"):
+                continue
+            file_path = os.path.join(root, file)
+            try:
+                if is_ascii_stl(file_path):
+                    found.append((file_path, os.path.getsize(file_path)))
+            except OSError as e:
+                print(f"Could not read {file_path}: {e}")
+    return found
+
+def normalize_folder(folder_path, max_workers=4, keep_original=False, measure=3, snapshot=None):
+    """
+    Convert every ASCII STL under folder_path to binary STL in parallel
+
+    measure is the number of files whose trimesh load time is compared before
+    and after conversion. Returns True if every conversion succeeded.
+    """
+    files = collect_ascii_stls(folder_path, snapshot)
+    progress.stage_start("binarystl", len(files), sum(size for _, size in files))
+    if not files:
+        print("No ASCII STL files found.")
+        progress.stage_end("binarystl")
+        return True
+
+    print(f"Converting {len(files)} ASCII STL files to binary with {max_workers} workers")
+    success = True
+    ascii_bytes = binary_bytes = 0
+    ascii_load = binary_load = 0.0
+    measured = 0
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(normalize_file, file_path, keep_original, index < measure): (file_path, size)
+                   for index, (file_path, size) in enumerate(files)}
+        for future in as_completed(futures):
+            file_path, size = futures[future]
+            try:
+                _, old_size, new_size, triangles, old_load, new_load, kept_path = future.result()
+            except ValueError as e:
+                # Malformed files stay as they are; the render stage reports them
+                print(f"Skipping {file_path}, left unchanged: {e}")
+                progress.item_done("binarystl", file_path, size, ok=False)
+                continue
+            except Exception as e:
+                print(f"Error converting {file_path}: {e}")
+                progress.error("binarystl", str(e), file_path)
+                progress.item_done("binarystl", file_path, size, ok=False)
+                success = False
+                continue
+            ascii_bytes += old_size
+            binary_bytes += new_size
+            if old_load is not None:
+                ascii_load += old_load
+                binary_load += new_load
+                measured += 1
+            if snapshot is not None:
+                snapshot.add_file(file_path)
+                if kept_path:
+                    snapshot.add_file(kept_path)
+            print(f"Converted: {file_path} ({triangles} triangles, "
+                  f"{old_size / (1024 * 1024):.1f} MB -> {new_size / (1024 * 1024):.1f} MB)")
+            progress.item_done("binarystl", file_path, size)
+    progress.stage_end("binarystl", success)
+
+    saved = ascii_bytes - binary_bytes
+    print(f"Saved {saved / (1024 * 1024):.1f} MB "
+          f"({ascii_bytes / (1024 * 1024):.1f} MB ASCII -> {binary_bytes / (1024 * 1024):.1f} MB binary)")
+    if measured and binary_load > 0:
+        print(f"Load time over {measured} sample files: {ascii_load:.2f}s ASCII, {binary_load:.2f}s binary "
+              f"({ascii_load / binary_load:.1f}x faster)")
+    return success
+
+def main():
+    args = sys.argv[1:]
+    try:
+        snapshot_path = pop_snapshot_option(args)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return 1
+    keep_original = "--keep-original" in args
+    args = [arg for arg in args if arg != "--keep-original"]
+    measure = 3
+    if "--measure" in args:
+        index = args.index("--measure")
+        try:
+            measure = int(args[index + 1])
+        except (IndexError, ValueError):
+            print("Error: --measure needs a number of files")
+            return 1
+        del args[index:index + 2]
+    if len(args) not in (1, 2):
+        print("Usage: python scriptstlbinary.py /path/to/folder [max_workers] [--keep-original] "
+              "[--measure N] [--snapshot FILE]")
+        return 1
+
+    folder_path = args[0]
+    if not os.path.isdir(folder_path):
+        print(f"Error: {folder_path} is not a valid directory")
+        return 1
+    try:
+        max_workers = int(args[1]) if len(args) == 2 else os.cpu_count() or 4
+    except ValueError:
+        print("Error: max_workers must be a number")
+        return 1
+
+    snapshot = open_snapshot(snapshot_path, folder_path) if snapshot_path else None
+    success = normalize_folder(folder_path, max_workers, keep_original, measure, snapshot)
+    if snapshot is not None:
+        snapshot.save(snapshot_path)
+    return 0 if success else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,11 +2,19 @@ import os
 import zipfile
 import tarfile
 import subprocess
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, wait
 import sys
+import progress
+from treesnapshot import pop_snapshot_option, open_snapshot
+
+ARCHIVE_EXTENSIONS = ('.zip', '.tar.gz', '.tgz', '.tar', '.rar')
 
 # Function to extract and delete a compressed file
-def extract_and_delete(file_path):
+def extract_and_delete(file_path, snapshot=None):
+    try:
+        archive_size = os.path.getsize(file_path)
+    except OSError:
+        archive_size = 0
     extract_to = os.path.join(os.path.dirname(file_path), os.path.splitext(os.path.basename(file_path))[0])
     os.makedirs(extract_to, exist_ok=True)  # Create output folder if it doesn't exist
     try:
@@ -22,36 +30,61 @@ def extract_and_delete(file_path):
             subprocess.run([winrar_path, "x", "-y", file_path, extract_to], check=True)
         else:
             print(f"Unsupported file type: {file_path}")
+            progress.item_done("unzip", file_path, ok=False)
             return
         print(f"Extracted: {file_path} -> {extract_to}")
         os.remove(file_path)  # Delete the compressed file after extraction
         print(f"Deleted: {file_path}")
+        if snapshot is not None:
+            snapshot.remove_file(file_path)
+            snapshot.add_tree(extract_to)
+        progress.item_done("unzip", file_path, archive_size)
     except Exception as e:
         print(f"Error processing {file_path}: {e}")
+        progress.error("unzip", str(e), file_path)
+        progress.item_done("unzip", file_path, archive_size, ok=False)
 
 # Recursive function to scan and extract files
-def process_folder(folder_path, executor):
-    for root, dirs, files in os.walk(folder_path):
+def process_folder(folder_path, executor, snapshot=None):
+    archives = []
+    walker = snapshot.walk(folder_path) if snapshot is not None else os.walk(folder_path)
+    for root, dirs, files in walker:
         for file in files:
-            file_path = os.path.join(root, file)
-            if file.endswith(('.zip', '.tar.gz', '.tgz', '.tar', '.rar')):
-                # Submit the extraction task to the thread pool
-                executor.submit(extract_and_delete, file_path)
+            if file.endswith(ARCHIVE_EXTENSIONS):
+                archives.append(os.path.join(root, file))
+
+    sizes = []
+    for file_path in archives:
+        info = snapshot.file_info(file_path) if snapshot is not None else None
+        try:
+            sizes.append(info.size if info is not None else os.path.getsize(file_path))
+        except OSError:
+            pass
+    progress.stage_start("unzip", len(archives), sum(sizes))
+    # Submit the extraction tasks to the thread pool
+    futures = [executor.submit(extract_and_delete, file_path, snapshot) for file_path in archives]
+    wait(futures)
+    progress.stage_end("unzip")
 
 # Path to the main folder
 main_folder = r"D:\STLPROCESSIOR"
 
 # Start processing
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python scriptunzipmultirar.py /path/to/folder")
+    args = sys.argv[1:]
+    snapshot_path = pop_snapshot_option(args)
+    if len(args) != 1:
+        print("Usage: python scriptunzipmultirar.py /path/to/folder [--snapshot FILE]")
         sys.exit(1)
 
-    folder_path = sys.argv[1]
+    folder_path = args[0]
     if not os.path.isdir(folder_path):
         print(f"Error: {folder_path} is not a valid directory")
         sys.exit(1)
 
+    snapshot = open_snapshot(snapshot_path, folder_path) if snapshot_path else None
     MAX_THREADS = 3
     with ThreadPoolExecutor(max_workers=MAX_THREADS) as executor:
-        process_folder(folder_path, executor)
+        process_folder(folder_path, executor, snapshot)
+    if snapshot is not None:
+        snapshot.save(snapshot_path)
@@ -6,7 +6,46 @@ import trimesh
 import trimesh.transformations as tf
 from PIL import Image
 import pyrender
+import io
+import json
+import time
 import concurrent.futures
+import progress
+from treesnapshot import pop_snapshot_option, open_snapshot
+from renderpool import RenderPool, TaskTimeout, WorkerCrashed, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
+from autotune import AUTO, AutoTuner, initial_worker_count, parse_worker_count
+from previewstore import PreviewStore
+from objreader import load_obj_mesh
+
+VIEW_SUFFIXES = {"top": "_top_view.png", "front": "_front_view.png"}
+# Views are rendered at the largest configured size; smaller sizes are downscaled from it
+RENDER_SIZE = 800
+MODEL_COLOR = (200, 150, 100)
+IMAGE_FORMATS = {"png": ".png", "webp": ".webp", "jpeg": ".jpg"}
+DEFAULT_ENCODER = {"format": "png", "quality": 85, "png_level": 6, "sizes": (RENDER_SIZE,)}
+
+# Render pool limits: seconds per model, models per worker, worker RSS in MB
+DEFAULT_TASK_TIMEOUT = 300
+DEFAULT_MAX_TASKS_PER_WORKER = 100
+DEFAULT_MAX_RSS_MB = 4096
+# Models that hung or crashed a worker, kept in the root of the rendered folder
+QUARANTINE_FILE = ".render_quarantine.json"
+# Folders to render ahead of the backlog, one path per line, in the root of the rendered folder
+PRIORITY_INBOX_FILE = ".render_inbox"
+# Seconds between checks of the priority inbox while rendering
+INBOX_POLL_SECONDS = 1.0
+# "files" writes loose PNGs next to the models, "store" appends them to a PreviewStore
+OUTPUT_BACKENDS = ("files", "store")
+# Rendered models between commits of the preview store
+STORE_COMMIT_EVERY = 50
+# With batching, models up to this many triangles are rendered BATCH_SIZE at a time in one framebuffer
+DEFAULT_BATCH_TRIANGLES = 20000
+BATCH_SIZE = 9
+# Rough file bytes per triangle, for models without a binary STL header
+ASCII_STL_BYTES_PER_TRIANGLE = 250
+OBJ_BYTES_PER_TRIANGLE = 30
+# Half the height the perspective camera sees at the model; orthographic tiles use the same framing
+TILE_HALF_EXTENT = 5.0 * math.tan(math.radians(30.0))
 
 def center_and_fit_no_division(mesh):
     bounds = mesh.bounds
@@ -46,164 +85,909 @@ def camera_front_view():
     rot_x_90 = tf.rotation_matrix(math.radians(90), [1, 0, 0])
     return trans @ rot_x_90
 
-def render_offscreen_with_pyrender(mesh, camera_transform, out_png):
-    pyr_mesh = pyrender.Mesh.from_trimesh(mesh, smooth=False)
+CAMERAS = {"top": camera_top_view, "front": camera_front_view}
+
+def build_render_mesh(vertices, faces):
+    """
+    Turn prepared float32 vertices and faces into a flat-shaded pyrender mesh built from compact buffers
+
+    Equivalent to pyrender.Mesh.from_trimesh(mesh, smooth=False) with a vertex
+    color, but the per-face vertex copies and normals are float32, face normals
+    are computed directly instead of through trimesh's float64 caches, and the
+    model color is a material factor instead of a per-vertex color array.
+    """
+    positions = vertices[faces].reshape(-1, 3)
+    del vertices, faces
+    triangles = positions.reshape(-1, 3, 3)
+    face_normals = np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0])
+    del triangles
+    lengths = np.linalg.norm(face_normals, axis=1, keepdims=True)
+    np.divide(face_normals, lengths, out=face_normals, where=lengths > 0)
+    face_normals[lengths[:, 0] == 0] = 0
+    normals = np.repeat(face_normals, 3, axis=0)
+    del face_normals, lengths
+    material = pyrender.MetallicRoughnessMaterial(
+        alphaMode='BLEND',
+        baseColorFactor=[c / 255.0 for c in MODEL_COLOR] + [1.0],
+        metallicFactor=0.2,
+        roughnessFactor=0.8
+    )
+    primitive = pyrender.Primitive(positions=positions, normals=normals,
+                                   material=material, mode=pyrender.constants.GLTF.TRIANGLES)
+    return pyrender.Mesh(primitives=[primitive])
+
+_renderer = None
+
+def get_renderer(width, height):
+    """Return this process's offscreen renderer, reused across views and models"""
+    global _renderer
+    if _renderer is None:
+        _renderer = pyrender.OffscreenRenderer(viewport_width=width, viewport_height=height)
+    elif (_renderer.viewport_width, _renderer.viewport_height) != (width, height):
+        _renderer.viewport_width = width
+        _renderer.viewport_height = height
+    return _renderer
+
+def reset_renderer():
+    """Drop the renderer after a failed render so the next one starts from a fresh context"""
+    global _renderer
+    if _renderer is not None:
+        try:
+            _renderer.delete()
+        except Exception:
+            pass
+        _renderer = None
 
+def release_meshes():
+    """
+    Make the renderer let go of the meshes it rendered last
+
+    pyrender keeps a scene's meshes (GPU buffers and their float32 host copies)
+    until it renders another scene, which would keep them alive while the next
+    model loads. Rendering an empty scene, depth only, frees them right away.
+    """
+    if _renderer is None:
+        return
+    scene = pyrender.Scene()
+    scene.add(pyrender.OrthographicCamera(xmag=1.0, ymag=1.0))
+    try:
+        _renderer.render(scene, flags=pyrender.RenderFlags.DEPTH_ONLY)
+    except Exception:
+        reset_renderer()
+
+def make_scene():
+    """Scene with the preview background and lights, but no mesh or camera"""
     scene = pyrender.Scene(
         bg_color=[40/255.0, 40/255.0, 40/255.0, 1.0],
         ambient_light=[0.3, 0.3, 0.3]
     )
-    scene.add(pyr_mesh)
-
     light = pyrender.DirectionalLight(color=np.ones(3), intensity=3.0)
     light_pose = tf.translation_matrix([2, 2, 5])
     scene.add(light, pose=light_pose)
+    return scene
+
+def render_views(render_mesh, views, label, size=RENDER_SIZE):
+    """
+    Render several views of one mesh from a single scene; yields (view, RGB array or None)
 
+    The mesh is uploaded once and only the camera pose changes between views.
+    When the next model is rendered the renderer frees this model's GPU buffers.
+    """
+    scene = make_scene()
+    scene.add(render_mesh)
     camera = pyrender.PerspectiveCamera(
         yfov=math.radians(60.0),
         znear=0.01,
         zfar=100.0
     )
-    scene.add(camera, pose=camera_transform)
-
-    try:
-        r = pyrender.OffscreenRenderer(viewport_width=800, viewport_height=800)
-        color_img, depth_img = r.render(scene)
-        r.delete()
-    except Exception as e:
-        print(f"Warning: Could not render {out_png} => {e}")
-        return
-
-    Image.fromarray(color_img).save(out_png)
-    enforce_dark_background(out_png, (40, 40, 40))
-
-def enforce_dark_background(image_path, rgb=(40, 40, 40)):
-    try:
-        img = Image.open(image_path).convert("RGBA")
-        px = img.load()
-        if px is None:
-            return
-        w, h = img.size
-        for y in range(h):
-            for x in range(w):
-                r, g, b, a = px[x, y]
-                if (r == 255 and g == 255 and b == 255 and a == 255):
-                    px[x, y] = (rgb[0], rgb[1], rgb[2], 255)
-        img.save(image_path)
-    except Exception as e:
-        print("Error enforcing dark background:", e)
-
-def render_two_views(mesh, out_prefix):
-    top_png = out_prefix + "_top_view.png"
-    front_png = out_prefix + "_front_view.png"
-
-    if os.path.exists(top_png) and os.path.exists(front_png):
-        print(f"Skipping (images exist): {top_png} & {front_png}")
-        return
-
-    if not os.path.exists(top_png):
-        top_tf = camera_top_view()
-        render_offscreen_with_pyrender(mesh, top_tf, top_png)
-        print(f"Rendered top view => {top_png}")
-    else:
-        print(f"Skipping (exists): {top_png}")
-
-    if not os.path.exists(front_png):
-        front_tf = camera_front_view()
-        render_offscreen_with_pyrender(mesh, front_tf, front_png)
-        print(f"Rendered front view => {front_png}")
+    camera_node = scene.add(camera, pose=np.eye(4))
+    for view in views:
+        scene.set_pose(camera_node, CAMERAS[view]())
+        try:
+            color_img, _ = get_renderer(size, size).render(scene)
+        except Exception as e:
+            print(f"Warning: Could not render {view} view of {label} => {e}")
+            reset_renderer()
+            color_img = None
+        yield view, color_img
+    release_meshes()
+
+def render_tiled(render_meshes, view, size=RENDER_SIZE):
+    """
+    Render several meshes side by side in one framebuffer; returns one size x size RGB tile per mesh
+
+    Meshes are laid out on a grid in the plane facing the camera and seen
+    through an orthographic camera, so every tile frames its mesh like the
+    perspective camera of render_views does, minus the perspective.
+    """
+    columns = math.ceil(math.sqrt(len(render_meshes)))
+    rows = math.ceil(len(render_meshes) / columns)
+    camera_pose = CAMERAS[view]()
+    scene = make_scene()
+    for index, render_mesh in enumerate(render_meshes):
+        row, column = divmod(index, columns)
+        # Tile offset along the camera's right and up axes
+        offset = camera_pose[:3, :3] @ [(column - (columns - 1) / 2) * 2 * TILE_HALF_EXTENT,
+                                         ((rows - 1) / 2 - row) * 2 * TILE_HALF_EXTENT, 0.0]
+        scene.add(render_mesh, pose=tf.translation_matrix(offset))
+    camera = pyrender.OrthographicCamera(xmag=columns * TILE_HALF_EXTENT, ymag=rows * TILE_HALF_EXTENT,
+                                         znear=0.01, zfar=100.0)
+    scene.add(camera, pose=camera_pose)
+    color_img, _ = get_renderer(columns * size, rows * size).render(scene)
+    tiles = []
+    for index in range(len(render_meshes)):
+        row, column = divmod(index, columns)
+        tiles.append(color_img[row * size:(row + 1) * size, column * size:(column + 1) * size])
+    return tiles
+
+def parse_encoder_options(image_format="png", quality=None, png_level=None, sizes=None):
+    """
+    Validate encoder settings from the command line or GUI; raises ValueError
+    """
+    image_format = image_format.lower()
+    if image_format == "jpg":
+        image_format = "jpeg"
+    if image_format not in IMAGE_FORMATS:
+        raise ValueError(f"image format must be one of {', '.join(IMAGE_FORMATS)}")
+    encoder = dict(DEFAULT_ENCODER, format=image_format)
+    if quality is not None:
+        encoder["quality"] = min(100, max(1, int(quality)))
+    if png_level is not None:
+        encoder["png_level"] = min(9, max(0, int(png_level)))
+    if sizes:
+        if isinstance(sizes, str):
+            sizes = [int(size) for size in sizes.split(",") if size.strip()]
+        sizes = tuple(sorted({int(size) for size in sizes}, reverse=True))
+        if not sizes or sizes[-1] < 16:
+            raise ValueError("image sizes must be at least 16 pixels")
+        encoder["sizes"] = sizes
+    return encoder
+
+def view_outputs(view, encoder=None):
+    """
+    Return [(key, suffix)] of every image written for one view
+
+    The largest size keeps the plain suffix (e.g. _top_view.png); smaller sizes
+    add the width (e.g. _top_view_200.png) and use the key "top_200".
+    """
+    encoder = encoder or DEFAULT_ENCODER
+    base = VIEW_SUFFIXES[view][:-len(".png")]
+    extension = IMAGE_FORMATS[encoder["format"]]
+    largest = encoder["sizes"][0]
+    return [(view, base + extension) if size == largest else
+            (f"{view}_{size}", f"{base}_{size}{extension}")
+            for size in encoder["sizes"]]
+
+def encode_view(color_img, view, encoder=None, rgb=(40, 40, 40)):
+    """
+    Encode one rendered view at every configured size; returns [(key, suffix, bytes)]
+
+    Pure white pixels are replaced by the dark background in memory, and the
+    smaller sizes are downscaled from the same render.
+    """
+    encoder = encoder or DEFAULT_ENCODER
+    pixels = np.ascontiguousarray(color_img[..., :3])
+    pixels[(pixels == 255).all(axis=2)] = rgb
+    img = Image.fromarray(pixels)
+
+    if encoder["format"] == "png":
+        save_options = {"format": "PNG", "compress_level": encoder["png_level"]}
+    elif encoder["format"] == "webp":
+        save_options = {"format": "WEBP", "quality": encoder["quality"], "method": 4}
     else:
-        print(f"Skipping (exists): {front_png}")
-
-def process_one_file_in_subprocess(file_path):
-    base_name = os.path.splitext(os.path.basename(file_path))[0]
-    dir_name = os.path.dirname(file_path)
-    out_prefix = os.path.join(dir_name, base_name)
-
-    try:
-        mesh = trimesh.load(file_path, force='mesh')
-    except Exception as e:
-        return f"Error loading {file_path}: {e}"
+        save_options = {"format": "JPEG", "quality": encoder["quality"]}
+
+    encoded = []
+    for size, (key, suffix) in zip(encoder["sizes"], view_outputs(view, encoder)):
+        scaled = img if img.width == size else img.resize((size, size), Image.LANCZOS, reducing_gap=2.0)
+        buffer = io.BytesIO()
+        scaled.save(buffer, **save_options)
+        encoded.append((key, suffix, buffer.getvalue()))
+    return encoded
+
+_encode_executor = None
+
+def get_encode_executor():
+    global _encode_executor
+    if _encode_executor is None:
+        _encode_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    return _encode_executor
+
+def render_and_encode(render_mesh, views, encoder, label):
+    """
+    Render each view and encode it on a background thread while the next view renders
+
+    Returns [(key, suffix, bytes)] for every view that rendered.
+    """
+    encoder = encoder or DEFAULT_ENCODER
+    futures = []
+    for view, color_img in render_views(render_mesh, views, label, encoder["sizes"][0]):
+        if color_img is not None:
+            futures.append(get_encode_executor().submit(encode_view, color_img, view, encoder))
+    encoded = []
+    for future in futures:
+        encoded.extend(future.result())
+    return encoded
+
+def load_mesh_for_render(file_path):
+    """
+    Load, center and fix a model; returns (pyrender mesh, None) or (None, message)
+
+    The trimesh object is only kept while the model is prepared, so its float64
+    arrays and caches are freed before the mesh is uploaded for rendering.
+    """
+    mesh = None
+    if file_path.lower().endswith('.obj'):
+        # Previews only need the geometry: skip materials, textures and groups
+        try:
+            mesh = load_obj_mesh(file_path)
+        except Exception:
+            # Anything the fast reader cannot handle is left to trimesh
+            mesh = None
+    if mesh is None:
+        try:
+            mesh = trimesh.load(file_path, force='mesh')
+        except Exception as e:
+            return None, f"Error loading {file_path}: {e}"
 
     if mesh.is_empty or len(mesh.vertices) == 0:
-        return f"Skipping empty mesh: {file_path}"
+        return None, f"Skipping empty mesh: {file_path}"
 
     center_and_fit_no_division(mesh)
     mesh.apply_scale(2.5)
 
     fix_inverted_faces_if_needed(mesh)
-    try:
-        mesh.visual.vertex_colors = [200, 150, 100, 255]
-    except Exception as e:
-        print(f"Error assigning color to {file_path}: {e}")
-
-    render_two_views(mesh, out_prefix)
-    return f"Rendered top & front for {file_path}"
+    vertices = mesh.vertices.astype(np.float32)
+    faces = mesh.faces.astype(np.uint32)
+    # Free the trimesh (float64 arrays and caches) before the render buffers are built
+    del mesh
+    return build_render_mesh(vertices, faces), None
+
+def process_one_file_in_subprocess(file_path, views=("top", "front"), encoder=None):
+    """
+    Render the missing views of one model; returns (message, written image paths)
+    """
+    mesh, message = load_mesh_for_render(file_path)
+    if mesh is None:
+        return message, []
+
+    written = write_previews(file_path, render_and_encode(mesh, views, encoder, file_path))
+    return f"Rendered {' & '.join(views)} for {file_path}", written
+
+def write_previews(file_path, encoded):
+    """Write [(key, suffix, bytes)] next to the model; returns the written paths"""
+    out_prefix = os.path.splitext(file_path)[0]
+    written = []
+    for key, suffix, data in encoded:
+        out_path = out_prefix + suffix
+        with open(out_path, "wb") as f:
+            f.write(data)
+        print(f"Rendered {key} => {out_path}")
+        written.append(out_path)
+    return written
+
+def render_previews_to_bytes(file_path, views=("top", "front"), encoder=None):
+    """
+    Render the missing views of one model for the preview store
+
+    Returns (message, {key: (suffix, encoded bytes)}).
+    """
+    mesh, message = load_mesh_for_render(file_path)
+    if mesh is None:
+        return message, {}
+
+    encoded = {key: (suffix, data)
+               for key, suffix, data in render_and_encode(mesh, views, encoder, file_path)}
+    return f"Rendered {' & '.join(views)} for {file_path}", encoded
+
+def render_batch(jobs, encoder=None, to_bytes=False):
+    """
+    Render a group of small models with one render call per view
+
+    jobs is [(model path, missing views)]. Returns {model path: (message, written)}
+    with what process_one_file_in_subprocess, or render_previews_to_bytes when
+    to_bytes is set, would have returned for each model.
+    """
+    encoder = encoder or DEFAULT_ENCODER
+    results = {}
+    loaded = []
+    for file_path, views in jobs:
+        render_mesh, message = load_mesh_for_render(file_path)
+        if render_mesh is None:
+            results[file_path] = (message, {} if to_bytes else [])
+        else:
+            loaded.append((file_path, views, render_mesh))
 
-def process_all_meshes_in_folder(folder_path, max_workers=4):
-    all_files_to_process = []
-    for root, _, files in os.walk(folder_path):
+    futures = []
+    for view in VIEW_SUFFIXES:
+        group = [(file_path, render_mesh) for file_path, views, render_mesh in loaded if view in views]
+        if not group:
+            continue
+        try:
+            tiles = render_tiled([render_mesh for _, render_mesh in group], view, encoder["sizes"][0])
+        except Exception as e:
+            print(f"Warning: Could not render {view} views of a batch of {len(group)} models => {e}")
+            reset_renderer()
+            continue
+        for (file_path, _), tile in zip(group, tiles):
+            futures.append((file_path, get_encode_executor().submit(encode_view, tile, view, encoder)))
+    release_meshes()
+
+    encoded = {file_path: [] for file_path, _, _ in loaded}
+    for file_path, future in futures:
+        encoded[file_path].extend(future.result())
+    for file_path, views, _ in loaded:
+        if to_bytes:
+            written = {key: (suffix, data) for key, suffix, data in encoded[file_path]}
+        else:
+            written = write_previews(file_path, encoded[file_path])
+        results[file_path] = (f"Rendered {' & '.join(views)} for {file_path}", written)
+    return results
+
+def estimate_triangles(file_path, size):
+    """
+    Rough triangle count from the file size, or the exact count from a binary STL header
+    """
+    if file_path.lower().endswith(".stl"):
+        try:
+            with open(file_path, "rb") as f:
+                header = f.read(84)
+            if len(header) == 84:
+                count = int.from_bytes(header[80:84], "little")
+                if size == 84 + 50 * count:
+                    return count
+        except OSError:
+            pass
+        return size // ASCII_STL_BYTES_PER_TRIANGLE
+    return size // OBJ_BYTES_PER_TRIANGLE
+
+def plan_batches(file_paths, sizes, max_triangles, batch_size=BATCH_SIZE):
+    """
+    Split models into batches of small models and the rest; returns (batches, singles)
+
+    Small models are grouped in path order so a batch usually holds parts of one pack.
+    """
+    small = []
+    singles = []
+    for file_path in file_paths:
+        if max_triangles and estimate_triangles(file_path, sizes[file_path]) <= max_triangles:
+            small.append(file_path)
+        else:
+            singles.append(file_path)
+    small.sort()
+    batches = [small[i:i + batch_size] for i in range(0, len(small), batch_size)]
+    if batches and len(batches[-1]) == 1:
+        singles.append(batches.pop()[0])
+    return batches, singles
+
+def collect_files_to_process(folder_path, snapshot=None, store=None, encoder=None):
+    """
+    Return {model path: missing views} using the directory listings only
+
+    A view is missing if any of its configured images is missing. With a
+    PreviewStore, images already in the store count as present as well.
+    """
+    outputs = {view: view_outputs(view, encoder) for view in VIEW_SUFFIXES}
+    files_to_process = {}
+    complete = 0
+    stored = store.stored_views() if store is not None else {}
+    walker = snapshot.walk(folder_path) if snapshot is not None else os.walk(folder_path)
+    for root, _, files in walker:
+        existing = set(files)
         for filename in files:
             if filename.lower().endswith(('.stl', '.obj')):
-                full_path = os.path.join(root, filename)
-
                 base_name = os.path.splitext(filename)[0]
-                top_png = os.path.join(root, base_name + "_top_view.png")
-                front_png = os.path.join(root, base_name + "_front_view.png")
-
-                if os.path.exists(top_png) and os.path.exists(front_png):
-                    print(f"Skipping (images exist): {top_png} & {front_png}")
+                in_store = stored.get(os.path.join(root, filename), ())
+                missing = tuple(view for view in VIEW_SUFFIXES
+                                if any(base_name + suffix not in existing and key not in in_store
+                                       for key, suffix in outputs[view]))
+                if not missing:
+                    complete += 1
                     continue
-
-                all_files_to_process.append(full_path)
-
-    if not all_files_to_process:
+                files_to_process[os.path.join(root, filename)] = missing
+    if complete:
+        print(f"Skipping {complete} models whose images exist")
+    return files_to_process
+
+def missing_views(file_path, encoder=None):
+    """
+    Return the views of one model that have no preview yet
+    """
+    out_prefix = os.path.splitext(file_path)[0]
+    return tuple(view for view in VIEW_SUFFIXES
+                 if any(not os.path.exists(out_prefix + suffix)
+                        for _, suffix in view_outputs(view, encoder)))
+
+def process_all_meshes_in_folder(folder_path, max_workers=4, snapshot=None,
+                                 executor=None, should_stop=None, pool_options=None,
+                                 output_backend="files", encoder=None, batch_triangles=0,
+                                 requests_since=None):
+    """
+    Render every model under folder_path that is missing a preview
+
+    An existing (e.g. pre-warmed) executor can be passed in; it is left running.
+    should_stop is polled between results to cancel the remaining jobs.
+    output_backend "store" keeps the previews in a PreviewStore in folder_path;
+    encoder selects the image format, quality and sizes (see parse_encoder_options).
+    batch_triangles enables batched rendering of small models (see render_files).
+    Folders passed to request_priority(folder_path, ...) before or while this
+    runs are rendered ahead of the rest; requests_since (a time.time() value,
+    e.g. the start of the pipeline run) ignores requests made before it.
+    """
+    store = PreviewStore(folder_path) if output_backend == "store" else None
+    try:
+        files_to_process = collect_files_to_process(folder_path, snapshot, store, encoder)
+        render_files(files_to_process, max_workers, snapshot, executor, should_stop,
+                     quarantine_root=folder_path, pool_options=pool_options, store=store,
+                     encoder=encoder, batch_triangles=batch_triangles,
+                     inbox=os.path.join(folder_path, PRIORITY_INBOX_FILE),
+                     requests_since=requests_since)
+    finally:
+        if store is not None:
+            store.close()
+
+def create_render_pool(max_workers, task_timeout=DEFAULT_TASK_TIMEOUT,
+                       max_tasks_per_worker=DEFAULT_MAX_TASKS_PER_WORKER,
+                       max_rss_mb=DEFAULT_MAX_RSS_MB, **kwargs):
+    """
+    Create a RenderPool with per-model timeouts and worker recycling
+    """
+    return RenderPool(max_workers, task_timeout=task_timeout,
+                      max_tasks_per_worker=max_tasks_per_worker,
+                      max_rss_mb=max_rss_mb, **kwargs)
+
+def request_priority(root_path, folder):
+    """
+    Ask the render running on root_path to render folder before its backlog
+
+    The request is appended to the inbox file in root_path with its time. If
+    no render is running, the next one on root_path starts with it, unless it
+    only accepts requests made since its run started (see requests_since in
+    render_files). Returns the inbox path.
+    """
+    inbox_path = os.path.join(root_path, PRIORITY_INBOX_FILE)
+    with open(inbox_path, "a", encoding="utf-8") as f:
+        f.write(f"{time.time():.3f}\t{os.path.abspath(folder)}\n")
+    return inbox_path
+
+def take_priority_requests(inbox_path):
+    """
+    Return and clear the requests in an inbox file as [(folder, request time)]
+
+    The file is renamed before it is read, so requests appended meanwhile go
+    to a new inbox. Lines without a time stand in with the file's mtime.
+    """
+    taken_path = f"{inbox_path}.{os.getpid()}"
+    try:
+        os.replace(inbox_path, taken_path)
+    except FileNotFoundError:
+        return []
+    except OSError as e:
+        # e.g. a writer still has it open on Windows; retried on the next poll
+        print(f"Could not read priority requests: {e}")
+        return []
+    try:
+        modified_at = os.path.getmtime(taken_path)
+        requests = []
+        with open(taken_path, encoding="utf-8") as f:
+            for line in f:
+                stamp, _, folder = line.strip().partition("\t")
+                try:
+                    requests.append((folder, float(stamp)))
+                except ValueError:
+                    requests.append((line.strip(), modified_at))
+        return [(folder, requested_at) for folder, requested_at in requests if folder]
+    finally:
+        os.remove(taken_path)
+
+def load_quarantine(folder_path):
+    """
+    Return {model path: record} of models that previously hung or crashed a worker
+    """
+    try:
+        with open(os.path.join(folder_path, QUARANTINE_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        print(f"Could not read quarantine list: {e}")
+        return {}
+
+def save_quarantine(folder_path, quarantine, snapshot=None):
+    quarantine_path = os.path.join(folder_path, QUARANTINE_FILE)
+    with open(quarantine_path, "w", encoding="utf-8") as f:
+        json.dump(quarantine, f, indent=2)
+    if snapshot is not None:
+        snapshot.add_file(quarantine_path)
+
+def file_signature(file_path, snapshot=None):
+    info = snapshot.file_info(file_path) if snapshot is not None else None
+    if info is not None:
+        return info.size, info.mtime_ns
+    st = os.stat(file_path)
+    return st.st_size, st.st_mtime_ns
+
+def is_quarantined(quarantine, file_path, snapshot=None):
+    """A quarantined model is retried once its size or mtime changes"""
+    record = quarantine.get(file_path)
+    if record is None:
+        return False
+    try:
+        return (record["size"], record["mtime_ns"]) == file_signature(file_path, snapshot)
+    except OSError:
+        return False
+
+def render_files(files_to_process, max_workers=4, snapshot=None,
+                 executor=None, should_stop=None, quarantine_root=None, pool_options=None,
+                 store=None, encoder=None, batch_triangles=0, inbox=None, requests_since=None):
+    """
+    Render {model path: missing views} on a process pool
+
+    With a PreviewStore the workers return encoded previews and only the store
+    files are written, instead of two loose PNGs per model.
+
+    With batch_triangles, models estimated below that many triangles are
+    rendered BATCH_SIZE at a time by render_batch; a batch that fails is
+    retried one model at a time.
+
+    Models that time out or crash their worker are added to the quarantine list
+    in quarantine_root and skipped by later runs until the file changes.
+    With max_workers="auto" the pool starts at a size that fits in memory and
+    is tuned while it renders.
+
+    inbox is a priority inbox file (see request_priority) polled while
+    rendering: the missing previews of each requested folder are queued at
+    PRIORITY_INTERACTIVE, or moved there if already queued, and served by the
+    running pool ahead of the backlog. Requests older than requests_since are
+    ignored. The inbox is emptied when the render ends, so requests found at
+    the start were made while nothing was rendering and are served. Request
+    latency is reported separately from the throughput of the backlog.
+    """
+    files_to_process = dict(files_to_process)
+    quarantine = load_quarantine(quarantine_root) if quarantine_root else {}
+    quarantine_changed = False
+    all_files_to_process = [f for f in files_to_process if not is_quarantined(quarantine, f, snapshot)]
+    if len(all_files_to_process) < len(files_to_process):
+        print(f"Skipping {len(files_to_process) - len(all_files_to_process)} quarantined models "
+              f"(listed in {QUARANTINE_FILE})")
+
+    sizes = {}
+    for file_path in all_files_to_process:
+        try:
+            sizes[file_path] = file_signature(file_path, snapshot)[0]
+        except OSError:
+            sizes[file_path] = 0
+    progress.stage_start("render", len(all_files_to_process), sum(sizes.values()))
+    if not all_files_to_process and not (inbox and os.path.exists(inbox)):
         print("No STL/OBJ files need processing.")
+        progress.stage_end("render")
         return
 
-    executor = concurrent.futures.ProcessPoolExecutor(max_workers=max_workers)
-    futures = {
-        executor.submit(process_one_file_in_subprocess, f): f
-        for f in all_files_to_process
-    }
-
-    try:
-        for idx, future in enumerate(concurrent.futures.as_completed(futures), start=1):
-            file_path = futures[future]
+    own_executor = executor is None
+    tuner = None
+    if own_executor:
+        if max_workers == AUTO:
+            executor = create_render_pool(initial_worker_count(list(sizes.values())),
+                                          **(pool_options or {}))
+            print(f"Autotune: starting with {executor.max_workers} workers")
+            tuner = AutoTuner(executor).start()
+        else:
+            executor = create_render_pool(max_workers, **(pool_options or {}))
+    render_one = process_one_file_in_subprocess if store is None else render_previews_to_bytes
+    batches, singles = plan_batches(all_files_to_process, sizes, batch_triangles)
+    if batches:
+        print(f"Rendering {sum(len(batch) for batch in batches)} small models in {len(batches)} batches")
+    # future -> model paths it renders; batch futures return {model path: result}
+    futures = {}
+    batch_futures = set()
+    # Absolute path of each queued or running model -> its future
+    model_futures = {}
+    for batch in batches:
+        future = executor.submit(render_batch, [(f, files_to_process[f]) for f in batch],
+                                 encoder, store is not None, items=len(batch))
+        futures[future] = batch
+        batch_futures.add(future)
+        model_futures.update((os.path.abspath(f), future) for f in batch)
+    for f in singles:
+        future = executor.submit(render_one, f, files_to_process[f], encoder)
+        futures[future] = [f]
+        model_futures[os.path.abspath(f)] = future
+    images_per_view = len((encoder or DEFAULT_ENCODER)["sizes"])
+    uncommitted = 0
+    completed = 0
+    # (peak worker RSS in MB, model path), reported by RenderPool workers on Linux
+    peaks = []
+    # Absolute paths of the models done in this run
+    finished = set()
+    # Open priority requests: {"folder", "requested" (time), "models", "waiting" (absolute model paths)}
+    requests = []
+    # Seconds from request to the last preview of its folder, and models rendered for requests
+    latencies = []
+    interactive_done = 0
+    started = time.time()
+    stale_requests = 0
+    pending = set(futures)
+
+    def prioritize(folder, requested_at):
+        """Queue the missing previews of folder ahead of the backlog"""
+        folder = os.path.abspath(folder)
+        if not os.path.isdir(folder):
+            print(f"Ignoring priority request, not a folder: {folder}")
+            return
+        # The folder may have been dropped after the snapshot was taken, so list it from disk
+        wanted = collect_files_to_process(folder, None, store, encoder)
+        waiting = set()
+        queued = set()
+        added = []
+        skipped = 0
+        for f, views in wanted.items():
+            if f in finished:
+                continue
+            if f in model_futures:
+                # Already queued, possibly under a relative path
+                queued.add(model_futures[f])
+                waiting.add(f)
+            elif is_quarantined(quarantine, f, snapshot):
+                skipped += 1
+            else:
+                files_to_process[f] = views
+                added.append(f)
+        for f in added:
             try:
-                result_msg = future.result()
-                if result_msg:
-                    print(result_msg)
-            except Exception as e:
-                print(f"Error in subprocess for {file_path}: {e}")
-            finally:
-                print(f"Completed {idx}/{len(all_files_to_process)} files.")
+                sizes[f] = file_signature(f)[0]
+                if snapshot is not None and snapshot.contains(f) and snapshot.file_info(f) is None:
+                    snapshot.add_file(f)
+            except OSError:
+                sizes[f] = 0
+            future = executor.submit(render_one, f, files_to_process[f], encoder,
+                                     priority=PRIORITY_INTERACTIVE)
+            futures[future] = [f]
+            model_futures[f] = future
+            pending.add(future)
+            all_files_to_process.append(f)
+            waiting.add(f)
+        if added:
+            progress.stage_add("render", len(added), sum(sizes[f] for f in added))
+        moved = executor.set_priority(queued, PRIORITY_INTERACTIVE)
+        quarantined = f", {skipped} quarantined skipped" if skipped else ""
+        if not waiting:
+            print(f"Priority request: nothing left to render in {folder}{quarantined}")
+            return
+        print(f"Priority request: {folder} ({len(added)} models added, {moved} queued jobs moved ahead"
+              f"{quarantined})")
+        # A request queued before the render started is timed from the start
+        requests.append({"folder": folder, "requested": max(requested_at, started),
+                         "models": len(waiting), "waiting": waiting})
+
+    def finish(file_path, get_result, peak):
+        """Record the outcome of one model; get_result returns (message, written) or raises"""
+        nonlocal uncommitted, completed, quarantine_changed, interactive_done
+        ok = False
+        try:
+            result_msg, written = get_result()
+            ok = (len(written) == len(files_to_process[file_path]) * images_per_view
+                  or result_msg.startswith("Skipping"))
+            if result_msg:
+                print(result_msg)
+            if not ok:
+                progress.error("render", result_msg, file_path)
+            if store is not None:
+                signature = (sizes[file_path], file_signature(file_path, snapshot)[1])
+                for key, (suffix, data) in written.items():
+                    store.put(file_path, key, suffix, data, signature)
+                uncommitted += 1
+                if uncommitted >= STORE_COMMIT_EVERY:
+                    store.commit()
+                    uncommitted = 0
+            elif snapshot is not None:
+                for out_png in written:
+                    snapshot.add_file(out_png)
+        except (TaskTimeout, WorkerCrashed) as e:
+            print(f"Quarantining {file_path}: {e}")
+            progress.error("render", str(e), file_path)
+            if quarantine_root:
+                try:
+                    size, mtime_ns = file_signature(file_path, snapshot)
+                    quarantine[file_path] = {"reason": str(e), "size": size, "mtime_ns": mtime_ns,
+                                             "time": time.strftime("%Y-%m-%d %H:%M:%S")}
+                    quarantine_changed = True
+                except OSError:
+                    pass
+        except Exception as e:
+            print(f"Error in subprocess for {file_path}: {e}")
+            progress.error("render", str(e), file_path)
+        finally:
+            if peak is not None:
+                peaks.append((peak, file_path))
+            completed += 1
+            finished.add(os.path.abspath(file_path))
+            model_futures.pop(os.path.abspath(file_path), None)
+            print(f"Completed {completed}/{len(all_files_to_process)} files.")
+            progress.item_done("render", file_path, sizes[file_path], ok)
+            for request in [r for r in requests if os.path.abspath(file_path) in r["waiting"]]:
+                request["waiting"].discard(os.path.abspath(file_path))
+                interactive_done += 1
+                if not request["waiting"]:
+                    requests.remove(request)
+                    latency = time.time() - request["requested"]
+                    latencies.append(latency)
+                    print(f"Priority request done: {request['folder']} "
+                          f"({request['models']} models in {latency:.1f}s)")
+
+    last_poll = None
+    try:
+        while True:
+            if inbox and (last_poll is None or time.time() - last_poll >= INBOX_POLL_SECONDS):
+                last_poll = time.time()
+                for folder, requested_at in take_priority_requests(inbox):
+                    if requests_since is not None and requested_at < requests_since:
+                        stale_requests += 1
+                    else:
+                        prioritize(folder, requested_at)
+            if not pending:
+                break
+            done, pending = concurrent.futures.wait(pending, timeout=INBOX_POLL_SECONDS if inbox else None,
+                                                    return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                peak = getattr(future, "peak_rss_mb", None)
+                if future not in batch_futures:
+                    finish(futures[future][0], future.result, peak)
+                    continue
+                try:
+                    results = future.result()
+                except Exception as e:
+                    # One bad model must not fail or quarantine the whole batch
+                    print(f"Batch of {len(futures[future])} models failed ({e}); rendering them one by one")
+                    for f in futures[future]:
+                        requested = any(os.path.abspath(f) in request["waiting"] for request in requests)
+                        retry = executor.submit(render_one, f, files_to_process[f], encoder,
+                                                priority=PRIORITY_INTERACTIVE if requested else PRIORITY_BACKGROUND)
+                        futures[retry] = [f]
+                        model_futures[os.path.abspath(f)] = retry
+                        pending.add(retry)
+                    continue
+                for f in futures[future]:
+                    finish(f, lambda: results[f], peak)
+            if should_stop is not None and should_stop():
+                print("Stop requested. Cancelling remaining files...")
+                for waiting in pending:
+                    waiting.cancel()
+                break
     except KeyboardInterrupt:
         print("Ctrl-C pressed. Stopping all workers gracefully...")
+        if tuner is not None:
+            tuner.stop()
         executor.shutdown(wait=False, cancel_futures=True)
         sys.exit(1)
-
-    executor.shutdown(wait=True)
+    finally:
+        # Requests for this run that came after the last poll must not carry over to the next one
+        late_requests = take_priority_requests(inbox) if inbox else []
+
+    if tuner is not None:
+        tuner.stop()
+        print(tuner.report())
+    if stale_requests:
+        print(f"Ignored {stale_requests} priority requests made before this run")
+    if late_requests:
+        print(f"Dropped {len(late_requests)} priority requests that arrived as the render finished")
+    if latencies:
+        elapsed = time.time() - started
+        batch_done = completed - interactive_done
+        latencies.sort()
+        print(f"Priority requests: {len(latencies)} folders ({interactive_done} models), latency "
+              f"median {latencies[len(latencies) // 2]:.1f}s, max {latencies[-1]:.1f}s")
+        print(f"Backlog throughput: {batch_done} models in {elapsed:.0f}s "
+              f"({batch_done / max(elapsed, 1e-6):.2f} models/s)")
+    if peaks:
+        peaks.sort()
+        print(f"Peak worker memory per model: median {peaks[len(peaks) // 2][0]:.0f} MB, "
+              f"max {peaks[-1][0]:.0f} MB ({peaks[-1][1]})")
+    if store is not None:
+        store.commit()
+    if own_executor:
+        executor.shutdown(wait=True)
+    if quarantine_changed:
+        save_quarantine(quarantine_root, quarantine, snapshot)
+    progress.stage_end("render", not (should_stop is not None and should_stop()))
     print("Processing complete.")
 
+def run_queue_coordinator(folder_path, db_path, max_workers):
+    """
+    Publish the folder's render jobs to a shared queue and help render them
+
+    Workers on other hosts join with: python renderqueue.py worker <queue.db> [processes]
+    """
+    import renderqueue
+    queue = renderqueue.RenderQueue(db_path)
+    files_to_process = collect_files_to_process(folder_path)
+    queue.publish(files_to_process)
+    print(f"Published {len(files_to_process)} render jobs to {queue.db_path}")
+    if max_workers == AUTO:
+        max_workers = initial_worker_count([file_signature(f)[0] for f in files_to_process])
+    workers = renderqueue.start_local_workers(db_path, max_workers, idle_exit=10)
+    counts = renderqueue.wait_for_queue(queue, workers=workers)
+    for worker in workers:
+        worker.join()
+    for path, message in queue.failures():
+        print(f"Failed: {path}: {message}")
+    print(f"Queue finished: {counts.get('done', 0)} done, {counts.get('failed', 0)} failed")
+
 def main():
-    if len(sys.argv) < 2:
-        print("Usage: python script.py /path/to/folder [max_workers]")
+    args = sys.argv[1:]
+    snapshot_path = pop_snapshot_option(args)
+    options = {"--queue": None, "--timeout": DEFAULT_TASK_TIMEOUT,
+               "--max-tasks": DEFAULT_MAX_TASKS_PER_WORKER, "--max-rss-mb": DEFAULT_MAX_RSS_MB,
+               "--output-backend": "files", "--format": "png", "--quality": None,
+               "--png-level": None, "--sizes": None, "--batch-small": None, "--prioritize": None,
+               "--requests-since": None}
+    for name in options:
+        if name in args:
+            index = args.index(name)
+            options[name] = args[index + 1] if index + 1 < len(args) else None
+            del args[index:index + 2]
+    queue_path = options["--queue"]
+    if len(args) < 1:
+        print("Usage: python script.py /path/to/folder [max_workers|auto] [--snapshot FILE] [--queue QUEUE_DB]")
+        print("       [--timeout SECONDS] [--max-tasks N] [--max-rss-mb MB] [--output-backend files|store]")
+        print("       [--format png|webp|jpeg] [--quality 1-100] [--png-level 0-9] [--sizes 800,200]")
+        print("       [--batch-small MAX_TRIANGLES] [--requests-since UNIX_TIME]")
+        print("       python script.py /path/to/folder --prioritize /path/to/folder/subfolder")
+        sys.exit(1)
+    try:
+        encoder = parse_encoder_options(options["--format"] or "png", options["--quality"],
+                                        options["--png-level"], options["--sizes"])
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    output_backend = options["--output-backend"]
+    if output_backend not in OUTPUT_BACKENDS:
+        print(f"Error: --output-backend must be one of {', '.join(OUTPUT_BACKENDS)}")
+        sys.exit(1)
+    try:
+        pool_options = {"task_timeout": float(options["--timeout"]),
+                        "max_tasks_per_worker": int(options["--max-tasks"]),
+                        "max_rss_mb": float(options["--max-rss-mb"])}
+        batch_triangles = int(options["--batch-small"] or 0)
+        requests_since = float(options["--requests-since"]) if options["--requests-since"] else None
+    except (TypeError, ValueError):
+        print("Error: --timeout, --max-tasks, --max-rss-mb, --batch-small and --requests-since "
+              "need numeric values")
         sys.exit(1)
 
-    folder_path = sys.argv[1]
+    folder_path = args[0]
     if not os.path.isdir(folder_path):
         print("Not a valid directory:", folder_path)
         sys.exit(1)
 
+    if options["--prioritize"]:
+        # Hand the folder to the render running on folder_path, or to the next standalone one, and exit
+        folder = options["--prioritize"]
+        if not os.path.isdir(folder):
+            print("Not a valid directory:", folder)
+            sys.exit(1)
+        inbox_path = request_priority(folder_path, folder)
+        print(f"Queued {os.path.abspath(folder)} in {inbox_path}; a render running on {folder_path} "
+              f"serves it next, otherwise the next 'python stlphoto18.py {folder_path}' starts with it")
+        return
+
     max_workers = 4
-    if len(sys.argv) >= 3:
-        try:
-            max_workers = int(sys.argv[2])
-        except:
-            pass
+    if len(args) >= 2:
+        max_workers = parse_worker_count(args[1])
+
+    if queue_path:
+        if output_backend != "files" or encoder != DEFAULT_ENCODER:
+            print("Queue workers write loose PNG files; ignoring --output-backend and encoder options")
+        run_queue_coordinator(folder_path, queue_path, max_workers)
+        print("Done.")
+        return
 
-    process_all_meshes_in_folder(folder_path, max_workers=max_workers)
+    snapshot = open_snapshot(snapshot_path, folder_path) if snapshot_path else None
+    process_all_meshes_in_folder(folder_path, max_workers=max_workers, snapshot=snapshot,
+                                 pool_options=pool_options, output_backend=output_backend,
+                                 encoder=encoder, batch_triangles=batch_triangles,
+                                 requests_since=requests_since)
+    if snapshot is not None:
+        snapshot.save(snapshot_path)
     print("Done.")
 
 if __name__ == "__main__":
@@ -0,0 +1,59 @@
+import os
+import time
+import signal
+import threading
+import multiprocessing
+
+from renderqueue import RenderQueue, start_local_workers, wait_for_queue
+
+LEASE_SECONDS = 2
+
+def write_tetrahedron(path):
+    """Write a small ASCII STL model"""
+    corners = [(0, 0, 0), (1, 0, 0), (0, 1, 0), (0, 0, 1)]
+    faces = [(0, 2, 1), (0, 1, 3), (0, 3, 2), (1, 2, 3)]
+    lines = ["solid tetra"]
+    for face in faces:
+        lines.append("facet normal 0 0 0")
+        lines.append("outer loop")
+        lines.extend("vertex %d %d %d" % corners[index] for index in face)
+        lines.append("endloop")
+        lines.append("endfacet")
+    lines.append("endsolid tetra")
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+def lease_and_hang(db_path, leased):
+    """A worker that takes a job and then stops responding without finishing it"""
+    RenderQueue(db_path, LEASE_SECONDS).lease("lost-host:1")
+    leased.set()
+    time.sleep(3600)
+
+def test_coordinator_finishes_when_a_worker_dies_mid_lease(tmp_path):
+    model_path = str(tmp_path / "tetra.stl")
+    write_tetrahedron(model_path)
+    db_path = str(tmp_path / "render-queue.db")
+    queue = RenderQueue(db_path, LEASE_SECONDS)
+    queue.publish({model_path: ("top", "front")})
+
+    leased = multiprocessing.Event()
+    lost_worker = multiprocessing.Process(target=lease_and_hang, args=(db_path, leased))
+    lost_worker.start()
+    assert leased.wait(30)
+    os.kill(lost_worker.pid, signal.SIGKILL)
+    lost_worker.join()
+    assert queue.counts() == {"leased": 1}
+
+    # The local worker would go idle long before the dead worker's lease expires
+    workers = start_local_workers(db_path, 1, lease_seconds=LEASE_SECONDS, idle_exit=0.5)
+    result = {}
+    waiter = threading.Thread(target=lambda: result.update(wait_for_queue(queue, 0.5, workers)),
+                              daemon=True)
+    waiter.start()
+    waiter.join(120)
+    for worker in workers:
+        worker.join(60)
+
+    assert not waiter.is_alive(), "coordinator did not finish"
+    assert result.get("pending", 0) == 0 and result.get("leased", 0) == 0
+    assert result.get("done", 0) + result.get("failed", 0) == 1
@@ -0,0 +1,47 @@
+import os
+
+from scriptcombine import EDGE_BLOCK_SIZE, deduplicate_files, find_duplicate_files
+
+def write_file(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+
+def make_files(root):
+    """Small and large duplicates, a large file that differs only in the middle, and a unique file"""
+    large = bytearray(b"m" * (3 * EDGE_BLOCK_SIZE))
+    write_file(os.path.join(root, "a.stl"), bytes(large))
+    write_file(os.path.join(root, "b.stl"), bytes(large))
+    large[len(large) // 2] = ord("x")
+    write_file(os.path.join(root, "c.stl"), bytes(large))
+    write_file(os.path.join(root, "small1.png"), b"same")
+    write_file(os.path.join(root, "small2.png"), b"same")
+    write_file(os.path.join(root, "unique.png"), b"different size")
+
+def test_find_duplicate_files_groups_identical_files_only(tmp_path):
+    root = str(tmp_path)
+    make_files(root)
+    groups = sorted((size, sorted(os.path.basename(p) for p in paths))
+                    for size, paths in find_duplicate_files(root))
+    assert groups == [(4, ["small1.png", "small2.png"]), (3 * EDGE_BLOCK_SIZE, ["a.stl", "b.stl"])]
+
+def test_deduplicate_files_hardlinks_duplicates_on_request(tmp_path):
+    root = str(tmp_path)
+    make_files(root)
+    assert deduplicate_files(root, hardlinks=True)
+
+    inode = lambda name: os.stat(os.path.join(root, name)).st_ino
+    assert inode("a.stl") == inode("b.stl")
+    assert inode("small1.png") == inode("small2.png")
+    assert inode("c.stl") != inode("a.stl")
+    with open(os.path.join(root, "b.stl"), "rb") as f:
+        assert f.read() == b"m" * (3 * EDGE_BLOCK_SIZE)
+    # No temporary files are left behind
+    assert sorted(os.listdir(root)) == ["a.stl", "b.stl", "c.stl", "small1.png", "small2.png", "unique.png"]
+
+def test_deduplicate_files_never_hardlinks_by_default(tmp_path):
+    root = str(tmp_path)
+    make_files(root)
+    assert deduplicate_files(root)
+    # Reflinked or left alone, the copies stay separate files
+    assert os.stat(os.path.join(root, "a.stl")).st_ino != os.stat(os.path.join(root, "b.stl")).st_ino
+    assert sorted(os.listdir(root)) == ["a.stl", "b.stl", "c.stl", "small1.png", "small2.png", "unique.png"]
@@ -0,0 +1,63 @@
+import os
+
+from scriptdeletempty import apply_deletion_plan, build_deletion_plan, make_plan_data, top_level_folders
+
+def write_file(path, size):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+
+def make_tree(root):
+    """A folder of each kind the delete modes tell apart"""
+    write_file(os.path.join(root, "two-images", "a.png"), 10)
+    write_file(os.path.join(root, "two-images", "b.jpg"), 10)
+    for name in "abcd":
+        write_file(os.path.join(root, "four-images", name + ".png"), 100)
+    os.makedirs(os.path.join(root, "empty"))
+    write_file(os.path.join(root, "model", "a.stl"), 1)
+    write_file(os.path.join(root, "model", "a_top_view.png"), 1)
+    write_file(os.path.join(root, "other", "readme.txt"), 1)
+    write_file(os.path.join(root, "nest", "inner", "a.png"), 1000)
+
+def planned(root, min_images, delete_mode):
+    plan = build_deletion_plan(root, min_images, delete_mode)
+    return sorted(os.path.relpath(folder["path"], root) for folder in plan)
+
+def test_classification_by_delete_mode(tmp_path):
+    root = str(tmp_path)
+    make_tree(root)
+    nested = os.path.join("nest", "inner")
+    assert planned(root, 3, "all") == sorted(["two-images", "four-images", "empty", "nest", nested])
+    assert planned(root, 3, "few") == sorted(["two-images", "empty", "nest", nested])
+    assert planned(root, 3, "keep") == ["empty"]
+
+def test_total_size_counts_nested_folders_once(tmp_path):
+    root = str(tmp_path)
+    make_tree(root)
+    plan = build_deletion_plan(root, 3, "all")
+    # two-images + four-images + nest (which includes nest/inner); empty adds nothing
+    assert make_plan_data(plan, root, 3, "all")["total_size"] == 20 + 400 + 1000
+
+def test_apply_skips_entries_that_changed_or_disappeared(tmp_path):
+    root = str(tmp_path)
+    make_tree(root)
+    data = make_plan_data(build_deletion_plan(root, 3, "all"), root, 3, "all")
+    write_file(os.path.join(root, "two-images", "c.png"), 10)
+    os.rmdir(os.path.join(root, "empty"))
+
+    assert apply_deletion_plan(data) == 2
+    assert sorted(os.listdir(root)) == ["model", "other", "two-images"]
+    assert len(os.listdir(os.path.join(root, "two-images"))) == 3
+
+def test_nested_entry_is_dropped_when_a_sibling_sorts_between(tmp_path):
+    # "Pack (1)" sorts between "Pack" and "Pack/sub" as a plain string
+    root = str(tmp_path)
+    write_file(os.path.join(root, "Pack", "sub", "a.png"), 1000)
+    write_file(os.path.join(root, "Pack (1)", "b.png"), 10)
+    write_file(os.path.join(root, "Pack.old", "c.png"), 5)
+    write_file(os.path.join(root, "model.stl"), 1)
+
+    plan = build_deletion_plan(root, delete_mode="all")
+    top = [os.path.relpath(folder["path"], root) for folder in top_level_folders(plan)]
+    assert top == ["Pack", "Pack (1)", "Pack.old"]
+    assert make_plan_data(plan, root, 3, "all")["total_size"] == 1015
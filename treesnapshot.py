@@ -0,0 +1,205 @@
+import os
+import json
+import threading
+from collections import namedtuple
+
+# Stat fields kept for every non-directory entry
+FileInfo = namedtuple("FileInfo", ["size", "mtime_ns", "inode", "device", "is_file"])
+
+SNAPSHOT_VERSION = 1
+
+class TreeSnapshot:
+    """
+    In-memory listing of a folder tree, built once with os.scandir
+
+    Directories are keyed by absolute path and hold their subdirectory names
+    and a FileInfo per file. Stages that create or delete files update the
+    snapshot instead of walking the tree again.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self.dirs = {}
+        self._lock = threading.RLock()
+
+    @classmethod
+    def build(cls, root):
+        """Scan root and return a new snapshot"""
+        snapshot = cls(root)
+        snapshot.add_tree(snapshot.root)
+        return snapshot
+
+    @classmethod
+    def load(cls, snapshot_path):
+        """Load a snapshot written by save()"""
+        with open(snapshot_path, encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported snapshot version in {snapshot_path}")
+        snapshot = cls(data["root"])
+        for path, (dirnames, files) in data["dirs"].items():
+            snapshot.dirs[path] = {
+                "dirs": set(dirnames),
+                "files": {name: FileInfo(*info) for name, info in files.items()},
+            }
+        return snapshot
+
+    def save(self, snapshot_path):
+        """Write the snapshot to a JSON file, replacing it atomically"""
+        with self._lock:
+            data = {
+                "version": SNAPSHOT_VERSION,
+                "root": self.root,
+                "dirs": {
+                    path: [sorted(node["dirs"]), {name: list(info) for name, info in node["files"].items()}]
+                    for path, node in self.dirs.items()
+                },
+            }
+        temp_path = snapshot_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(temp_path, snapshot_path)
+
+    def contains(self, path):
+        """Return True if path is inside the snapshot root"""
+        path = os.path.abspath(path)
+        return path == self.root or path.startswith(os.path.join(self.root, ""))
+
+    def _scan_dir(self, path):
+        node = {"dirs": set(), "files": {}}
+        subdirs = []
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            node["dirs"].add(entry.name)
+                            subdirs.append(entry.path)
+                            continue
+                        st = entry.stat(follow_symlinks=False)
+                        node["files"][entry.name] = FileInfo(
+                            st.st_size, st.st_mtime_ns, st.st_ino, st.st_dev,
+                            entry.is_file(follow_symlinks=False))
+                    except OSError as e:
+                        print(f"Error reading {entry.path}: {e}")
+        except OSError as e:
+            print(f"Error scanning {path}: {e}")
+        self.dirs[path] = node
+        return subdirs
+
+    def add_tree(self, path):
+        """Scan path and everything below it into the snapshot"""
+        path = os.path.abspath(path)
+        with self._lock:
+            self._remove_tree_entries(path)
+            stack = [path]
+            while stack:
+                stack.extend(self._scan_dir(stack.pop()))
+            parent, name = os.path.split(path)
+            if path != self.root and parent in self.dirs:
+                self.dirs[parent]["dirs"].add(name)
+                self.dirs[parent]["files"].pop(name, None)
+
+    def _remove_tree_entries(self, path):
+        prefix = os.path.join(path, "")
+        for key in [key for key in self.dirs if key == path or key.startswith(prefix)]:
+            del self.dirs[key]
+
+    def remove_tree(self, path):
+        """Forget a deleted directory and everything below it"""
+        path = os.path.abspath(path)
+        with self._lock:
+            self._remove_tree_entries(path)
+            parent, name = os.path.split(path)
+            if parent in self.dirs:
+                self.dirs[parent]["dirs"].discard(name)
+
+    def add_file(self, path, info=None):
+        """Record a created or modified file, stat'ing it unless info is given"""
+        path = os.path.abspath(path)
+        if info is None:
+            st = os.stat(path, follow_symlinks=False)
+            info = FileInfo(st.st_size, st.st_mtime_ns, st.st_ino, st.st_dev, os.path.isfile(path))
+        parent, name = os.path.split(path)
+        with self._lock:
+            if parent not in self.dirs:
+                self.add_tree(parent)
+            else:
+                self.dirs[parent]["files"][name] = info
+
+    def remove_file(self, path):
+        """Forget a deleted file"""
+        parent, name = os.path.split(os.path.abspath(path))
+        with self._lock:
+            if parent in self.dirs:
+                self.dirs[parent]["files"].pop(name, None)
+
+    def isdir(self, path):
+        return os.path.abspath(path) in self.dirs
+
+    def isfile(self, path):
+        return self.file_info(path) is not None
+
+    def exists(self, path):
+        return self.isdir(path) or self.isfile(path)
+
+    def file_info(self, path):
+        """Return the FileInfo of path, or None if it is not a known file"""
+        parent, name = os.path.split(os.path.abspath(path))
+        node = self.dirs.get(parent)
+        if node is None:
+            return None
+        return node["files"].get(name)
+
+    def listdir(self, path):
+        """Return (subdirectory names, {file name: FileInfo}) for a directory"""
+        path = os.path.abspath(path)
+        with self._lock:
+            node = self.dirs.get(path)
+            if node is None:
+                raise FileNotFoundError(f"Not in snapshot: {path}")
+            return sorted(node["dirs"]), dict(node["files"])
+
+    def walk(self, top=None, topdown=True):
+        """Yield (dirpath, dirnames, filenames) like os.walk, without touching the disk"""
+        top = os.path.abspath(top or self.root)
+        if top not in self.dirs:
+            return
+        dirnames, files = self.listdir(top)
+        filenames = sorted(files)
+        if topdown:
+            yield top, dirnames, filenames
+        for name in dirnames:
+            yield from self.walk(os.path.join(top, name), topdown)
+        if not topdown:
+            yield top, dirnames, filenames
+
+def pop_snapshot_option(args):
+    """Remove --snapshot PATH from an argument list and return PATH (or None)"""
+    if "--snapshot" not in args:
+        return None
+    index = args.index("--snapshot")
+    if index + 1 >= len(args):
+        raise ValueError("--snapshot requires a value")
+    snapshot_path = args[index + 1]
+    del args[index:index + 2]
+    return snapshot_path
+
+def open_snapshot(snapshot_path, folder_path):
+    """
+    Load the snapshot at snapshot_path, or build one for folder_path
+
+    A fresh snapshot is built (and saved) when the file is missing, unreadable
+    or does not cover folder_path.
+    """
+    snapshot = None
+    if os.path.exists(snapshot_path):
+        try:
+            snapshot = TreeSnapshot.load(snapshot_path)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Could not load snapshot {snapshot_path}: {e}")
+    if snapshot is None or not snapshot.isdir(folder_path):
+        print(f"Building folder snapshot for: {folder_path}")
+        snapshot = TreeSnapshot.build(folder_path)
+        snapshot.save(snapshot_path)
+    return snapshot
@@ -0,0 +1,446 @@
+import os
+import sys
+import json
+import time
+import struct
+import select
+import signal
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+import script7zextract
+import scriptunzipmultirar
+import progress
+from autotune import AUTO, AutoTuner, parse_worker_count
+from pipeline import Pipeline
+
+ARCHIVE_EXTENSIONS = ('.zip', '.7z', '.rar', '.tar', '.tar.gz', '.tgz')
+MODEL_EXTENSIONS = ('.stl', '.obj')
+
+# inotify constants from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_MOVED_FROM | IN_DELETE
+EVENT_HEADER = struct.Struct("iIII")
+
+class Inotify:
+    """
+    Minimal ctypes wrapper around the Linux inotify API
+    """
+
+    def __init__(self):
+        import ctypes
+        import ctypes.util
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches = {}
+
+    def add_watch(self, path):
+        import ctypes
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {path}")
+        self.watches[wd] = path
+
+    def read_events(self, timeout):
+        """Wait up to timeout seconds and return a list of (path, mask)"""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            directory = self.watches.get(wd)
+            if mask & IN_Q_OVERFLOW or directory is None:
+                events.append((None, mask))
+            else:
+                events.append((os.path.join(directory, os.fsdecode(name)), mask))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+class DropFolderWatcher:
+    """
+    Watches drop folders and reports archives and models once their size is stable
+
+    Uses inotify where available; otherwise polls by stat'ing every known
+    directory and re-listing only those whose mtime changed.
+    """
+
+    def __init__(self, folders, settle_seconds=5.0, use_inotify=True):
+        self.folders = [os.path.abspath(folder) for folder in folders]
+        self.settle_seconds = settle_seconds
+        self.dir_mtimes = {}
+        # path -> [size, mtime_ns, time of last change, time first seen]
+        self.pending = {}
+        # folder -> {file name: (size, mtime_ns)} of files already dispatched
+        self.processed = {}
+        self.inotify = None
+        if use_inotify and sys.platform.startswith("linux"):
+            try:
+                self.inotify = Inotify()
+            except (OSError, AttributeError) as e:
+                print(f"inotify unavailable, falling back to polling: {e}")
+
+    @property
+    def mode(self):
+        return "inotify" if self.inotify is not None else "polling"
+
+    def is_candidate(self, path):
+        return path.lower().endswith(ARCHIVE_EXTENSIONS + MODEL_EXTENSIONS)
+
+    def scan_tree(self, top, now, queue_existing):
+        """Register every directory below top and note candidate files"""
+        stack = [top]
+        while stack:
+            folder = stack.pop()
+            try:
+                self.dir_mtimes[folder] = os.stat(folder).st_mtime_ns
+                if self.inotify is not None:
+                    self.inotify.add_watch(folder)
+                with os.scandir(folder) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            if entry.path not in self.dir_mtimes:
+                                stack.append(entry.path)
+                        elif queue_existing:
+                            self.note_file(entry.path, now)
+            except OSError as e:
+                print(f"Error scanning {folder}: {e}")
+                self.dir_mtimes.pop(folder, None)
+
+    def start(self, catch_up=True):
+        now = time.time()
+        for folder in self.folders:
+            self.scan_tree(folder, now, catch_up)
+        print(f"Watching {len(self.dir_mtimes)} folders ({self.mode}), "
+              f"{len(self.pending)} files queued from existing content")
+
+    def note_file(self, path, now):
+        if not self.is_candidate(path) or path in self.pending:
+            return
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+        signature = (st.st_size, st.st_mtime_ns)
+        folder, name = os.path.split(path)
+        if self.processed.get(folder, {}).get(name) == signature:
+            return
+        self.pending[path] = [st.st_size, st.st_mtime_ns, now, now]
+
+    def mark_processed(self, path, size, mtime_ns):
+        folder, name = os.path.split(path)
+        self.processed.setdefault(folder, {})[name] = (size, mtime_ns)
+
+    def forget(self, path):
+        """Drop a deleted or moved file, or a whole folder tree, from the processed records"""
+        folder, name = os.path.split(path)
+        files = self.processed.get(folder)
+        if files is not None:
+            files.pop(name, None)
+            if not files:
+                del self.processed[folder]
+        prefix = os.path.join(path, "")
+        for known in [known for known in self.processed if known == path or known.startswith(prefix)]:
+            del self.processed[known]
+        for known in [known for known in self.dir_mtimes if known == path or known.startswith(prefix)]:
+            del self.dir_mtimes[known]
+
+    def poll_directories(self, now):
+        """Re-list only directories whose mtime changed since the last poll"""
+        for folder, mtime_ns in list(self.dir_mtimes.items()):
+            if folder not in self.dir_mtimes:
+                # Removed by forget() along with its deleted parent
+                continue
+            try:
+                current = os.stat(folder).st_mtime_ns
+            except OSError:
+                self.forget(folder)
+                continue
+            if current == mtime_ns:
+                continue
+            self.dir_mtimes[folder] = current
+            names = set()
+            try:
+                with os.scandir(folder) as it:
+                    for entry in it:
+                        names.add(entry.name)
+                        if entry.is_dir(follow_symlinks=False):
+                            if entry.path not in self.dir_mtimes:
+                                self.scan_tree(entry.path, now, True)
+                        else:
+                            self.note_file(entry.path, now)
+            except OSError as e:
+                print(f"Error scanning {folder}: {e}")
+                continue
+            for name in set(self.processed.get(folder, ())) - names:
+                self.forget(os.path.join(folder, name))
+
+    def wait_for_changes(self, timeout):
+        if self.inotify is None:
+            time.sleep(timeout)
+            self.poll_directories(time.time())
+            return
+        events = self.inotify.read_events(timeout)
+        now = time.time()
+        for path, mask in events:
+            if path is None:
+                # Event queue overflowed: fall back to one mtime poll
+                self.poll_directories(now)
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                self.forget(path)
+            elif mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self.scan_tree(path, now, True)
+            else:
+                self.note_file(path, now)
+
+    def ready_files(self):
+        """Return (path, size, mtime_ns, first seen) for files unchanged for settle_seconds"""
+        now = time.time()
+        ready = []
+        for path, record in list(self.pending.items()):
+            try:
+                st = os.stat(path)
+            except OSError:
+                del self.pending[path]
+                continue
+            if (st.st_size, st.st_mtime_ns) != (record[0], record[1]):
+                record[0], record[1], record[2] = st.st_size, st.st_mtime_ns, now
+            elif now - record[2] >= self.settle_seconds:
+                del self.pending[path]
+                ready.append((path, st.st_size, st.st_mtime_ns, record[3]))
+        return ready
+
+    def close(self):
+        if self.inotify is not None:
+            self.inotify.close()
+
+class CatalogDaemon:
+    """
+    Extracts new archives and renders new models from watched drop folders
+    """
+
+    def __init__(self, folders, max_workers=4, settle_seconds=5.0, use_inotify=True,
+                 status_path=None, status_interval=30.0):
+        self.watcher = DropFolderWatcher(folders, settle_seconds, use_inotify)
+        self.pipeline = Pipeline(max_workers)
+        self.tuner = None
+        self.extractor = ThreadPoolExecutor(max_workers=2)
+        self.status_path = status_path
+        self.status_interval = status_interval
+        self.lock = threading.Lock()
+        self.stop_requested = False
+        self.started = time.time()
+        self.counters = collections.Counter()
+        self.extracting = 0
+        self.rendering = 0
+        self.recent_renders = collections.deque()
+        self.latencies = collections.deque(maxlen=100)
+        self.peaks = collections.deque(maxlen=100)
+
+    def stats(self):
+        """Return queue depth and throughput counters"""
+        now = time.time()
+        with self.lock:
+            while self.recent_renders and now - self.recent_renders[0] > 60:
+                self.recent_renders.popleft()
+            latencies = sorted(self.latencies)
+            peaks = sorted(self.peaks)
+            return {
+                "mode": self.watcher.mode,
+                "uptime_seconds": round(now - self.started, 1),
+                "queue_depth": len(self.watcher.pending) + self.extracting + self.rendering,
+                "waiting_to_settle": len(self.watcher.pending),
+                "extracting": self.extracting,
+                "rendering": self.rendering,
+                "render_workers": self.pipeline.executor.max_workers if self.pipeline.executor else 0,
+                "archives_extracted": self.counters["archives_extracted"],
+                "models_rendered": self.counters["models_rendered"],
+                "errors": self.counters["errors"],
+                "models_per_second": round(len(self.recent_renders) / 60.0, 3),
+                "median_latency_seconds": round(latencies[len(latencies) // 2], 1) if latencies else None,
+                "median_peak_rss_mb": round(peaks[len(peaks) // 2]) if peaks else None,
+                "max_peak_rss_mb": round(peaks[-1]) if peaks else None,
+            }
+
+    def report(self):
+        stats = self.stats()
+        print(f"[status] queue={stats['queue_depth']} extracting={stats['extracting']} "
+              f"rendering={stats['rendering']} rendered={stats['models_rendered']} "
+              f"archives={stats['archives_extracted']} errors={stats['errors']} "
+              f"rate={stats['models_per_second']}/s")
+        if self.status_path:
+            temp_path = self.status_path + ".tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(stats, f, indent=2)
+            os.replace(temp_path, self.status_path)
+
+    def extract(self, path):
+        if path.lower().endswith('.7z'):
+            script7zextract.extract_7z_and_delete(path)
+        else:
+            scriptunzipmultirar.extract_and_delete(path)
+        return not os.path.exists(path)
+
+    def on_extracted(self, path, future):
+        with self.lock:
+            self.extracting -= 1
+            try:
+                if future.result():
+                    self.counters["archives_extracted"] += 1
+                else:
+                    self.counters["errors"] += 1
+            except Exception as e:
+                print(f"Error extracting {path}: {e}")
+                self.counters["errors"] += 1
+
+    def on_rendered(self, path, size, first_seen, future):
+        now = time.time()
+        with self.lock:
+            self.rendering -= 1
+            try:
+                message, _ = future.result()
+                print(message)
+                self.counters["models_rendered"] += 1
+                self.recent_renders.append(now)
+                self.latencies.append(now - first_seen)
+                if getattr(future, "peak_rss_mb", None) is not None:
+                    self.peaks.append(future.peak_rss_mb)
+                progress.item_done("render", path, size)
+            except Exception as e:
+                print(f"Error rendering {path}: {e}")
+                self.counters["errors"] += 1
+                progress.error("render", str(e), path)
+                progress.item_done("render", path, size, ok=False)
+
+    def dispatch(self, path, size, mtime_ns, first_seen):
+        import stlphoto18
+        self.watcher.mark_processed(path, size, mtime_ns)
+        if path.lower().endswith(ARCHIVE_EXTENSIONS):
+            print(f"New archive: {path}")
+            with self.lock:
+                self.extracting += 1
+            future = self.extractor.submit(self.extract, path)
+            future.add_done_callback(lambda f: self.on_extracted(path, f))
+            return
+
+        views = stlphoto18.missing_views(path)
+        if not views:
+            return
+        print(f"New model: {path}")
+        try:
+            self.start_pool()
+            future = self.pipeline.executor.submit(stlphoto18.process_one_file_in_subprocess, path, views)
+        except (RuntimeError, OSError) as e:
+            # The pool was shut down or could not start; it is recreated on the next dispatch
+            print(f"Could not queue {path}, retrying: {e}")
+            self.pipeline.executor = None
+            with self.lock:
+                self.counters["errors"] += 1
+            self.watcher.forget(path)
+            self.watcher.note_file(path, time.time())
+            return
+        with self.lock:
+            self.rendering += 1
+        future.add_done_callback(lambda f: self.on_rendered(path, size, first_seen, f))
+
+    def start_pool(self):
+        """Start the render pool, or a new one after terminate(), with its tuner"""
+        executor = self.pipeline.executor
+        self.pipeline.start()
+        if self.pipeline.executor is not executor and self.pipeline.max_workers == AUTO:
+            if self.tuner is not None:
+                self.tuner.stop()
+            self.tuner = AutoTuner(self.pipeline.executor).start()
+
+    def run(self, catch_up=True, tick=1.0):
+        self.start_pool()
+        self.watcher.start(catch_up)
+        last_report = 0.0
+        try:
+            while not self.stop_requested:
+                self.watcher.wait_for_changes(tick)
+                for ready in self.watcher.ready_files():
+                    self.dispatch(*ready)
+                if time.time() - last_report >= self.status_interval:
+                    self.report()
+                    last_report = time.time()
+        except KeyboardInterrupt:
+            print("Ctrl-C pressed. Stopping watcher...")
+        finally:
+            self.extractor.shutdown(wait=True)
+            if self.tuner is not None:
+                self.tuner.stop()
+                print(self.tuner.report())
+            self.pipeline.close()
+            self.watcher.close()
+            self.report()
+
+def main():
+    args = sys.argv[1:]
+    options = {"--workers": "4", "--settle": "5", "--status": None, "--status-interval": "30"}
+    flags = {"--polling": False, "--no-catch-up": False}
+    folders = []
+    i = 0
+    while i < len(args):
+        if args[i] in options and i + 1 < len(args):
+            options[args[i]] = args[i + 1]
+            i += 2
+        elif args[i] in flags:
+            flags[args[i]] = True
+            i += 1
+        else:
+            folders.append(args[i])
+            i += 1
+
+    if not folders:
+        print("Usage: python watchfolder.py <folder> [<folder> ...] [--workers N|auto] [--settle SECONDS]")
+        print("       [--status FILE] [--status-interval SECONDS] [--polling] [--no-catch-up]")
+        return 1
+    for folder in folders:
+        if not os.path.isdir(folder):
+            print(f"Error: {folder} is not a valid directory")
+            return 1
+
+    try:
+        daemon = CatalogDaemon(folders,
+                               max_workers=parse_worker_count(options["--workers"]),
+                               settle_seconds=float(options["--settle"]),
+                               use_inotify=not flags["--polling"],
+                               status_path=options["--status"],
+                               status_interval=float(options["--status-interval"]))
+    except ValueError as e:
+        print(f"Error: {e}")
+        return 1
+    signal.signal(signal.SIGTERM, lambda signum, frame: setattr(daemon, "stop_requested", True))
+    daemon.run(catch_up=not flags["--no-catch-up"])
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())